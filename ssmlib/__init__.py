@@ -13,4 +13,4 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-__all__ = ["backends", "misc", "main", "problem"]
+__all__ = ["backends", "dm", "misc", "main", "problem"]
@@ -14,3 +14,77 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 __all__ = ["lvm", "btrfs", "crypt", "multipath"]
+
+# Registry of the backends. Backend modules are imported only when they are
+# enabled and the information they provide is needed.
+
+import os
+import importlib
+
+# Backends to use, all of them by default
+try:
+    SSM_BACKENDS = [name.strip() for name in
+                    os.environ['SSM_BACKENDS'].split(",") if name.strip()]
+except KeyError:
+    SSM_BACKENDS = None
+
+# Classes providing pools, devices, volumes and snapshots for every kind
+# of storage. Every entry is (name, backend module, class, description),
+# the description is used in the warning when the backend fails.
+REGISTRY = {
+    'pool': [('lvm', 'lvm', 'VgsInfo', "LVM pools"),
+             ('thin', 'lvm', 'ThinPool', "thin pools"),
+             ('btrfs', 'btrfs', 'BtrfsPool', "btrfs pools"),
+             ('crypt', 'crypt', 'DmCryptPool', "crypt pools")],
+    'dev': [('lvm', 'lvm', 'PvsInfo', "LVM physical volumes"),
+            ('btrfs', 'btrfs', 'BtrfsDev', "btrfs devices"),
+            ('md', 'md', 'MdRaidDevice', "MD devices"),
+            ('crypt', 'crypt', 'DmCryptDevice', "crypt devices"),
+            ('multipath', 'multipath', 'MultipathDevice',
+             "multipath devices")],
+    'vol': [('lvm', 'lvm', 'LvsInfo', "LVM volumes"),
+            ('crypt', 'crypt', 'DmCryptVolume', "crypt volumes"),
+            ('btrfs', 'btrfs', 'BtrfsVolume', "btrfs volumes"),
+            ('md', 'md', 'MdRaidVolume', "md raid volumes")],
+    'snap': [('lvm', 'lvm', 'SnapInfo', "LVM snapshots"),
+             ('btrfs', 'btrfs', 'BtrfsSnap', "btrfs snapshots")],
+}
+
+
+def register(kind, name, module, cls, description):
+    """ Add a backend class providing 'kind' of information (pool, dev, vol
+        or snap). 'module' is either the name of a module in ssmlib.backends
+        or a full module path.
+    """
+    REGISTRY[kind].append((name, module, cls, description))
+
+
+def is_enabled(module):
+    """ Return True if the backend module is allowed by SSM_BACKENDS. """
+    if SSM_BACKENDS is None:
+        return True
+    return module.split(".")[-1] in SSM_BACKENDS
+
+
+def get_module(module):
+    """ Import the backend module and return it. """
+    if "." not in module:
+        module = "{0}.{1}".format(__name__, module)
+    return importlib.import_module(module)
+
+
+def get_backends(kind, modules=None):
+    """ Return the list of (name, class, description) of all the enabled
+        backends providing 'kind' of information, importing only modules
+        of those backends. When 'modules' are given, only backends from
+        those modules are returned.
+    """
+    backends = []
+    for name, module, cls, description in REGISTRY[kind]:
+        if not is_enabled(module):
+            continue
+        if modules is not None and module.split(".")[-1] not in modules:
+            continue
+        backends.append((name, getattr(get_module(module), cls),
+                         description))
+    return backends
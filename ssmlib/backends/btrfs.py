@@ -38,38 +38,66 @@ def get_btrfs_version():
         version = "0.0"
     return float(version)
 
-BTRFS_VERSION = get_btrfs_version()
-
-
-class Btrfs(template.Backend):
-
-    def __init__(self, *args, **kwargs):
-        super(Btrfs, self).__init__(*args, **kwargs)
-        self.type = 'btrfs'
-        self.default_pool_name = SSM_BTRFS_DEFAULT_POOL
-        self._vol = {}
-        self._pool = {}
-        self._dev = {}
-        self._snap = {}
-        self._subvolumes = {}
-        self._binary = misc.check_binary('btrfs')
-        self.modified_list_version = True
-
-        if not self._binary:
-            return
-
-        self.mounts = misc.get_mounts('btrfs')
+# Probed on the first use, see btrfs_version()
+BTRFS_VERSION = None
+
+
+def btrfs_version():
+    global BTRFS_VERSION
+    if BTRFS_VERSION is None:
+        BTRFS_VERSION = misc.get_capabilities().get('btrfs', 'version',
+                                                    get_btrfs_version,
+                                                    failed=0.0)
+    return BTRFS_VERSION
+
+
+def get_btrfs_topology():
+    """ Return BtrfsTopology shared by all the btrfs backends. It is kept
+        in the system snapshot until invalidate_btrfs_topology() is called.
+    """
+    return misc.get_snapshot().cached('btrfs_topology', BtrfsTopology)
+
+
+def invalidate_btrfs_topology():
+    misc.get_snapshot().invalidate('btrfs_topology')
+
+
+def _copy_items(items):
+    return dict([(name, item.copy()) for name, item in items.items()])
+
+
+class BtrfsTopology(object):
+    """
+    Btrfs file systems, their devices and subvolumes. 'btrfs filesystem
+    show' is parsed only once and subvolumes of every mounted file system
+    are listed only once, no matter how many btrfs backends are asking.
+    Backends should work with copies of the items since they modify them.
+    """
+
+    def __init__(self):
+        self.vol = {}
+        self.pool = {}
+        self.dev = {}
+        self._subvolume_lists = {}
+
+        snapshot = misc.get_snapshot()
+        self.mounts = dict([(dev, mount) for dev, mount in
+                            snapshot.mounts.items()
+                            if mount.get('fs', 'btrfs') == 'btrfs'])
+        # Subvolume mounts are stored as <device>:<subvolume>, remember the
+        # first one of every device so we do not need to search for it
+        self.subvolume_mounts = {}
+        for dev_i in self.mounts:
+            if ':/' in dev_i:
+                self.subvolume_mounts.setdefault(dev_i.split(':/')[0], dev_i)
         command = ['btrfs', 'filesystem', 'show']
         self.output = misc.run(command, stderr=False)[1]
 
         vol = {}
         pool = {}
         dev = {}
-        partitions = {}
         fs_size = pool_size = fs_used = 0
         pool_name = ''
-        for line in misc.get_partitions():
-            partitions[line[3]] = line
 
         for line in self.output.strip().split("\n"):
             if not line:
@@ -96,12 +124,9 @@ class Btrfs(template.Backend):
                         pool['mount'] = self.mounts[vol['real_dev']]['mp']
                         vol['mount'] = self.mounts[vol['real_dev']]['mp']
 
-                    else:
-                        for dev_i in self.mounts:
-                            found = re.findall(r'{0}:/.*'.format(vol['real_dev']), dev_i)
-                            if found:
-                                pool['mount'] = self.mounts[found[0]]['mp']
-                                break
+                    elif vol['real_dev'] in self.subvolume_mounts:
+                        found = self.subvolume_mounts[vol['real_dev']]
+                        pool['mount'] = self.mounts[found]['mp']
                 except OSError:
                     # udev is "hard-to-work-with" sometimes so this is fallback
                     vol['real_dev'] = ""
@@ -122,7 +147,7 @@ class Btrfs(template.Backend):
                 # real usage
                 if not os.path.islink(array[7]):
                     array[7] = re.sub(r'.*/dev/', '/dev/', array[7])
-                dev['dev_name'] = misc.get_real_device(array[7])
+                dev['dev_name'] = snapshot.get_real_device(array[7])
 
                 if not pool_name:
                     pool_name = self._find_uniq_pool_name(label, array[7])
@@ -137,68 +162,124 @@ class Btrfs(template.Backend):
                         if 'root' in self.mounts[dev['dev_name']]:
                             if self.mounts[dev['dev_name']]['root'] == '/':
                                 vol['mount'] = self.mounts[dev['dev_name']]['mp']
-                    else:
-                        for dev_i in self.mounts:
-                            found = re.findall(r'{0}:/.*'.format(dev['dev_name']), dev_i)
-                            if found:
-                                pool['mount'] = self.mounts[found[0]]['mp']
-                                vol['real_dev'] = found[0].split(':')[0]
-                                break
+                    elif dev['dev_name'] in self.subvolume_mounts:
+                        found = self.subvolume_mounts[dev['dev_name']]
+                        pool['mount'] = self.mounts[found]['mp']
+                        vol['real_dev'] = dev['dev_name']
 
                 dev_used = float(misc.get_real_size(array[5]))
                 dev['dev_used'] = str(dev_used)
                 fs_size += float(misc.get_real_size(array[3]))
 
                 dev_size = \
-                    int(partitions[dev['dev_name']][2])
+                    int(snapshot.get_partition(dev['dev_name'])[2])
                 pool_size += dev_size
                 dev['dev_free'] = dev_size - dev_used
                 dev['hide'] = False
-                self._dev[dev['dev_name']] = dev
+                self.dev[dev['dev_name']] = dev
                 dev = {}
 
         if len(vol) > 0:
             self._store_data(vol, pool, fs_used, fs_size, pool_size, pool_name)
 
+    def list_subvolumes(self, mount, list_snapshots=False):
+        key = (mount, list_snapshots)
+        if key not in self._subvolume_lists:
+            self._subvolume_lists[key] = self._list_subvolumes(mount,
+                                                               list_snapshots)
+        return self._subvolume_lists[key]
+
+    def _list_subvolumes(self, mount, list_snapshots=False):
+        capabilities = misc.get_capabilities()
+        # Old versions of btrfs do not know the '-a' option
+        list_all = capabilities.get('btrfs', 'subvolume list -a')
+        command = ['btrfs', 'subvolume', 'list']
+        options = [mount]
+        if list_snapshots:
+            options.insert(0, '-s')
+        if list_all is not False:
+            ret, output, err = misc.run(command + ['-a'] + options,
+                                        stdout=False, can_fail=True)
+            if not ret:
+                capabilities.set('btrfs', 'subvolume list -a', True)
+                return output
+        output = misc.run(command + options, stdout=False)[1]
+        if list_all is None:
+            capabilities.set('btrfs', 'subvolume list -a', False)
+        return output
+
+    def _find_uniq_pool_name(self, label, dev):
+        if len(label) < 3 or label == "none":
+            label = "btrfs_{0}".format(os.path.basename(dev))
+        if label not in self.pool:
+            return label
+        return os.path.basename(dev)
+
+    def _store_data(self, vol, pool, fs_used, fs_size, pool_size, pool_name):
+        vol['fs_type'] = 'btrfs'
+        vol['fs_used'] = pool['pool_used'] = str(fs_used)
+        vol['fs_free'] = str(fs_size - fs_used)
+        vol['fs_size'] = vol['vol_size'] = str(fs_size)
+        pool['pool_free'] = str(pool_size - fs_used)
+        pool['pool_size'] = pool_size
+        pool['pool_name'] = vol['pool_name'] = vol['dev_name'] = pool_name
+        pool['type'] = 'btrfs'
+        vol['type'] = 'btrfs'
+
+        self.pool[pool['pool_name']] = pool
+        self.vol[vol['dev_name']] = vol
+
+
+class Btrfs(template.Backend):
+
+    def __init__(self, *args, **kwargs):
+        super(Btrfs, self).__init__(*args, **kwargs)
+        self.type = 'btrfs'
+        self.default_pool_name = SSM_BTRFS_DEFAULT_POOL
+        self._vol = {}
+        self._pool = {}
+        self._dev = {}
+        self._snap = {}
+        self._subvolumes = {}
+        self._binary = misc.check_binary('btrfs')
+
+        if not self._binary:
+            return
+
+        self.topology = get_btrfs_topology()
+        self.mounts = self.topology.mounts
+        # Skip file systems which are not asked about, so we do not list
+        # their subvolumes
+        self._vol = _copy_items(self._in_scope(self.topology.vol))
+        self._pool = _copy_items(self._in_scope(self.topology.pool))
+        self._dev = _copy_items(self._in_scope(self.topology.dev))
+
+    def _in_scope(self, items):
+        if not self.pool_filter:
+            return items
+        return dict([(name, item) for name, item in items.items()
+                     if self.in_scope(item.get('pool_name'))])
+
     def run_btrfs(self, command):
         if not self._binary:
             self.problem.check(self.problem.TOOL_MISSING, 'btrfs')
         command.insert(0, "btrfs")
+        invalidate_btrfs_topology()
         return misc.run(command, stdout=True)
 
     def _list_subvolumes(self, mount, list_snapshots=False):
-        command = ['btrfs', 'subvolume', 'list']
-        if self.modified_list_version:
-            command.append('-a')
-        if list_snapshots:
-            command.append('-s')
-        ret, output, err = misc.run(command + [mount], stdout=False,
-                                    can_fail=True)
-        if ret:
-            command = ['btrfs', 'subvolume', 'list']
-            if list_snapshots:
-                command.append('-s')
-            output = misc.run(command + [mount], stdout=False)[1]
-            self.modified_list_version = False
-        return output
+        return self.topology.list_subvolumes(mount, list_snapshots)
 
     # There is no way in btrfs to list subvolumes which are not snapshots
     # so we have to get the list of snapshots to filter it out from
     # regular subvolume list so we do not have it in the output twice.
     # Once in volume list and once in snapshot list.
     def _get_snap_name_list(self, mount):
-        snap = []
-        if BTRFS_VERSION < 0.20:
-            return snap
-        command = ['btrfs', 'subvolume', 'list', '-s', mount]
-        output = misc.run(command, stdout=False)[1]
-
-        for line in output.strip().split("\n"):
-            if not line:
-                continue
-            path = re.search('(?<=path ).*$', line).group(0)
-            snap.append(path)
-        return snap
+        if btrfs_version() < 0.20:
+            return []
+        # The same listing is used by BtrfsSnap, so it costs nothing here
+        output = self._list_subvolumes(mount, list_snapshots=True)
+        return [volume['path'] for volume in self._parse_subvolumes(output)]
 
     def _fill_subvolumes(self, list_snapshots=False):
         if not self._binary:
@@ -283,27 +364,6 @@ class Btrfs(template.Backend):
             volume['subvolume'] = True
             yield volume
 
-    def _find_uniq_pool_name(self, label, dev):
-        if len(label) < 3 or label == "none":
-            label = "btrfs_{0}".format(os.path.basename(dev))
-        if label not in self._pool:
-            return label
-        return os.path.basename(dev)
-
-    def _store_data(self, vol, pool, fs_used, fs_size, pool_size, pool_name):
-        vol['fs_type'] = 'btrfs'
-        vol['fs_used'] = pool['pool_used'] = str(fs_used)
-        vol['fs_free'] = str(fs_size - fs_used)
-        vol['fs_size'] = vol['vol_size'] = str(fs_size)
-        pool['pool_free'] = str(pool_size - fs_used)
-        pool['pool_size'] = pool_size
-        pool['pool_name'] = vol['pool_name'] = vol['dev_name'] = pool_name
-        pool['type'] = 'btrfs'
-        vol['type'] = 'btrfs'
-
-        self._pool[pool['pool_name']] = pool
-        self._vol[vol['dev_name']] = vol
-
     def _remove_filesystem(self, name):
         if 'mount' in self._vol[name]:
             if self.problem.check(self.problem.FS_MOUNTED,
@@ -447,12 +507,11 @@ class BtrfsPool(Btrfs, template.BackendPool):
         behaviour and options without bumping version number. So we have
         to check whether btrfs allows to 'force' file system creation.
         """
-        output = misc.run(command + ['--force'], can_fail=True)[1]
-        found = re.search('invalid option', output)
-        if found:
-            return False
-        else:
-            return True
+        def probe():
+            output = misc.run(command + ['--force'], can_fail=True)[1]
+            return not re.search('invalid option', output)
+        return misc.get_capabilities().get(
+            command[0], " ".join(command[1:] + ['--force']), probe)
 
     def _create_filesystem(self, pool, name, devs, size=None, options=None):
         options = options or {}
@@ -485,9 +544,10 @@ class BtrfsPool(Btrfs, template.BackendPool):
         # have tried to remove the device from the respective pool already.
         # So at this point there should not be any useful signatures to
         # speak of. However as I mentioned btrfs is broken, so force it.
-        if self._can_btrfs_force(command):
+        if self._can_btrfs_force(['mkfs.btrfs']):
             command.extend(['--force'])
         command.extend(devs)
+        invalidate_btrfs_topology()
         misc.run(command, stdout=True)
         misc.udev_checkpoint(devs)
         return name
@@ -617,7 +677,7 @@ class BtrfsSnap(Btrfs):
 
         self._fill_subvolumes(list_snapshots=True)
         for (name, vol) in self._subvolumes.items():
-            if BTRFS_VERSION < 0.20:
+            if btrfs_version() < 0.20:
                 if 'snap_name' in vol:
                     self._snap[vol['snap_name']] = vol.copy()
                     self._snap[vol['snap_name']]['hide'] = False
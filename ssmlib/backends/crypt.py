@@ -21,6 +21,7 @@ import stat
 import tempfile
 from ssmlib import misc
 from ssmlib import problem
+from ssmlib import dm as dm_module
 from ssmlib.backends import template
 
 __all__ = ["DmCryptVolume"]
@@ -53,19 +54,28 @@ def get_cryptsetup_version():
     try:
         output = misc.run(['cryptsetup', '--version'], can_fail=True)[1]
         version = list(map(int, output.strip().split()[-1].split('.', 3)))
-    except (OSError, AttributeError):
+    except (OSError, AttributeError, IndexError, ValueError):
         version = [0, 0, 0]
     return version
 
-CRYPTSETUP_VERSION = get_cryptsetup_version()
+# Probed on the first use, see cryptsetup_version()
+CRYPTSETUP_VERSION = None
+
+
+def cryptsetup_version():
+    global CRYPTSETUP_VERSION
+    if CRYPTSETUP_VERSION is None:
+        CRYPTSETUP_VERSION = misc.get_capabilities().get(
+            'cryptsetup', 'version', get_cryptsetup_version,
+            failed=[0, 0, 0])
+    return CRYPTSETUP_VERSION
 
 
 class DmObject(template.Backend):
     def __init__(self, *args, **kwargs):
         super(DmObject, self).__init__(*args, **kwargs)
         self.type = 'crypt'
-        self.mounts = misc.get_mounts('{0}/mapper'.format(DM_DEV_DIR))
-        self.swaps = misc.get_swaps()
+        self.system_snapshot = misc.get_snapshot()
         self.default_pool_name = SSM_CRYPT_DEFAULT_POOL
 
         if not misc.check_binary('dmsetup') or \
@@ -112,7 +122,7 @@ class DmCryptPool(DmObject, template.BackendPool):
 
     def create(self, pool, size=None, name=None, devs=None,
                options=None):
-        if CRYPTSETUP_VERSION < [1, 6, 0]:
+        if cryptsetup_version() < [1, 6, 0]:
             msg = "You need at least cryptsetup version " + \
                   "{0}. Creating encrypted volumes".format('1.6.0')
             self.problem.check(self.problem.NOT_SUPPORTED, msg)
@@ -176,40 +186,76 @@ class DmCryptVolume(DmObject, template.BackendVolume):
 
     def __init__(self, *args, **kwargs):
         super(DmCryptVolume, self).__init__(*args, **kwargs)
+        if not self.in_scope(self.default_pool_name):
+            return
 
+        tables = self.system_snapshot.dm_tables
+        if tables is None:
+            self._parse_dmsetup()
+            return
+
+        for table in tables:
+            if not table['targets'] or \
+               table['targets'][0]['type'] != 'crypt':
+                continue
+            target = table['targets'][0]
+            dm = self._new_volume(table['name'], target['length'],
+                                  table['major'], table['minor'])
+            if not dm:
+                continue
+            dm['cipher'], dm['keysize'], device = \
+                dm_module.parse_crypt_params(target['params'])
+            if ':' in device:
+                major, minor = device.split(':')
+                device = self.system_snapshot.get_device_by_number(
+                    major, minor) or device
+            dm['crypt_device'] = device
+            self.data[dm['dev_name']] = dm
+
+    def _new_volume(self, name, sectors, major=None, minor=None):
+        """ Create volume data for the crypt mapping 'name' which is
+            'sectors' long. Return None if the device does not exist.
+            The device number is used to find the device and its mount
+            when known.
+        """
+        dm = {}
+        dm['type'] = 'crypt'
+        dm['vol_size'] = str(int(sectors) / 2.0)
+        devname = "{0}/mapper/{1}".format(DM_DEV_DIR, name)
+        dm['dm_name'] = devname
+        dm['pool_name'] = self.default_pool_name
+        dm['dev_name'] = devname
+        dm['real_dev'] = self.system_snapshot.get_real_device(devname, major,
+                                                              minor)
+        mount = self.system_snapshot.get_mount(dm['real_dev'], major, minor)
+        if mount:
+            dm['mount'] = mount['mp']
+        elif self.system_snapshot.is_swap(dm['real_dev'], major, minor):
+            dm['mount'] = "SWAP"
+
+        # Check if the device really exists in the system. In some cases
+        # (tests) DM_DEV_DIR can lie to us, if that is the case, simple
+        # ignore the device.
+        if not os.path.exists(devname):
+            return None
+        return dm
+
+    def _parse_dmsetup(self):
+        """ Fallback for when we can not ask device mapper directly. """
         command = ['dmsetup', 'table']
         self.output = misc.run(command, stderr=False)[1]
         for line in self.output.split("\n"):
             if not line or line == "No devices found":
                 break
-            dm = {}
             array = line.split()
             if len(array) == 1:
                 continue
-            dm['type'] = array[3]
-            if dm['type'] != 'crypt':
+            if array[3] != 'crypt':
                 continue
-            dm['vol_size'] = str(int(array[2]) / 2.0)
-            devname = re.sub(":$", "",
-                             "{0}/mapper/{1}".format(DM_DEV_DIR, array[0]))
-            dm['dm_name'] = devname
-            dm['pool_name'] = self.default_pool_name
-            dm['dev_name'] = devname
-            dm['real_dev'] = misc.get_real_device(devname)
-            if dm['real_dev'] in self.mounts:
-                dm['mount'] = self.mounts[dm['real_dev']]['mp']
-            else:
-                for swap in self.swaps:
-                    if swap[0] == dm['real_dev']:
-                        dm['mount'] = "SWAP"
-                        break
-
-            # Check if the device really exists in the system. In some cases
-            # (tests) DM_DEV_DIR can lie to us, if that is the case, simple
-            # ignore the device.
-            if not os.path.exists(devname):
+            dm = self._new_volume(re.sub(":$", "", array[0]), array[2])
+            if not dm:
                 continue
-            command = ['cryptsetup', 'status', devname]
+            command = ['cryptsetup', 'status', dm['dev_name']]
             self._parse_cryptsetup(command, dm)
             self.data[dm['dev_name']] = dm
 
@@ -234,11 +280,17 @@ class DmCryptVolume(DmObject, template.BackendVolume):
             device = DM_DEV_DIR + "/" + name
             if not os.path.exists(device):
                 return None
-        device = misc.get_real_device(device)
+        device = self.system_snapshot.get_real_device(device)
         if device in self.data:
             return self.data[device]
         return None
 
+    def aliases(self, key):
+        names = [self.data[key].get('real_dev')]
+        if key.startswith(DM_DEV_DIR + "/"):
+            names.append(key[len(DM_DEV_DIR) + 1:])
+        return names
+
     def remove(self, dm):
         vol = self[dm]
         if 'mount' in vol:
@@ -254,17 +306,19 @@ class DmCryptDevice(DmObject, template.BackendDevice):
 
     def __init__(self, *args, **kwargs):
         super(DmCryptDevice, self).__init__(*args, **kwargs)
+        if not self.in_scope(self.default_pool_name):
+            return
 
-        for line in misc.get_partitions():
+        for line in self.system_snapshot.partitions:
             device = {}
             devname = line[3]
-            signature = misc.get_signature(devname)
+            signature = self.system_snapshot.get_signature(devname)
             if signature in CRYPT_SIGNATURES:
                 device['hide'] = False
                 device['dev_name'] = devname
                 device['pool_name'] = self.default_pool_name
                 device['dev_free'] = '0'
-                device['dev_used'] = str(misc.get_device_size(devname))
+                device['dev_used'] = str(line[2])
                 self.data[devname] = device
 
     def remove(self, devices):
@@ -18,6 +18,7 @@
 import re
 import os
 import stat
+import json
 import datetime
 from ssmlib import misc
 from ssmlib import problem
@@ -55,7 +56,47 @@ def get_lvm_version():
         version = [0, 0, 0]
     return version
 
-LVM_VERSION = get_lvm_version()
+# Probed on the first use, see lvm_version()
+LVM_VERSION = None
+
+
+def lvm_version():
+    global LVM_VERSION
+    if LVM_VERSION is None:
+        LVM_VERSION = misc.get_capabilities().get('lvm', 'version',
+                                                  get_lvm_version,
+                                                  failed=[0, 0, 0])
+    return LVM_VERSION
+
+# 'lvm fullreport' with json output is not available in older versions
+FULLREPORT_VERSION = [2, 2, 158]
+
+# Fields requested from lvm for each of the report types. Those are the
+# canonical lvm field names which are also used as keys in the report rows.
+REPORT_FIELDS = {
+    'vg': ['vg_name', 'pv_count', 'vg_size', 'vg_free', 'lv_count'],
+    'pv': ['pv_name', 'vg_name', 'pv_free', 'pv_used', 'pv_size'],
+    'lv': ['vg_name', 'lv_name', 'lv_uuid', 'lv_size', 'origin', 'lv_attr',
+           'pool_lv', 'snap_percent', 'data_percent', 'metadata_percent',
+           'thin_count', 'lv_kernel_major', 'lv_kernel_minor', 'lv_dm_path'],
+    'seg': ['lv_uuid', 'segtype', 'stripes', 'stripe_size'],
+}
+
+def get_lvm_report(vg=None):
+    """ Return LvmReport shared by all the lvm backends. The report is
+        gathered only once and it is kept in the system snapshot until
+        invalidate_lvm_report() is called. See LvmReport for 'vg'.
+    """
+    return misc.get_snapshot().cached('lvm_report', lambda: LvmReport(vg))
+
+
+def invalidate_lvm_report():
+    """ Drop the shared lvm report so the next backend will gather it again.
+        This needs to be called whenever the lvm configuration might have
+        changed.
+    """
+    misc.get_snapshot().invalidate('lvm_report')
+
 
 def create_thin_volume(parent_pool, thin_pool, virtsize, lvname):
     pool_volume = parent_pool + '/' + thin_pool
@@ -64,16 +105,130 @@ def create_thin_volume(parent_pool, thin_pool, virtsize, lvname):
     command = ['lvcreate', '-n', lvname, '-T', pool_volume,
                '-V', str(virtsize) + 'K']
     command.insert(0, "lvm")
+    invalidate_lvm_report()
     misc.run(command, stdout=True)
     return "{0}/{1}/{2}".format(DM_DEV_DIR, parent_pool, lvname)
 
 
+class LvmReport(object):
+    """
+    Information about all volume groups, physical volumes and logical volumes
+    in the system gathered with a single 'lvm fullreport' call, so we do not
+    have to rescan all the physical volumes for every lvm backend. Older lvm
+    versions do not have 'fullreport' and in that case we fall back to
+    running 'lvm vgs', 'lvm pvs' and 'lvm lvs' once each.
+
+    Rows are stored as dictionaries indexed by lvm field names. Logical
+    volume rows also contain fields of its volume group and its (last)
+    segment.
+
+    When 'vg' is given, only that volume group is asked about if lvm can
+    do that. If there is no such volume group, the name might be a thin
+    pool and the full report is gathered instead.
+    """
+
+    def __init__(self, vg=None):
+        self.vgs = []
+        self.pvs = []
+        self.lvs = []
+        version = lvm_version()
+        if version == [0, 0, 0] or version >= FULLREPORT_VERSION:
+            if vg and self._load_fullreport([vg]) and self.vgs:
+                return
+            self.vgs, self.pvs, self.lvs = [], [], []
+            if self._load_fullreport():
+                return
+        self._load_legacy()
+
+    @staticmethod
+    def _run(command):
+        ret, output, err = misc.run(command, stderr=False, can_fail=True)
+        # A workaround for LVM behaviour:
+        # lvm exit code is 5 on exported volumes, even if everything
+        # is ok. So, if the code is 5 and error message says that a volume
+        # was exported, ignore the error
+        if ret == 5 and str(err).endswith('is exported\n'):
+            ret = 0
+        return ret, output, err
+
+    def _load_fullreport(self, vgs=None):
+        """ Parse the output of 'lvm fullreport', optionally for the volume
+            groups 'vgs' only. Return False if the report can not be used
+            and we should fall back to separate commands.
+        """
+        command = ["lvm", "fullreport", "--reportformat", "json",
+                   "--nosuffix", "--units", "k"]
+        for report in ['vg', 'pv', 'lv', 'seg']:
+            command.extend(["--configreport", report, "-o",
+                            ",".join(REPORT_FIELDS[report])])
+        command.extend(vgs or [])
+        ret, output, err = self._run(command)
+        if ret != 0:
+            return False
+        if not output or not output.strip():
+            return True
+        try:
+            report = json.loads(output)['report']
+        except (ValueError, KeyError, TypeError):
+            return False
+
+        # Every volume group comes in its own section. Orphan physical
+        # volumes come in a section without any volume group.
+        for section in report:
+            vg = {}
+            for row in section.get('vg', []):
+                vg = row
+                self.vgs.append(row)
+            self.pvs.extend(section.get('pv', []))
+            segs = {}
+            for seg in section.get('seg', []):
+                segs[seg.get('lv_uuid')] = seg
+            for lv in section.get('lv', []):
+                row = dict(vg)
+                row.update(segs.get(lv.get('lv_uuid'), {}))
+                row.update(lv)
+                self.lvs.append(row)
+        return True
+
+    def _load_legacy(self):
+        """ Gather the same information with separate vgs, pvs and lvs
+            commands for lvm versions without 'fullreport'.
+        """
+        self.vgs = self._parse_legacy('vgs', REPORT_FIELDS['vg'])
+        self.pvs = self._parse_legacy('pvs', REPORT_FIELDS['pv'])
+        # Segment fields are reported directly by lvs
+        fields = REPORT_FIELDS['lv'] + ['pv_count'] + \
+                 [f for f in REPORT_FIELDS['seg'] if f != 'lv_uuid']
+        self.lvs = self._parse_legacy('lvs', fields)
+
+    def _parse_legacy(self, report, fields):
+        command = ["lvm", report, "--separator", "|", "--noheadings",
+                   "--nosuffix", "--units", "k", "-o", ",".join(fields)]
+        ret, output, err = self._run(command)
+        if ret != 0:
+            err_msg = "ERROR exit code {0} for running command: \"{1}\"".format(
+                      ret, " ".join(command))
+            if err is not None:
+                print(err)
+            raise problem.CommandFailed(err_msg, exitcode=ret)
+        rows = []
+        for line in (output or "").split("\n"):
+            if not line:
+                break
+            array = line.split("|")
+            rows.append(dict([(fields[index], array[index].strip())
+                              for index in range(min(len(array),
+                                                     len(fields)))]))
+        return rows
+
+
 class LvmInfo(template.Backend):
 
     def __init__(self, *args, **kwargs):
         super(LvmInfo, self).__init__(*args, **kwargs)
         self.type = 'lvm'
         self.attrs = []
+        self.fields = []
         self.binary = misc.check_binary('lvm')
         self.default_pool_name = SSM_LVM_DEFAULT_POOL
         self.init_local_problem_set()
@@ -99,38 +254,35 @@ class LvmInfo(template.Backend):
         if self.options.verbose:
             command.insert(1, "-v")
         command.insert(0, "lvm")
+        invalidate_lvm_report()
+        # pvcreate and friends change device signatures
+        misc.get_snapshot().invalidate('signatures')
         misc.run(command, stdout=True)
 
+    @property
+    def report(self):
+        vg = None
+        if self.pool_filter:
+            # Thin pools can be asked about as vg/pool
+            vg = self.pool_filter.split('/')[0]
+        return get_lvm_report(vg)
+
     def _data_index(self, row):
         return row.values()[len(row.values()) - 1]
 
     def _skip_data(self, row):
         return False
 
-    def _parse_data(self, command):
+    def _parse_data(self, rows):
+        """ Fill self.data from rows of the shared lvm report. self.fields
+            are lvm field names which are stored under the names from
+            self.attrs.
+        """
         if not self.binary:
             return
-        ret, self.output, err = misc.run(command, stderr=False, can_fail=True)
-        # A workaround for LVM behaviour:
-        # lvm lvs' exit code is 5 on exported volumes, even if everything
-        # is ok. So, if the code is 5, command was 'lvm lvs ...'
-        # and error message says that a volume was exported, ignore the
-        # error
-        if ret != 0:
-            err_msg = "ERROR exit code {0} for running command: \"{1}\"".format(
-                      ret, " ".join(command))
-            if ret != 5 or command[0:2] != ['lvm', 'lvs'] or \
-               not str(err).endswith('is exported\n'):
-                if err is not None:
-                    print(err)
-                raise problem.CommandFailed(err_msg, exitcode=ret)
-
-        for line in self.output.split("\n"):
-            if not line:
-                break
-            array = line.split("|")
-            row = dict([(self.attrs[index], array[index].lstrip())
-                       for index in range(len(array))])
+        for array in rows:
+            row = dict([(attr, str(array.get(field, '')).lstrip())
+                       for attr, field in zip(self.attrs, self.fields)])
             if self._skip_data(row):
                 continue
             self._fill_additional_info(row)
@@ -139,8 +291,32 @@ class LvmInfo(template.Backend):
     def _fill_additional_info(self, row):
         pass
 
+    def _fill_dm_name(self, lv):
+        # lvm reports device mapper path of active volumes, so we only need
+        # to look into sysfs if it is not available.
+        if lv.get('dm_path'):
+            lv['dm_name'] = lv['dm_path']
+            return
+        name = misc.get_snapshot().get_dm_name(lv.get('major'),
+                                               lv.get('minor'))
+        if name:
+            lv['dm_name'] = "{0}/mapper/{1}".format(DM_DEV_DIR, name)
+            return
+        sysfile = "/sys/block/{0}/dm/name".format(
+                  os.path.basename(lv['real_dev']))
+
+        # In some weird cases the "real" device might not be in /dev/dm-*
+        # form (see tests). In this case constructed sysfile will not exist
+        # so we just use real device name to search mounts.
+        try:
+            with open(sysfile, 'r') as f:
+                lvname = f.readline()[:-1]
+            lv['dm_name'] = "{0}/mapper/{1}".format(DM_DEV_DIR, lvname)
+        except IOError:
+            lv['dm_name'] = lv['real_dev']
+
     def supported_since(self, version, string):
-        if version > LVM_VERSION:
+        if version > lvm_version():
             msg = "ERROR: You need at least lvm version " + \
                   "{0}. Feature \"{1}\"".format(".".join(map(str, version)),
                                                 string)
@@ -160,14 +336,7 @@ class LvmInfo(template.Backend):
         # have it only as an optional dependency for lvm2 and if it is not installed,
         # lvm behaves strangely and can fail without any useful information
         # in middle of a sequence of commands SSM does.
-        found = False
-        for path in os.environ["PATH"].split(os.pathsep):
-            path = path.strip('"')
-            if os.path.isfile(os.path.join(path, 'thin_check')):
-                    found = True
-                    break
-
-        if not found:
+        if not misc.check_binary('thin_check'):
             msg = "ERROR: lvm does not have installed thin provisioning tools. " +\
                   "Some distributions mark it as an optional dependency for lvm2, " +\
                   "in which case, you need to install it manually"
@@ -180,13 +349,12 @@ class VgsInfo(LvmInfo, template.BackendPool):
 
     def __init__(self, *args, **kwargs):
         super(VgsInfo, self).__init__(*args, **kwargs)
-        command = ["lvm", "vgs", "--separator", "|", "--noheadings",
-                   "--nosuffix", "--units", "k", "-o",
-                   "vg_name,pv_count,vg_size,vg_free,lv_count"]
+        self.fields = ['vg_name', 'pv_count', 'vg_size', 'vg_free', 'lv_count']
         self.attrs = ['pool_name', 'dev_count', 'pool_size', 'pool_free',
                       'vol_count']
 
-        self._parse_data(command)
+        if self.binary:
+            self._parse_data(self.report.vgs)
 
     def _fill_additional_info(self, vg):
         vg['type'] = 'lvm'
@@ -371,16 +539,15 @@ class PvsInfo(LvmInfo, template.BackendDevice):
 
     def __init__(self, *args, **kwargs):
         super(PvsInfo, self).__init__(*args, **kwargs)
-        command = ["lvm", "pvs", "--separator", "|", "--noheadings",
-                   "--nosuffix", "--units", "k", "-o",
-                   "pv_name,vg_name,pv_free,pv_used,pv_size"]
+        self.fields = ['pv_name', 'vg_name', 'pv_free', 'pv_used', 'pv_size']
         self.attrs = ['dev_name', 'pool_name', 'dev_free',
                       'dev_used', 'dev_size']
 
-        self._parse_data(command)
+        if self.binary:
+            self._parse_data(self.report.pvs)
 
     def _data_index(self, row):
-        return misc.get_real_device(row['dev_name'])
+        return misc.get_snapshot().get_real_device(row['dev_name'])
 
     def _fill_additional_info(self, pv):
         pv['hide'] = False
@@ -403,15 +570,16 @@ class LvsInfo(LvmInfo, template.BackendVolume):
 
     def __init__(self, *args, **kwargs):
         super(LvsInfo, self).__init__(*args, **kwargs)
-        command = ["lvm", "lvs", "--separator", "|", "--noheadings",
-                   "--nosuffix", "--units", "k", "-o",
-                   "vg_name,lv_size,stripes,stripesize,segtype,lv_name,origin,lv_attr,pool_lv"]
+        self.fields = ['vg_name', 'lv_size', 'stripes', 'stripe_size',
+                       'segtype', 'lv_name', 'origin', 'lv_attr', 'pool_lv',
+                       'lv_kernel_major', 'lv_kernel_minor', 'lv_dm_path']
         self.attrs = ['pool_name', 'vol_size', 'stripes',
-                      'stripesize', 'type', 'lv_name', 'origin', 'attr', 'pool_lv']
+                      'stripesize', 'type', 'lv_name', 'origin', 'attr',
+                      'pool_lv', 'major', 'minor', 'dm_path']
         self.handle_fs = True
-        self.mounts = misc.get_mounts('{0}/mapper'.format(DM_DEV_DIR))
-        self.swaps = misc.get_swaps()
-        self._parse_data(command)
+        self.system_snapshot = misc.get_snapshot()
+        if self.binary:
+            self._parse_data(self.report.lvs)
 
     def _fill_additional_info(self, lv):
         lv['dev_name'] = "{0}/{1}/{2}".format(DM_DEV_DIR, lv['pool_name'],
@@ -425,28 +593,18 @@ class LvsInfo(LvmInfo, template.BackendVolume):
             lv['parent_pool'] = lv['pool_name']
             lv['pool_name'] = lv['pool_lv']
 
-        lv['real_dev'] = misc.get_real_device(lv['dev_name'])
+        # Active volumes are joined with the rest by the device number
+        number = (lv.get('major'), lv.get('minor'))
+        lv['real_dev'] = self.system_snapshot.get_real_device(lv['dev_name'],
+                                                              *number)
 
-        sysfile = "/sys/block/{0}/dm/name".format(
-                  os.path.basename(lv['real_dev']))
+        self._fill_dm_name(lv)
 
-        # In some weird cases the "real" device might not be in /dev/dm-*
-        # form (see tests). In this case constructed sysfile will not exist
-        # so we just use real device name to search mounts.
-        try:
-            with open(sysfile, 'r') as f:
-                lvname = f.readline()[:-1]
-            lv['dm_name'] = "{0}/mapper/{1}".format(DM_DEV_DIR, lvname)
-        except IOError:
-            lv['dm_name'] = lv['real_dev']
-
-        if lv['real_dev'] in self.mounts:
-            lv['mount'] = self.mounts[lv['real_dev']]['mp']
-        else:
-            for swap in self.swaps:
-                if swap[0] == lv['real_dev']:
-                    lv['mount'] = "SWAP"
-                    break
+        mount = self.system_snapshot.get_mount(lv['real_dev'], *number)
+        if mount:
+            lv['mount'] = mount['mp']
+        elif self.system_snapshot.is_swap(lv['real_dev'], *number):
+            lv['mount'] = "SWAP"
         self.parse_attr(lv, lv['attr'])
 
     def __getitem__(self, name):
@@ -459,16 +617,29 @@ class LvsInfo(LvmInfo, template.BackendVolume):
             device = DM_DEV_DIR + "/" + name
             if not os.path.exists(device):
                 return None
-        device = misc.get_real_device(device)
+        device = self.system_snapshot.get_real_device(device)
         if device in self.data:
             return self.data[device]
         return None
 
+    def aliases(self, key):
+        lv = self.data[key]
+        names = [lv.get('dev_name'), lv.get('dm_name')]
+        if lv.get('pool_name') and lv.get('lv_name'):
+            names.append("{0}/{1}".format(lv['pool_name'], lv['lv_name']))
+        # The names relative to DM_DEV_DIR __getitem__() accepts as well,
+        # like mapper/vg-lv, dm-3 or vg/lv. The last one is not the same
+        # as the above for thin volumes, their pool is the thin pool.
+        for name in [key, lv.get('dev_name'), lv.get('dm_name')]:
+            if name and name.startswith(DM_DEV_DIR + "/"):
+                names.append(name[len(DM_DEV_DIR) + 1:])
+        return names
+
     def _data_index(self, row):
         return row['real_dev']
 
     def _get_dev_name(self, lv):
-        real = misc.get_real_device(lv)
+        real = self.system_snapshot.get_real_device(lv)
         if real in self.data:
             return self.data[real]['dev_name']
         else:
@@ -526,16 +697,18 @@ class SnapInfo(LvmInfo):
 
     def __init__(self, *args, **kwargs):
         super(SnapInfo, self).__init__(*args, **kwargs)
-        command = ["lvm", "lvs", "--separator", "|", "--noheadings",
-                   "--nosuffix", "--units", "k", "-o",
-                   "vg_name,lv_size,stripes,stripesize,segtype," +
-                   "lv_name,origin,snap_percent,lv_attr,pool_lv"]
+        self.fields = ['vg_name', 'lv_size', 'stripes', 'stripe_size',
+                       'segtype', 'lv_name', 'origin', 'snap_percent',
+                       'lv_attr', 'pool_lv', 'lv_kernel_major',
+                       'lv_kernel_minor', 'lv_dm_path']
         self.attrs = ['pool_name', 'vol_size', 'stripes',
                       'stripesize', 'type', 'lv_name', 'origin',
-                      'snap_size', 'attr', 'pool_lv']
+                      'snap_size', 'attr', 'pool_lv', 'major', 'minor',
+                      'dm_path']
         self.handle_fs = True
-        self.mounts = misc.get_mounts('{0}/mapper'.format(DM_DEV_DIR))
-        self._parse_data(command)
+        self.system_snapshot = misc.get_snapshot()
+        if self.binary:
+            self._parse_data(self.report.lvs)
 
     def _skip_data(self, row):
         if not row['origin']:
@@ -544,7 +717,7 @@ class SnapInfo(LvmInfo):
             return False
 
     def _data_index(self, row):
-        return misc.get_real_device(row['dev_name'])
+        return row['real_dev']
 
     def _fill_additional_info(self, snap):
         snap['dev_name'] = "{0}/{1}/{2}".format(DM_DEV_DIR, snap['pool_name'],
@@ -565,23 +738,15 @@ class SnapInfo(LvmInfo):
             snap['parent_pool'] = snap['pool_name']
             snap['pool_name'] = snap['pool_lv']
 
-        snap['real_dev'] = misc.get_real_device(snap['dev_name'])
+        number = (snap.get('major'), snap.get('minor'))
+        snap['real_dev'] = self.system_snapshot.get_real_device(
+            snap['dev_name'], *number)
 
-        sysfile = "/sys/block/{0}/dm/name".format(
-                  os.path.basename(snap['real_dev']))
+        self._fill_dm_name(snap)
 
-        # In some weird cases the "real" device might not be in /dev/dm-*
-        # form (see tests). In this case constructed sysfile will not exist
-        # so we just use real device name to search mounts.
-        try:
-            with open(sysfile, 'r') as f:
-                lvname = f.readline()[:-1]
-            snap['dm_name'] = "{0}/mapper/{1}".format(DM_DEV_DIR, lvname)
-        except IOError:
-            snap['dm_name'] = snap['real_dev']
-
-        if snap['real_dev'] in self.mounts:
-            snap['mount'] = self.mounts[snap['real_dev']]['mp']
+        mount = self.system_snapshot.get_mount(snap['real_dev'], *number)
+        if mount:
+            snap['mount'] = mount['mp']
 
         self.parse_attr(snap, snap['attr'])
 
@@ -591,16 +756,16 @@ class ThinPool(LvmInfo, template.BackendPool):
     def __init__(self, *args, **kwargs):
         super(ThinPool, self).__init__(*args, **kwargs)
         self.type = 'thin'
-        command = ["lvm", "lvs", "--separator", "|", "--noheadings",
-                   "--nosuffix", "--units", "k", "-o",
-                   "vg_name,lv_size,stripes,stripesize,segtype,lv_name," +
-                   "origin,lv_attr,pv_count,thin_count,data_percent," +
-                   "metadata_percent,snap_percent"]
+        self.fields = ['vg_name', 'lv_size', 'stripes', 'stripe_size',
+                       'segtype', 'lv_name', 'origin', 'lv_attr', 'pv_count',
+                       'thin_count', 'data_percent', 'metadata_percent',
+                       'snap_percent']
         self.attrs = ['parent_pool', 'vol_size', 'stripes',
                       'stripesize', 'type', 'lv_name', 'origin', 'attr',
                       'dev_count', 'vol_count', 'data_percent',
                       'metadata_percent', 'snap_percent']
-        self._parse_data(command)
+        if self.binary:
+            self._parse_data(self.report.lvs)
         # Uff, so ugly...needs to be changed
         global THIN_POOL_DATA
         THIN_POOL_DATA = self.data
@@ -633,6 +798,9 @@ class ThinPool(LvmInfo, template.BackendPool):
                     raise Exception("Multiple items with name {} found".format(key))
         return found
 
+    def aliases(self, key):
+        return [key.split('/', 1)[1]]
+
     def _data_index(self, row):
         return row['index_name']
 
@@ -16,6 +16,7 @@
 # md module for System Storage Manager
 
 import os
+import re
 import socket
 from ssmlib import misc
 from ssmlib.backends import template
@@ -27,6 +28,154 @@ except KeyError:
 
 MDADM = "mdadm"
 
+MDSTAT = "/proc/mdstat"
+SYSFS_BLOCK = "/sys/block"
+
+# Operations reported by the kernel in /proc/mdstat
+SYNC_ACTIONS = "resync|recovery|reshape|check|repair"
+
+
+def read_mdstat():
+    try:
+        with open(MDSTAT, 'r') as f:
+            return f.read()
+    except (IOError, OSError):
+        # md module is not loaded, so there are no arrays
+        return ""
+
+
+def _read_sysfs(path):
+    try:
+        with open(path, 'r') as f:
+            return f.read().strip()
+    except (IOError, OSError):
+        return None
+
+
+def parse_mdstat(data):
+    """ Parse the content of /proc/mdstat and return a dictionary of arrays
+        indexed by the kernel name of the array. Every array has the 'state',
+        the raid 'level' (if known), the list of 'members' and the 'size' in
+        KiB. When there is a resync, recovery, reshape or check running, the
+        'sync_action', 'sync_progress' in percent and 'sync_speed' in KiB/s
+        are provided as well.
+
+    >>> arrays = parse_mdstat('''Personalities : [raid1]
+    ... md127 : active raid1 sdc1[1] sdb1[0](F)
+    ...       1047552 blocks super 1.2 [2/1] [U_]
+    ...       [=>....]  recovery =  8.6% (90112/1047552) speed=90112K/sec
+    ...
+    ... unused devices: <none>''')
+    >>> arrays['md127']['level'], arrays['md127']['members']
+    ('raid1', ['sdc1', 'sdb1'])
+    >>> arrays['md127']['sync_action'], arrays['md127']['sync_progress']
+    ('recovery', '8.6')
+    >>> arrays['md127']['size'], arrays['md127']['sync_speed']
+    (1047552, 90112)
+    """
+    arrays = {}
+    array = None
+    for line in data.splitlines():
+        m = re.match(r'(md\S+) : (\S+)(.*)$', line)
+        if m:
+            array = {'state': m.group(2), 'level': None, 'members': []}
+            arrays[m.group(1)] = array
+            for item in m.group(3).split():
+                # Skip flags like (read-only) or (auto-read-only)
+                if item.startswith('('):
+                    continue
+                member = re.match(r'(\S+)\[\d+\]', item)
+                if member:
+                    array['members'].append(member.group(1))
+                elif array['level'] is None:
+                    array['level'] = item
+            continue
+        if array is None or not line.startswith(' '):
+            array = None
+            continue
+        m = re.match(r'\s+(\d+) blocks', line)
+        if m:
+            array['size'] = int(m.group(1))
+            continue
+        m = re.search(r'({0})\s*=\s*([\d.]+)%.*speed=(\d+)K/sec'.format(
+                      SYNC_ACTIONS), line)
+        if m:
+            array['sync_action'] = m.group(1)
+            array['sync_progress'] = m.group(2)
+            array['sync_speed'] = int(m.group(3))
+            continue
+        m = re.search(r'({0})\s*=\s*(DELAYED|PENDING)'.format(SYNC_ACTIONS),
+                      line)
+        if m:
+            array['sync_action'] = "{0} {1}".format(m.group(1),
+                                                    m.group(2).lower())
+    return arrays
+
+
+class MdArrays(object):
+    """
+    MD arrays in the system as described by /proc/mdstat and
+    /sys/block/mdX/md. Neither of those touches the member devices, so
+    this is cheap even with spun down or failing disks. We only fall back
+    to 'mdadm --detail' for arrays where the kernel does not tell us the
+    raid level.
+    """
+
+    def __init__(self):
+        self.arrays = parse_mdstat(read_mdstat())
+        for name, array in self.arrays.items():
+            self._read_sysfs_data(name, array)
+            if not array['level']:
+                self._read_mdadm_data(name, array)
+
+    def _read_sysfs_data(self, name, array):
+        path = os.path.join(SYSFS_BLOCK, name)
+        level = _read_sysfs(os.path.join(path, "md", "level"))
+        if level:
+            array['level'] = level
+        raid_disks = _read_sysfs(os.path.join(path, "md", "raid_disks"))
+        if raid_disks:
+            array['raid_disks'] = raid_disks
+        size = _read_sysfs(os.path.join(path, "size"))
+        if size:
+            # Size in sysfs is always in 512B sectors
+            array['size'] = int(size) // 2
+        members = []
+        try:
+            entries = sorted(os.listdir(os.path.join(path, "md")))
+        except (IOError, OSError):
+            entries = []
+        for entry in entries:
+            if not entry.startswith("dev-"):
+                continue
+            member = entry[4:]
+            state = _read_sysfs(os.path.join(path, "md", entry, "state"))
+            members.append(member)
+            array.setdefault('member_state', {})[member] = state
+        if members:
+            array['members'] = members
+
+    def _read_mdadm_data(self, name, array):
+        command = [MDADM, '--detail', "/dev/{0}".format(name)]
+        for line in misc.run(command, stderr=False,
+                             can_fail=True)[1].split("\n"):
+            item = line.split(":")
+            if len(item) < 2:
+                continue
+            if item[0].strip() == 'Raid Level':
+                array['level'] = item[1].strip()
+            elif item[0].strip() == 'Array Size':
+                array['size'] = int(item[1].split()[0])
+
+
+def get_md_arrays():
+    """ Return MdArrays shared by all md backend instances. """
+    return misc.get_snapshot().cached('md_arrays', MdArrays)
+
+
+def invalidate_md_arrays():
+    misc.get_snapshot().invalidate('md_arrays')
+
 
 class MdRaid(template.Backend):
 
@@ -42,71 +191,60 @@ class MdRaid(template.Backend):
         self.attrs = ['dev_name', 'pool_name', 'dev_free',
                       'dev_used', 'dev_size']
 
-        if not self._binary:
+        if not self._binary or not self.in_scope(SSM_DM_DEFAULT_POOL):
             return
 
-        self.mounts = misc.get_mounts('/dev/md')
-        self.swaps = misc.get_swaps()
+        self.system_snapshot = misc.get_snapshot()
 
-        mdnumber = misc.get_dmnumber("md")
+        for name, array in get_md_arrays().arrays.items():
+            devname = "/dev/{0}".format(name)
+            self._vol[devname] = self.get_volume_data(devname, array)
+            for member in array['members']:
+                dev = "/dev/{0}".format(member)
+                self._dev[dev] = self.get_device_data(dev, array, member)
 
-        for line in misc.get_partitions():
-            devname = line[3]
-            devsize = int(line[2])
-            if line[0] == mdnumber:
-                self._vol[devname] = self.get_volume_data(devname)
-                for dev in misc.get_slaves(os.path.basename(devname)):
-                    self._dev[dev] = self.get_device_data(dev, devsize)
-
-    def get_device_data(self, devname, devsize):
+    def get_device_data(self, devname, array, member):
         data = {}
         data['dev_name'] = devname
         data['hide'] = False
-        command = [MDADM, '--examine', devname]
-        output = misc.run(command, stderr=False)[1].split("\n")
-        for line in output:
-            array = line.split(":")
-            if len(array) < 2:
-                continue
-            item = array[0].strip()
-            if item == "Name":
-                data['pool_name'] = SSM_DM_DEFAULT_POOL
-            data['dev_used'] = data['dev_size'] = devsize
-            data['dev_free'] = 0
+        data['pool_name'] = SSM_DM_DEFAULT_POOL
+        state = array.get('member_state', {}).get(member)
+        if state:
+            data['md_state'] = state
+        partition = self.system_snapshot.get_partition(devname)
+        devsize = partition[2] if partition else 0
+        data['dev_used'] = data['dev_size'] = devsize
+        data['dev_free'] = 0
         return data
 
-    def get_volume_data(self, devname):
+    def get_volume_data(self, devname, array):
         data = {}
         data['dev_name'] = devname
         data['real_dev'] = devname
         data['pool_name'] = SSM_DM_DEFAULT_POOL
-        if data['dev_name'] in self.mounts:
-            data['mount'] = self.mounts[data['dev_name']]['mp']
-        else:
-            for swap in self.swaps:
-                if swap[0] == data['dev_name']:
-                    data['mount'] = "SWAP"
-                    break
-        command = [MDADM, '--detail', devname]
-        for line in misc.run(command, stderr=False)[1].split("\n"):
-            array = line.split(":")
-            if len(array) < 2:
-                continue
-            item = array[0].strip()
-            value = array[1].strip()
-            if item == 'Raid Level':
-                data['type'] = value
-            elif item == 'Array Size':
-                data['vol_size'] = value.split()[0]
-            elif item == 'Total Devices':
-                data['total_devices'] = value
-
+        partition = self.system_snapshot.get_partition(devname)
+        number = partition[:2] if partition else (None, None)
+        mount = self.system_snapshot.get_mount(devname, *number)
+        if mount:
+            data['mount'] = mount['mp']
+        elif self.system_snapshot.is_swap(devname, *number):
+            data['mount'] = "SWAP"
+        if array['level']:
+            data['type'] = array['level']
+        if 'size' in array:
+            data['vol_size'] = array['size']
+        data['total_devices'] = str(len(array['members']))
+        for item in ['raid_disks', 'sync_action', 'sync_progress',
+                     'sync_speed']:
+            if item in array:
+                data[item] = array[item]
         return data
 
     def run_mdadm(self, command):
         if not self._binary:
             self.problem.check(self.problem.TOOL_MISSING, MDADM)
         command.insert(0, MDADM)
+        invalidate_md_arrays()
         return misc.run(command, stdout=True)
 
 
@@ -32,6 +32,72 @@ try:
 except KeyError:
     DM_DEV_DIR = "/dev"
 
+# Map header, with or without the user friendly name, e.g.
+# "mpatha (360000000000000000e00000000010001) dm-2 QEMU,QEMU HARDDISK"
+# "360000000000000000e00000000010001 dm-2 QEMU,QEMU HARDDISK"
+MAP_HEADER = re.compile(r"^([^\s|`]\S*)(?: \(([^)]+)\))? (dm-\d+) ")
+# Path line, e.g. "| `- 11:0:0:1 sda 8:64 active ready running"
+MAP_PATH = re.compile(r"\d+:\d+:\d+:\d+\s+(\S+)\s+\d+:\d+")
+
+
+def parse_multipath(output):
+    """ Parse the output of 'multipath -ll' and return the list of maps in
+        the order they were listed. Every map is a dictionary with the
+        'name', 'wwid', 'dm' device and a list of all its 'paths' from all
+        path groups.
+
+    >>> maps = parse_multipath('''mpatha (3600a0b80) dm-2 QEMU,QEMU HARDDISK
+    ... size=10G features='0' hwhandler='0' wp=rw
+    ... |-+- policy='service-time 0' prio=1 status=active
+    ... | |- 11:0:0:1 sda 8:0  active ready running
+    ... | `- 12:0:0:1 sdb 8:16 active ready running
+    ... `-+- policy='service-time 0' prio=1 status=enabled
+    ...   `- 13:0:0:1 sdc 8:32 active ready running
+    ... 3600a0b81 dm-3 QEMU,QEMU HARDDISK
+    ... size=1G features='0' hwhandler='0' wp=rw
+    ... `-+- policy='service-time 0' prio=1 status=active
+    ...   `- 14:0:0:1 sdd 8:48 failed faulty running''')
+    >>> [(m['name'], m['wwid'], m['dm'], m['paths']) for m in maps]
+    ... # doctest: +NORMALIZE_WHITESPACE
+    [('mpatha', '3600a0b80', 'dm-2', ['sda', 'sdb', 'sdc']),
+     ('3600a0b81', '3600a0b81', 'dm-3', ['sdd'])]
+    """
+    maps = []
+    current = None
+    for line in output.splitlines():
+        match = MAP_HEADER.match(line)
+        if match:
+            current = {'name': match.group(1),
+                       'wwid': match.group(2) or match.group(1),
+                       'dm': match.group(3),
+                       'paths': []}
+            maps.append(current)
+            continue
+        if current is None:
+            continue
+        match = MAP_PATH.search(line)
+        if match:
+            current['paths'].append(match.group(1))
+    return maps
+
+
+def _read_multipath_maps():
+    command = [MP, '-ll']
+    try:
+        output = misc.run(command, stderr=False, can_fail=True)[1]
+    except (problem.CommandFailed, OSError):
+        # probably multipath not installed
+        output = ""
+    return parse_multipath(output or "")
+
+
+def get_multipath_maps():
+    """ Return all multipath maps with their paths. There is only one call
+        to multipath for all the maps, shared through the system snapshot.
+    """
+    return misc.get_snapshot().cached('multipath_maps', _read_multipath_maps)
+
+
 class Multipath(template.Backend):
     def __init__(self, options, data=None):
         self.type = 'multipath'
@@ -40,11 +106,14 @@ class Multipath(template.Backend):
         self.options = options
         self.output = None
         self.problem = problem.ProblemSet(options)
-        self.swaps = misc.get_swaps()
-        self.mounts = misc.get_mounts('{0}/mapper'.format(DM_DEV_DIR))
+        self.system_snapshot = misc.get_snapshot()
+        self._maps = dict([(mp_map['name'], mp_map)
+                           for mp_map in get_multipath_maps()])
 
         for mp_dev in self.get_mp_devices():
             mpname = self.get_real_device(mp_dev)
+            if not self.in_scope(mpname):
+                continue
             self._dev[mp_dev] = self.get_volume_data(mp_dev)
             for devname in self._dev[mp_dev]['nodes']:
                 self._dev[devname] = self.get_device_data(devname, mpname, 0)
@@ -56,10 +125,15 @@ class Multipath(template.Backend):
         """ Get the device for multipath volume name.
             Do we have /dev/mapper/mpathX, or /dev/dm-X?
         """
+        if devname in self._maps:
+            # multipath tells us the kernel name of the map already, whether
+            # it is named mpathX, by its wwid or by an alias
+            return "/dev/" + self._maps[devname]['dm']
         if len(devname) > 5 and devname[:5] == "mpath":
-            return misc.get_real_device("/dev/mapper/"+devname)
+            return self.system_snapshot.get_real_device(
+                "/dev/mapper/" + devname)
         elif len(devname) > 3 and devname[:3] == "dm-":
-            return misc.get_real_device("/dev/"+devname)
+            return self.system_snapshot.get_real_device("/dev/" + devname)
         # Or maybe raise an exception?
         return devname
 
@@ -76,55 +150,31 @@ class Multipath(template.Backend):
 
     def get_mp_devices(self):
         """ Find all multipath devices (but not their nodes). """
-        devices = []
-        command = [MP, '-ll']
-        try:
-            output = misc.run(command, stderr=False, can_fail=True)[1].split("\n")
-            pattern = re.compile(r"^([a-z0-9]+) \([^)]+\)")
-        except (problem.CommandFailed, OSError):
-            # probably multipath not installed
-            output = []
-
-        for line in output:
-            match = pattern.match(line)
-            if match:
-                devices.append(match.group(1))
-        return devices
-
+        return [mp_map['name'] for mp_map in get_multipath_maps()]
 
     def get_volume_data(self, volname):
         data = {}
         data['dev_name'] = self.get_real_device(volname)
         data['hide'] = False
-        command = [MP, '-ll', volname]
-        try:
-            output = misc.run(command, stderr=False)[1].split("\n")
-        except OSError:
-            # probably multipath not installed
-            output = []
-
-        if len(output) > 0:
-            match = re.search(r"\(([^)]+)\)",output[0])
-            data['wwid'] = match.group(1)
+        mp_map = self._maps.get(volname)
+        if not mp_map:
+            return data
+
+        data['wwid'] = mp_map['wwid']
+        partition = self.system_snapshot.get_partition(data['dev_name'])
+        if partition:
+            data['dev_size'] = partition[2]
+        else:
             data['dev_size'] = misc.get_device_size(data['dev_name'])
-            data['nodes'] = []
-            data['total_nodes'] = 0
-            if data['dev_name'] in self.mounts:
-                data['mount'] = self.mounts[data['dev_name']]['mp']
-            else:
-                for swap in self.swaps:
-                    if swap[0] == data['dev_name']:
-                        data['mount'] = "SWAP"
-                        break
-            for entry in zip(output[2::2],output[3::2]):
-                """ Some string operations to remove the tree path symbols
-                    from the output. """
-                dev = list(filter(None,
-                            entry[1][re.search(r"[a-zA-Z0-9]", entry[1])
-                                     .start():].split(" ")
-                        ))
-                data['nodes'].append("/dev/"+self.get_real_device(dev[1]))
-                data['total_nodes'] += 1
+        data['nodes'] = ["/dev/" + self.get_real_device(path)
+                         for path in mp_map['paths']]
+        data['total_nodes'] = len(data['nodes'])
+        number = partition[:2] if partition else (None, None)
+        mount = self.system_snapshot.get_mount(data['dev_name'], *number)
+        if mount:
+            data['mount'] = mount['mp']
+        elif self.system_snapshot.is_swap(data['dev_name'], *number):
+            data['mount'] = "SWAP"
         return data
 
 
@@ -48,6 +48,23 @@ class Backend(object):
         if key in self.data:
             return self.data[key]
 
+    @property
+    def pool_filter(self):
+        """ Name of the only pool of interest, or None. """
+        return getattr(self.options, 'pool_filter', None)
+
+    def in_scope(self, pool_name):
+        """ Return False when nothing from the pool 'pool_name' is going to
+            be used, so there is no need to discover it.
+        """
+        return not self.pool_filter or self.pool_filter == pool_name
+
+    def aliases(self, key):
+        """ Return names other than 'key' which __getitem__() accepts for
+            the item 'key', so they can be looked up without asking us.
+        """
+        return []
+
 
 class BackendPool(Backend):
     def __init__(self, *args, **kwargs):
@@ -0,0 +1,190 @@
+# (C)2011 Red Hat, Inc., Lukas Czerner <lczerner@redhat.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# dm.py - talking to the device mapper directly through its ioctl interface
+
+import os
+import re
+import struct
+import fcntl
+
+__all__ = ["get_tables", "hide_crypt_key", "parse_crypt_params"]
+
+DM_CONTROL = "/dev/mapper/control"
+
+# Any 4.x interface will do, we are only reading
+DM_VERSION = (4, 0, 0)
+
+# struct dm_ioctl from <linux/dm-ioctl.h>
+DM_IOCTL_FORMAT = "=10IQ128s129s7s"
+DM_IOCTL_SIZE = struct.calcsize(DM_IOCTL_FORMAT)
+
+# struct dm_target_spec
+DM_TARGET_SPEC_FORMAT = "=QQiI16s"
+DM_TARGET_SPEC_SIZE = struct.calcsize(DM_TARGET_SPEC_FORMAT)
+
+# struct dm_name_list without the name
+DM_NAME_LIST_FORMAT = "=QI"
+DM_NAME_LIST_SIZE = struct.calcsize(DM_NAME_LIST_FORMAT)
+
+DM_LIST_DEVICES_CMD = 2
+DM_TABLE_STATUS_CMD = 12
+
+DM_STATUS_TABLE_FLAG = 1 << 4
+DM_BUFFER_FULL_FLAG = 1 << 8
+
+
+def _iowr(nr):
+    return (3 << 30) | (DM_IOCTL_SIZE << 16) | (0xfd << 8) | nr
+
+
+def _cstr(data):
+    string = data.split(b"\0", 1)[0]
+    if not isinstance(string, str):
+        string = string.decode('utf-8', 'replace')
+    return string
+
+
+def _ioctl(fd, cmd, name="", flags=0):
+    """ Run device mapper ioctl and return the result buffer, growing it
+        until the kernel has enough space for the whole answer.
+    """
+    size = 16384
+    while True:
+        buf = bytearray(size)
+        struct.pack_into(DM_IOCTL_FORMAT, buf, 0,
+                         DM_VERSION[0], DM_VERSION[1], DM_VERSION[2],
+                         size, DM_IOCTL_SIZE, 0, 0, flags, 0, 0, 0,
+                         name.encode('utf-8'), b"", b"")
+        fcntl.ioctl(fd, _iowr(cmd), buf, True)
+        header = struct.unpack_from(DM_IOCTL_FORMAT, buf, 0)
+        if header[7] & DM_BUFFER_FULL_FLAG:
+            size *= 4
+            continue
+        return buf, header
+
+
+def _list_devices(fd):
+    buf, header = _ioctl(fd, DM_LIST_DEVICES_CMD)
+    devices = []
+    offset = header[4]
+    while True:
+        dev, next_offset = struct.unpack_from(DM_NAME_LIST_FORMAT, buf, offset)
+        # dev is zero when there are no devices at all
+        if dev == 0:
+            break
+        name = _cstr(bytes(buf[offset + DM_NAME_LIST_SIZE:
+                               offset + DM_NAME_LIST_SIZE + 128]))
+        devices.append(name)
+        if not next_offset:
+            break
+        offset += next_offset
+    return devices
+
+
+def _table_status(fd, name):
+    buf, header = _ioctl(fd, DM_TABLE_STATUS_CMD, name, DM_STATUS_TABLE_FLAG)
+    data_start = header[4]
+    dev = header[10]
+    table = {'name': _cstr(header[11]),
+             'uuid': _cstr(header[12]),
+             'major': os.major(dev),
+             'minor': os.minor(dev),
+             'targets': []}
+    offset = data_start
+    for _ in range(header[5]):
+        start, length, _, next_offset, target_type = struct.unpack_from(
+            DM_TARGET_SPEC_FORMAT, buf, offset)
+        params = _cstr(bytes(buf[offset + DM_TARGET_SPEC_SIZE:
+                                 header[3]]))
+        target_type = _cstr(target_type)
+        if target_type == 'crypt':
+            params = hide_crypt_key(params)
+        table['targets'].append({'start': start,
+                                 'length': length,
+                                 'type': target_type,
+                                 'params': params})
+        # Offsets in the answer are relative to the start of the data
+        offset = data_start + next_offset
+    return table
+
+
+def get_tables():
+    """ Return tables of all device mapper devices with a single sweep over
+        the device mapper control device, without running dmsetup.
+
+        Every table is a dictionary with 'name', 'uuid', 'major', 'minor'
+        and a list of 'targets', each with 'start', 'length' (both in
+        512 byte sectors), 'type' and 'params'. The keys of crypt targets
+        are hidden the same way 'dmsetup table' does it.
+
+        Raises OSError or IOError when the device mapper can not be queried
+        directly, for example when we are not running as root.
+    """
+    fd = os.open(DM_CONTROL, os.O_RDWR)
+    try:
+        tables = []
+        for name in _list_devices(fd):
+            try:
+                tables.append(_table_status(fd, name))
+            except (OSError, IOError):
+                # The device might have disappeared in the meantime
+                continue
+        return tables
+    finally:
+        os.close(fd)
+
+
+def hide_crypt_key(params):
+    """ Replace the key in the table parameters of the crypt target with
+        zeros of the same length, so only its size is left. Keys in the
+        kernel keyring are only referred to by their description and are
+        left as they are.
+
+    >>> hide_crypt_key("aes-xts-plain64 0123abcd 0 8:16 4096")
+    'aes-xts-plain64 00000000 0 8:16 4096'
+    >>> hide_crypt_key("capi:xts(aes)-plain64 :64:logon:cryptsetup:x 0 253:3 32768")
+    'capi:xts(aes)-plain64 :64:logon:cryptsetup:x 0 253:3 32768'
+    """
+    array = params.split(' ')
+    if len(array) > 1 and not array[1].startswith(':'):
+        array[1] = '0' * len(array[1])
+    return ' '.join(array)
+
+
+def parse_crypt_params(params):
+    """ Parse the table parameters of the crypt target and return the
+        cipher, the key size in bits and the underlying device in the same
+        form as 'cryptsetup status' would.
+
+    >>> parse_crypt_params("aes-xts-plain64 " + "0" * 128 + " 0 8:16 4096")
+    ('aes-xts-plain64', '512', '8:16')
+    >>> parse_crypt_params("capi:xts(aes)-plain64 :64:logon:cryptsetup:x 0 253:3 32768")
+    ('aes-xts-plain64', '512', '253:3')
+    """
+    array = params.split()
+    cipher = array[0]
+    # Kernel crypto API format used by LUKS2
+    match = re.match(r'capi:(\w+)\((\w+)\)-(\S+)$', cipher)
+    if match:
+        cipher = "{0}-{1}-{2}".format(match.group(2), match.group(1),
+                                      match.group(3))
+    key = array[1]
+    if key.startswith(':'):
+        # Key in the kernel keyring - :<key size in bytes>:<type>:<desc>
+        keysize = int(key.split(':')[1]) * 8
+    else:
+        keysize = len(key) * 4
+    return cipher, str(keysize), array[3]
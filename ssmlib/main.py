@@ -24,11 +24,13 @@ import stat
 import atexit
 import argparse
 import getpass
+from collections import OrderedDict
 from ssmlib import misc
 from ssmlib import problem
+from ssmlib import superblock
 
-# Import backends
-from ssmlib.backends import lvm, crypt, btrfs, md, multipath
+# Backends are imported only when needed, see ssmlib.backends
+from ssmlib import backends
 
 # conditional import of pwquality
 try:
@@ -37,8 +39,25 @@ except ImportError:
     pwquality = None
 
 EXTN = ['ext2', 'ext3', 'ext4']
+
+# Item keys which need the file system to be probed, see FsInfo.get_usage()
+FS_USAGE = ['fs_size', 'fs_free', 'fs_used', 'fs_info']
+
+# Storage index entry of a name more than one item is known by, see
+# Storage._get_index()
+AMBIGUOUS = object()
+
+# Formats of 'list' and 'info' output, see misc.precords()
+OUTPUT_FORMATS = ['text', 'json', 'ndjson', 'csv']
+
+# Attributes with these suffixes are sizes in KiB
+SIZE_SUFFIXES = ('_size', '_free', '_used')
+
+# Types of values which go into machine readable output as they are
+RAW_TYPES = (str, int, float, bool)
 SUPPORTED_FS = ['xfs', 'btrfs'] + EXTN
-SUPPORTED_BACKENDS = ['lvm', 'btrfs', 'crypt']
+SUPPORTED_BACKENDS = [name for name in ['lvm', 'btrfs', 'crypt']
+                      if backends.is_enabled(name)]
 SUPPORTED_RAID = ['0', '1', '10']
 os.environ['LC_ALL'] = "C"
 
@@ -55,6 +74,12 @@ try:
 except KeyError:
     SSM_NONINTERACTIVE = not os.isatty(sys.stdout.fileno())
 
+# Number of backends to discover in parallel
+try:
+    SSM_DISCOVERY_WORKERS = int(os.environ['SSM_DISCOVERY_WORKERS'])
+except (KeyError, ValueError):
+    SSM_DISCOVERY_WORKERS = 4
+
 if sys.version < '3':
     def __next__(iter):
         return iter.next()
@@ -78,6 +103,9 @@ class Options(object):
         self.force = False
         self.yes = False
         self.config = None
+        # Only the pool of this name (and what is in it) is of interest,
+        # backends can use that to discover less. See Backend.in_scope()
+        self.pool_filter = None
 
     @property
     def vv(self):
@@ -160,6 +188,25 @@ def calculate_size(arg_size, pool):
 
     return base_size *  mult
 
+def raw_value(key, value):
+    """ Return the value of the attribute 'key' the way it goes into machine
+        readable output. Sizes are converted from KiB to bytes.
+
+    >>> raw_value('dev_size', '1.5')
+    1536
+    >>> raw_value('dev_size', '')
+    >>> raw_value('dev_name', '/dev/sda')
+    '/dev/sda'
+    """
+    if not key.endswith(SIZE_SUFFIXES) or isinstance(value, bool):
+        return value
+    if value is None or value == '':
+        return None
+    try:
+        return int(float(value) * 1024)
+    except ValueError:
+        return value
+
 def calculate_resize_size(arg_size, volume, pool):
     vol_size = float(volume['vol_size'])
 
@@ -244,23 +291,99 @@ class FsInfo(object):
     each file system should be part of this class
     """
 
-    def __init__(self, dev, options):
+    def __init__(self, dev, options, usage=True, major=None, minor=None):
         self.data = {}
         self.options = options
-        fstype = misc.get_fs_type(dev)
+        self.major = major
+        self.minor = minor
+        fstype = None
+        if dev:
+            fstype = misc.get_snapshot().get_fs_type(dev)
         if fstype not in [None, 'btrfs']:
             self.data['fs_type'] = fstype
         else:
             return
 
         self.fs_info = {}
-        if fstype in EXTN:
-            self.extN_get_info(dev)
-        elif fstype == "xfs":
-            self.xfs_get_info(dev)
         self.fstype = fstype
         self.device = dev
         self.mounted = False
+        self.has_usage = False
+        if usage:
+            self.get_usage()
+
+    def get_usage(self):
+        """ Fill in the size and usage of the file system. Mounted file
+            systems are asked with statvfs, ext2, ext3, ext4 and xfs
+            superblocks are read directly otherwise. Only when neither works
+            the file system tool is run, so it is only done once and only
+            when asked for.
+        """
+        if self.has_usage:
+            return
+        mount_point = self.mount_point()
+        if mount_point:
+            # The counters in the superblock of a mounted file system are
+            # stale, so it is up to the tools if statvfs fails
+            done = self.statvfs_usage(mount_point)
+        else:
+            done = self.superblock_usage()
+        if not done:
+            if self.fstype in EXTN:
+                self.extN_get_info(self.device)
+            elif self.fstype == "xfs":
+                self.xfs_get_info(self.device)
+        self.has_usage = True
+
+    def mount_point(self):
+        """ Return where the file system is mounted, or None. """
+        snapshot = misc.get_snapshot()
+        realdev = snapshot.get_real_device(self.device, self.major,
+                                           self.minor)
+        mount = snapshot.get_mount(realdev, self.major, self.minor)
+        return (mount or {}).get('mp')
+
+    def statvfs_usage(self, mount_point):
+        """ Fill in the usage of the file system mounted on mount_point from
+            statvfs. Return False if that failed.
+        """
+        size = None
+        if self.fstype in EXTN:
+            # statvfs leaves the metadata overhead out of the size, but
+            # extN_resize() compares the new size with the whole file system.
+            # The block count in the superblock is up to date even when
+            # mounted, unlike the free block count.
+            fs_info = superblock.read_usage(self.device, self.fstype)
+            if not fs_info:
+                return False
+            size = fs_info['Block count'] * fs_info['Block size'] // 1024
+        try:
+            stat = os.statvfs(mount_point)
+        except OSError:
+            return False
+        if size is None:
+            size = stat.f_blocks * stat.f_frsize // 1024
+        # The blocks reserved for root are neither free nor used, the same
+        # way they are counted from the superblock
+        self.data['fs_size'] = size
+        self.data['fs_free'] = stat.f_bavail * stat.f_frsize // 1024
+        self.data['fs_used'] = \
+            (stat.f_blocks - stat.f_bfree) * stat.f_frsize // 1024
+        return True
+
+    def superblock_usage(self):
+        """ Fill in the usage of a file system which is not mounted from its
+            superblock. Return False if the superblock could not be read.
+        """
+        fs_info = superblock.read_usage(self.device, self.fstype)
+        if not fs_info:
+            return False
+        self.fs_info = fs_info
+        if self.fstype in EXTN:
+            self.extN_usage()
+        else:
+            self.xfs_usage()
+        return True
 
     def _get_fs_func(self, func, *args, **kwargs):
         fstype = self.fstype
@@ -296,7 +419,9 @@ class FsInfo(object):
             array = line.split(":")
             if len(array) == 2:
                 self.fs_info[array[0]] = array[1].lstrip()
+        self.extN_usage()
 
+    def extN_usage(self):
         bsize = int(self.fs_info['Block size'])
         bcount = int(self.fs_info['Block count'])
         rbcount = int(self.fs_info['Reserved block count'])
@@ -349,37 +474,30 @@ class FsInfo(object):
     def xfs_get_info(self, dev):
         # Never use xfs_db for a mounted filesystem - such use is unsupported
         # by XFS and almost guaranteed to report stale data.
-        realdev = misc.get_real_device(dev)
-        mount_point = misc.get_mounts(dev).get(realdev, {}).get('mp', None)
-        if mount_point:
-            stat = os.statvfs(mount_point)
-            total = stat.f_blocks*stat.f_bsize/1024
-            free = stat.f_bfree*stat.f_bsize/1024
-            used = (stat.f_blocks-stat.f_bfree)*stat.f_bsize/1024
-            self.data['fs_size'] = total
-            self.data['fs_free'] = free
-            self.data['fs_used'] = used
-        else :
-            command = ["xfs_db", "-r", "-c", "sb", "-c", "print", dev]
-            if not misc.check_binary(command[0]):
-                return
-            output = misc.run(command)[1]
-
-            for line in output.split("\n")[1:]:
-                    array = line.split("=")
-                    if len(array) == 2:
-                        self.fs_info[array[0].rstrip()] = array[1].lstrip()
-
-            bsize = int(self.fs_info['blocksize'])
-            bcount = int(self.fs_info['dblocks'])
-            lbcount = int(self.fs_info['logblocks'])
-            bcount -= lbcount
-            agcount = int(self.fs_info['agcount'])
-            fbcount = int(self.fs_info['fdblocks'])
-            fbcount -= 4 + (4 + agcount)
-            self.data['fs_size'] = bcount * bsize // 1024
-            self.data['fs_free'] = fbcount * bsize // 1024
-            self.data['fs_used'] = (bcount - fbcount) * bsize // 1024
+        if self.mount_point():
+            return
+        command = ["xfs_db", "-r", "-c", "sb", "-c", "print", dev]
+        if not misc.check_binary(command[0]):
+            return
+        output = misc.run(command)[1]
+
+        for line in output.split("\n")[1:]:
+                array = line.split("=")
+                if len(array) == 2:
+                    self.fs_info[array[0].rstrip()] = array[1].lstrip()
+        self.xfs_usage()
+
+    def xfs_usage(self):
+        bsize = int(self.fs_info['blocksize'])
+        bcount = int(self.fs_info['dblocks'])
+        lbcount = int(self.fs_info['logblocks'])
+        bcount -= lbcount
+        agcount = int(self.fs_info['agcount'])
+        fbcount = int(self.fs_info['fdblocks'])
+        fbcount -= 4 + (4 + agcount)
+        self.data['fs_size'] = bcount * bsize // 1024
+        self.data['fs_free'] = fbcount * bsize // 1024
+        self.data['fs_used'] = (bcount - fbcount) * bsize // 1024
 
     def xfs_fsck(self):
         command = ['xfs_repair', '-n']
@@ -411,6 +529,30 @@ class FsInfo(object):
             misc.run(command, stdout=True)
 
 
+def get_fs_info(device, options, usage=True, major=None, minor=None):
+    """ Return FsInfo of the file system on the device, or None if there is
+        no file system. The same block device is often listed as a volume,
+        a device and a snapshot, so FsInfo is kept per device number for as
+        long as the system snapshot is valid and it is probed only once.
+    """
+    snapshot = misc.get_snapshot()
+    key = misc.device_number(major, minor)
+    if not key and device:
+        row = snapshot.get_partition(snapshot.get_real_device(device))
+        key = (row and misc.device_number(row[0], row[1])) or device
+    fs_infos = snapshot.cached('fs_infos', dict)
+    try:
+        fs = fs_infos[key]
+    except KeyError:
+        fs = FsInfo(device, options, usage=False, major=major, minor=minor)
+        if 'fs_type' not in fs.data:
+            fs = None
+        fs_infos[key] = fs
+    if fs and usage:
+        fs.get_usage()
+    return fs
+
+
 class DeviceInfo(object):
     """
     Parse and store information about the devices present in the system. The
@@ -430,14 +572,18 @@ class DeviceInfo(object):
         self.attrs = ['major', 'minor', 'dev_size', 'dev_name', 'human_name', 'parent_name']
         self.options = options
 
+        snapshot = misc.get_snapshot()
         hide_dmnumbers = []
         for name in ['device-mapper', 'sr', 'md']:
-            hide_dmnumbers.append(misc.get_dmnumber(name))
+            hide_dmnumbers.append(snapshot.get_dmnumber(name))
 
-        mounts = misc.get_mounts('/dev/')
-
-        for items in misc.get_partitions():
+        kernel_partitions = set()
+        for items in snapshot.partitions:
             devices = dict(zip(self.attrs, items))
+            if getattr(items, 'partition', False):
+                kernel_partitions.add(devices['dev_name'])
+            if not devices.get('parent_name'):
+                devices.pop('parent_name', None)
             devices['vol_size'] = devices['dev_size']
             devices['dev_name'] = devices['dev_name']
             devices['human_name'] = devices['human_name']
@@ -450,27 +596,29 @@ class DeviceInfo(object):
                 self.data[devices['dev_name']].update(devices)
             else:
                 self.data[devices['dev_name']] = devices
-            if devices['dev_name'] in mounts:
-                devices['mount'] = mounts[devices['dev_name']]['mp']
-
-        for item in misc.get_swaps():
-            if item[0] in self.data:
-                self.data[item[0]]['mount'] = "SWAP"
-
-        for i, dev in enumerate(self.data.values()):
-            part = 0
-            for a, d in enumerate(self.data.values()):
-                if a == i:
-                    continue
-                try:
-                    if d['parent_name'] != dev['dev_name'] and dev['major'] != d['major']:
-                        continue
-                except KeyError:
-                    continue
-                if re.search(dev['dev_name'], d['dev_name']):
-                    d['partition'] = True
-                    d['type'] = 'part'
-                    part += 1
+            number = (devices['major'], devices['minor'])
+            if snapshot.is_swap(devices['dev_name'], *number):
+                self.data[devices['dev_name']]['mount'] = "SWAP"
+                continue
+            mount = snapshot.get_mount(devices['dev_name'], *number)
+            if mount:
+                devices['mount'] = mount['mp']
+
+        # Partitions are either known to be partitions from sysfs, or they
+        # are named after their parent, like /dev/sda1 or /dev/nvme0n1p1.
+        # Other children, like device mapper devices on top of it, are not.
+        partitions = {}
+        for dev in self.data.values():
+            parent = dev.get('parent_name')
+            if parent and 'dev_name' in dev and \
+               (dev['dev_name'] in kernel_partitions or
+                misc.is_partition_name(dev['dev_name'], parent)):
+                dev['partition'] = True
+                dev['type'] = 'part'
+                partitions[parent] = partitions.get(parent, 0) + 1
+
+        for dev in self.data.values():
+            part = partitions.get(dev.get('dev_name'), 0)
             dev['partitioned'] = part
             if part > 0:
                 dev['mount'] = "PARTITIONED"
@@ -491,7 +639,7 @@ class DeviceInfo(object):
         source = self.data[source_dev]
         target = self.data[target_dev]
 
-        if misc.get_signature(source_dev) == 'btrfs':
+        if misc.get_snapshot().get_signature(source_dev) == 'btrfs':
             raise problem.ProgrammingError("BTRFS SHOULD NOT BE CLONED WITH DD")
 
         if source['dev_size'] > target['dev_size']:
@@ -524,7 +672,7 @@ class DeviceInfo(object):
             yield item
 
     def __getitem__(self, name):
-        device = misc.get_real_device(name)
+        device = misc.get_snapshot().get_real_device(name)
         if device in self.data:
             return self.data[device]
         return None
@@ -540,7 +688,7 @@ class Item(misc.Node):
     need to call Dev, Pool or Vol methods directly.
     """
 
-    def __init__(self, obj, name, source):
+    def __init__(self, obj, name, source, key=None):
         """
         Parameters:
         ----------
@@ -550,11 +698,15 @@ class Item(misc.Node):
             Primary name/path
         source : Storage
             An instance implementing Storage, which created this object
+        key : str, optional
+            The key of the data in the backend when it differs from the name
         """
         super(Item, self).__init__()
         self.obj = obj
         self.name = name
+        self.key = key or name
         self._name_fields = None
+        self._names = None
         self.aliases = set()
         self.type = obj.type
         self.source = source
@@ -569,21 +721,32 @@ class Item(misc.Node):
     @name_fields.setter
     def name_fields(self, vals):
         self._name_fields = set(vals)
+        self._names = None
 
     @property
     def data(self):
-        return self.obj[self.name]
+        return self.obj[self.key]
+
+    @property
+    def backend_name(self):
+        """ Name of the backend module this item comes from, e.g. 'lvm'. """
+        return type(self.obj).__module__.rsplit('.', 1)[-1]
 
     @property
     def names(self):
         """ Get a set of all names that can be used to reference this object.
             E.g /dev/dm-0 and /dev/mapper/some_name.
 
+            The set is put together only once, Storage creates new items
+            whenever the backend data are discovered again.
+
         Returns
         -------
         set
             A set of names of this object.
         """
+        if self._names is not None:
+            return self._names
         names = set([self.name])
         for field in self.name_fields:
             name = self[field]
@@ -593,6 +756,7 @@ class Item(misc.Node):
             names.add(name)
         if 'pool_name' in self and 'lv_name' in self:
             names.add("{}/{}".format(self['pool_name'], self['lv_name']))
+        self._names = names
         return names
 
     def matches_name(self, name):
@@ -694,6 +858,32 @@ class Item(misc.Node):
             out.append(('  type', 'Swap'))
         return out
 
+    @classmethod
+    def stack_info(cls, node):
+        """
+        Get a list of pairs (description, value) with all the block devices
+        the given node is built on, as found in sysfs.
+
+        Parameters:
+        ----------
+        node : {Item}
+            An item we want to learn about.
+        Returns
+        -------
+        {list}
+            List of (str, str) tuples, with (description, value) meaning.
+        """
+        device = node['real_dev'] or node['dev_name']
+        if not device:
+            return []
+        stack = misc.get_snapshot().get_stack(device)
+        if not stack:
+            return []
+        out = [('built on', '')]
+        for dev in stack:
+            out.append(('  device', dev))
+        return out
+
     @classmethod
     def get_pool_node(cls, node):
         """
@@ -761,6 +951,13 @@ class Item(misc.Node):
             out.append(('size', misc.humanize_size(node['dev_size'])))
         else:
             out.append(('size', misc.humanize_size(node['vol_size'])))
+        if node['sync_action']:
+            sync = node['sync_action']
+            if node['sync_progress']:
+                sync += " {0}% at {1}/s".format(
+                    node['sync_progress'],
+                    misc.humanize_size(node['sync_speed']))
+            out.append(('sync', sync))
         return out
 
     @classmethod
@@ -828,6 +1025,17 @@ class Item(misc.Node):
         """
         return False
 
+    def fs_claimed(self):
+        """
+        Test if this item is known not to hold a file system, so it does not
+        need to be probed for one. Subclasses should overwrite this method.
+
+        Returns
+        -------
+        bool
+        """
+        return False
+
     def __getattr__(self, func_name):
         func = getattr(self.obj, func_name)
 
@@ -844,8 +1052,10 @@ class Item(misc.Node):
         return _new_func
 
     def __getitem__(self, key):
-        if key not in self.data and isinstance(key, str) and \
-           re.match(r"fs_.*", key):
+        if key == 'fs_type' and key not in self.data:
+            # The type is known without probing the file system itself
+            self._fill_fs_info(usage=False)
+        elif key in FS_USAGE and (key not in self.data or key == 'fs_info'):
             self._fill_fs_info()
         try:
             ret = self.data[key]
@@ -863,7 +1073,13 @@ class Item(misc.Node):
         self._fill_fs_info()
         return repr((self.names, repr(self.data)))
 
-    def _fill_fs_info(self):
+    def _fill_fs_info(self, usage=True):
+        fs = self.data.get('fs_info')
+        if fs:
+            if usage:
+                fs.get_usage()
+            self.data.update(fs.data)
+            return
         if 'dm_name' in self.data:
             name = self.data['dm_name']
         elif 'real_dev' in self.data:
@@ -872,14 +1088,14 @@ class Item(misc.Node):
             name = self.data['dev_name']
         else:
             name = None
-        fs = FsInfo(name, self.obj.options)
-        if 'fs_type' not in fs.data:
+        fs = get_fs_info(name, self.obj.options, usage=usage,
+                         major=self.data.get('major'),
+                         minor=self.data.get('minor'))
+        if not fs:
             # Not a file system
             return
-        try:
-            fs.mounted = self.data['mount']
-        except KeyError:
-            fs.mounted = ""
+        # Not every name of the device knows where it is mounted
+        fs.mounted = self.data.get('mount') or fs.mounted or ""
         self.data.update(fs.data)
         self.data['fs_info'] = fs
 
@@ -969,6 +1185,15 @@ class DeviceItem(Item):
 
         return self.__is_dm_dev
 
+    def fs_claimed(self):
+        # Devices which are part of a pool, swaps, and devices something
+        # else is built on are used as a whole. Hidden devices are listed
+        # as volumes and probed there.
+        if self['hide'] or self['pool_name'] or self['mount'] == "SWAP":
+            return True
+        row = misc.get_snapshot().get_partition(self['dev_name'])
+        return bool(row and row.holders)
+
     def _get_printable_details(self):
         out = []
         if self['partition']:
@@ -1057,6 +1282,7 @@ class VolumeItem(Item):
         out.append(('type', self.volume_type_name(pool['type'])))
         out += self.volume_info(self)
         out += self.parent_pool_info(self, 'parent pool')
+        out += self.stack_info(self)
         out += self.fs_info(self)
         return out
 
@@ -1121,6 +1347,10 @@ class Storage(object):
         super(Storage, self).__init__()
         self._data = {}
         self._cache = {}
+        self._index = None
+        self._mounts = None
+        # Kind of backends in ssmlib.backends.REGISTRY this storage uses
+        self.kind = None
         self.name_fields = set()
         self.detail_fields = []
         self.header = None
@@ -1129,7 +1359,7 @@ class Storage(object):
         self.item_cls = None
         self.set_globals(options)
 
-    def _cached_Item(self, backend, item):
+    def _cached_Item(self, backend, item, key=None):
         """ Read self._data to get an Item and use cache so subsequent
             request for the same Item do not create a new instance all the
             time.
@@ -1140,6 +1370,9 @@ class Storage(object):
                 The name of the backend to use.
             item : str
                 The name of the item from the backend.
+            key : str, optional
+                The key of the item in the backend data if 'item' is just
+                one of its aliases.
         """
         if backend not in self._cache:
             self._cache[backend] = {}
@@ -1148,7 +1381,8 @@ class Storage(object):
             new_item = self.item_cls(
                 obj=self._data[backend],
                 name=item,
-                source=self)
+                source=self,
+                key=key)
             self._cache[backend][item] = new_item
 
         return self._cache[backend][item]
@@ -1165,14 +1399,158 @@ class Storage(object):
             return False
 
     def __getitem__(self, name):
+        index = self._get_index()
+        found = index.get(name)
+        if not found and name:
+            # Any symlink to the device will do as well
+            found = index.get(misc.get_snapshot().get_real_device(name))
+        if not found:
+            return None
+        if found is AMBIGUOUS:
+            raise Exception("Multiple items with name {} found".format(name))
+        backend, key = found
+        return self._cached_Item(backend, name, key)
+
+    def _get_index(self):
+        """ Map all the names the items can be referred to by to the backend
+            and the key of the item, so a lookup does not need to ask every
+            backend, which might need to look into /dev to resolve the name.
+            Backends tell the names they accept besides the key through
+            aliases(). The first backend wins, the same as if they were
+            asked in turn. An alias of more than one item of the same backend
+            is ambiguous and looking it up raises an exception.
+
+            The index is dropped with _drop_index() whenever the backend data
+            change.
+        """
+        if self._index is not None:
+            return self._index
+        index = {}
+        mounts = {}
         for backend, source in self._data.items():
-            item = source[name]
-            if item:
-                return self._cached_Item(backend, name)
-        return None
+            aliases = getattr(source, 'aliases', None)
+            for key in source:
+                index.setdefault(key, (backend, key))
+                data = source[key]
+                if data and data.get('mount'):
+                    mounts.setdefault(data['mount'], (backend, key))
+            if not aliases:
+                continue
+            found = {}
+            for key in source:
+                for alias in aliases(key):
+                    if alias and alias not in index:
+                        found.setdefault(alias, set()).add(key)
+            for alias, keys in found.items():
+                if len(keys) > 1:
+                    index[alias] = AMBIGUOUS
+                else:
+                    index[alias] = (backend, keys.pop())
+        self._index = index
+        self._mounts = mounts
+        return index
+
+    def _drop_index(self):
+        self._index = None
+        self._mounts = None
+
+    def get_mounted(self, mount):
+        """ Return the item mounted at 'mount', or None. """
+        self._get_index()
+        found = self._mounts.get(mount.rstrip("/"))
+        if not found:
+            return None
+        return self._cached_Item(*found)
+
+    def reinitialize(self, backends=None, items=None):
+        """ Discover everything again, or only what might have changed.
 
-    def reinitialize(self):
-        self.__init__(self.options)
+            Parameters
+            ----------
+            backends : list of str, optional
+                Backend modules (for example 'lvm') to ask again. Information
+                from the other backends is kept as it is.
+            items : list of str, optional
+                Names of items which might have changed without any backend
+                being involved, for example when a signature was wiped.
+
+            Storage which does not get its backends from the registry is
+            always discovered again in full.
+        """
+        if (backends is None and items is None) or self.kind is None:
+            self.__init__(self.options)
+            return
+        if backends:
+            self._refresh_backends(backends)
+        for name in items or []:
+            self._refresh_item(name)
+
+    def _refresh_backends(self, modules):
+        listed = backends.get_backends(self.kind, modules)
+        found = dict(self._discover(listed))
+        refreshed = [name for name, _, _ in listed]
+        # Keep the order in which the backends are registered
+        data = {}
+        for name, _, _ in backends.get_backends(self.kind):
+            if name in refreshed:
+                if name in found:
+                    data[name] = found[name]
+            elif name in self._data:
+                data[name] = self._data[name]
+        self._data = data
+        for name in refreshed:
+            self._cache.pop(name, None)
+        self._drop_index()
+        self._apply_prefix_filter()
+
+    def _refresh_item(self, name):
+        # Mount points might have changed as well
+        self._drop_index()
+        # The file system information is stored with the backend data, so
+        # drop it to be read again
+        for source in self._data.values():
+            data = source[name]
+            if data and 'fs_info' in data:
+                for key in list(data['fs_info'].data.keys()) + ['fs_info']:
+                    data.pop(key, None)
+        for cache in self._cache.values():
+            for key, item in list(cache.items()):
+                if name in (key, item.name):
+                    del cache[key]
+
+    def _discover(self, backends):
+        """ Create backend instances in parallel, since most of the time is
+            spent waiting for the tools they run.
+
+            Parameters
+            ----------
+            backends : list of (str, class, str)
+                The name of the backend, its class and the description
+                used in the warning when the backend fails.
+
+            Returns
+            -------
+            list of (str, object)
+                Names and instances of the backends in the order they were
+                given. Backends which failed are left out and a warning is
+                printed for them.
+        """
+        def probe(backend):
+            try:
+                return backend[1](options=self.options), None
+            except RuntimeError as err:
+                return None, err
+
+        found = []
+        results = misc.parallel_map(probe, backends, SSM_DISCOVERY_WORKERS)
+        for (name, _, description), (obj, err) in zip(backends, results):
+            if err is not None:
+                PR.warn(err)
+                PR.warn("Can not get information about {0}".format(
+                        description))
+                continue
+            found.append((name, obj))
+        return found
 
     def _apply_prefix_filter(self):
         """
@@ -1208,6 +1586,8 @@ class Storage(object):
 
     def filesystems(self):
         for item in self:
+            if item.fs_claimed():
+                continue
             if 'fs_type' in item:
                 yield item
 
@@ -1236,92 +1616,123 @@ class Storage(object):
         return found
 
 
-    def psummary(self, cond=None, more_data=None, cond_func=None):
+    def psummary(self, cond=None, more_data=None, cond_func=None,
+                 fields=None):
         """
         Print information table about the source (devices, pools, volumes)
         using the predefined variables (below). cond, or cond_func can be
-        provided to decide which items not to print out.
+        provided to decide which items not to print out. fields can be
+        provided to print other attributes than self.attrs.
 
         self.header - list of headers for the table
         self.attrs - list of attribute keys to print out
         self.types - types of the attributes to print out (str, or float/int)
         """
         lines = []
+        header, attrs, types = self._columns(fields)
 
-        if cond == "fs_only":
-            iterator = self.filesystems()
-        else:
-            iterator = self
-
-        # Keep track of used columns. Then we only print out columns with
-        # values.
-        columns = [False] * len(self.attrs)
-
-        index = 0
-        # Gather all lines which are going to be printed into the list
-        # and create matrix of attribute lengths.
-        # Iterate through all items in each data source first.
-        for data in misc.chain(iterator, more_data or []):
-            if (cond_func and not cond_func(data)) or 'hide' in data:
-                continue
+        # Gather all lines which are going to be printed into the list,
+        # misc.ptable() needs to see all of them to find the column widths.
+        for data in self._summary_items(cond, more_data, cond_func):
             line = ()
             # Iterate through all attributes in each item
-            for i, attr in enumerate(self.attrs):
-                if self.types[i] in (float, int):
+            for i, attr in enumerate(attrs):
+                if types[i] in (float, int):
                     item = misc.humanize_size(data[attr])
                 elif attr + "_print" in data:
                     item = data[attr + "_print"]
                 else:
                     item = data[attr]
-                if item:
-                    columns[i] = True
+                if not isinstance(item, str):
+                    item = str(item)
                 line += item,
             lines.append(line)
-            index += 1
 
         if len(lines) == 0:
             return
 
-        misc.ptable(lines, zip(self.header, self.types))
+        misc.ptable(lines, zip(header, types))
+
+    def _columns(self, fields=None):
+        """ Return the header, attributes and types of the columns for
+            the attributes 'fields', by default all of self.attrs. Fields
+            this source does not list by default are named after the
+            attribute.
+        """
+        if not fields:
+            return self.header, self.attrs, self.types
+        header = []
+        types = []
+        for attr in fields:
+            if attr in self.attrs:
+                index = self.attrs.index(attr)
+                header.append(self.header[index])
+                types.append(self.types[index])
+            else:
+                header.append(attr)
+                types.append(float if attr.endswith(SIZE_SUFFIXES) else str)
+        return header, fields, types
+
+    def _summary_items(self, cond=None, more_data=None, cond_func=None):
+        if cond == "fs_only":
+            iterator = self.filesystems()
+        else:
+            iterator = self
+
+        # Iterate through all items in each data source first.
+        for data in misc.chain(iterator, more_data or []):
+            if (cond_func and not cond_func(data)) or 'hide' in data:
+                continue
+            yield data
+
+    def records(self, cond=None, more_data=None, cond_func=None,
+                fields=None):
+        """
+        Yield a machine readable record for every item psummary() would
+        print, with the same attributes, but the values straight from the
+        backend data and sizes in bytes.
+        """
+        attrs = self._columns(fields)[1]
+        for data in self._summary_items(cond, more_data, cond_func):
+            record = [('object', self.kind)]
+            for attr in attrs:
+                record.append((attr, raw_value(attr, data[attr])))
+            yield OrderedDict(record)
+
+    def details(self, item=None):
+        """
+        Yield a machine readable record with everything known about every
+        item, or just those matching the name 'item', like pinfo() prints.
+        """
+        for node in self:
+            if item and not node.matches_name(item):
+                continue
+            # Make sure the file system information is there
+            'fs_info' in node
+            record = [('object', self.kind), ('name', node.name)]
+            for key in sorted(node.data):
+                value = node.data[key]
+                if value is None or isinstance(value, RAW_TYPES):
+                    record.append((key, raw_value(key, value)))
+            yield OrderedDict(record)
 
 
 class Pool(Storage):
     """
     Store Pools from all the backends. When new backend is added into the ssm
-    it should be registered within this class with appropriate name.
+    it should be registered in ssmlib.backends.REGISTRY as a 'pool' backend.
     """
 
     def __init__(self, *args, **kwargs):
         super(Pool, self).__init__(*args, **kwargs)
+        self.kind = 'pool'
 
-        try:
-            self._data['lvm'] = lvm.VgsInfo(options=self.options)
-        except RuntimeError as err:
-            PR.warn(err)
-            PR.warn("Can not get information about LVM pools")
-        try:
-            self._data['thin'] = lvm.ThinPool(options=self.options)
-        except RuntimeError as err:
-            PR.warn(err)
-            PR.warn("Can not get information about thin pools")
-        try:
-            self._data['btrfs'] = btrfs.BtrfsPool(options=self.options)
-        except RuntimeError as err:
-            PR.warn(err)
-            PR.warn("Can not get information about btrfs pools")
-        try:
-            self._data['crypt'] = crypt.DmCryptPool(options=self.options)
-        except RuntimeError as err:
-            PR.warn(err)
-            PR.warn("Can not get information about crypt pools")
+        found = self._discover(backends.get_backends(self.kind))
+        for name, backend in found:
+            self._data[name] = backend
 
         self.item_cls = PoolItem
-
-        backend = self.get_backend(SSM_DEFAULT_BACKEND)
-        self.default = PoolItem(
-                obj=backend,
-                name=backend.default_pool_name,
-                source=self)
+        self._set_default()
         self.header = ['Pool', 'Type', 'Devices', 'Free', 'Used',
                        'Total', 'Parent']
         self.attrs = ['pool_name', 'type', 'dev_count', 'pool_free',
@@ -1329,11 +1740,22 @@ class Pool(Storage):
         self.types = [str, str, str, float, float, float, str]
         self._apply_prefix_filter()
 
+    def _set_default(self):
+        backend = self.get_backend(SSM_DEFAULT_BACKEND)
+        self.default = PoolItem(
+                obj=backend,
+                name=backend.default_pool_name,
+                source=self)
+
+    def _refresh_backends(self, modules):
+        super(Pool, self)._refresh_backends(modules)
+        self._set_default()
+
 
 class Devices(Storage):
     """
     Store Devices from all the backends. When new backend is added into the ssm
-    it should be registered within this class with appropriate name.
+    it should be registered in ssmlib.backends.REGISTRY as a 'dev' backend.
 
     If the backend only have new information about the device which is already
     discovered by the DeviceInfo() class then it should just add the
@@ -1343,85 +1765,78 @@ class Devices(Storage):
 
     def __init__(self, *args, **kwargs):
         super(Devices, self).__init__(*args, **kwargs)
+        self.kind = 'dev'
+
+        self._backends = []
+        self._backend_data = {}
+        self._add_backends(self._discover(backends.get_backends(self.kind)))
 
-        try:
-            my_lvm = lvm.PvsInfo(options=self.options)
-        except RuntimeError as err:
-            PR.warn(err)
-            PR.warn("Can not get information about LVM physical volumes")
-        try:
-            my_btrfs = btrfs.BtrfsDev(options=self.options)
-        except RuntimeError as err:
-            PR.warn(err)
-            PR.warn("Can not get information about btrfs devices")
-            my_btrfs = Struct()
-            my_btrfs.data = {}
-        try:
-            my_md = md.MdRaidDevice(options=self.options)
-        except RuntimeError as err:
-            PR.warn(err)
-            PR.warn("Can not get information about MD devices")
-            my_md = Struct()
-            my_md.data = {}
-        try:
-            my_crypt = crypt.DmCryptDevice(options=self.options)
-        except RuntimeError as err:
-            PR.warn(err)
-            PR.warn("Can not get information about crypt devices")
-            my_crypt = Struct()
-            my_crypt.data = {}
-        try:
-            my_multipath = multipath.MultipathDevice(options=self.options)
-        except RuntimeError as err:
-            PR.warn(err)
-            PR.warn("Can not get information about multipath devices")
-            my_multipath = Struct()
-            my_multipath.data = {}
-
-        self._data['dev'] = DeviceInfo(data=dict(list(my_lvm.data.items()) +
-                                                 list(my_btrfs.data.items()) +
-                                                 list(my_md.data.items()) +
-                                                 list(my_crypt.data.items()) +
-                                                 list(my_multipath.data.items())),
-                                       options=self.options)
         self.item_cls = DeviceItem
         self.header = ['Device', 'Free', 'Used',
                        'Total', 'Pool', 'Mount point']
         self.attrs = ['dev_name', 'dev_free', 'dev_used', 'dev_size',
                       'pool_name', 'mount']
         self.types = [str, float, float, float, str, str]
+        self._build()
+
+    def _add_backends(self, found):
+        for name, backend in found:
+            self._backends.append((name, backend))
+            # DeviceInfo adds its own information into the backend data,
+            # so remember what the backend found to be able to start over
+            self._backend_data[name] = dict(
+                (dev, dict(data)) for dev, data in backend.data.items())
+
+    def _build(self):
+        data = []
+        for name, backend in self._backends:
+            for dev, found in self._backend_data[name].items():
+                backend.data[dev].clear()
+                backend.data[dev].update(found)
+            data.extend(list(backend.data.items()))
+
+        self._data['dev'] = DeviceInfo(data=dict(data), options=self.options)
+        self._cache = {}
+        self._drop_index()
         self._apply_prefix_filter()
 
+    def reinitialize(self, backends=None, items=None):
+        if backends is None and items is None:
+            self.__init__(self.options)
+            return
+        # All the devices are merged into a single DeviceInfo which is cheap
+        # to put together again, only the backends are expensive to ask
+        if backends:
+            listed = self._registered(backends)
+            refreshed = [name for name, _, _ in listed]
+            found = self._discover(listed)
+            self._backends = [(name, backend) for name, backend
+                              in self._backends if name not in refreshed]
+            for name in refreshed:
+                self._backend_data.pop(name, None)
+            self._add_backends(found)
+            # Keep the order in which the backends are registered
+            order = [name for name, _, _ in self._registered(None)]
+            self._backends.sort(key=lambda backend: order.index(backend[0]))
+        self._build()
+
+    def _registered(self, modules):
+        return backends.get_backends(self.kind, modules)
+
 
 class Volumes(Storage):
     """
     Store Volumes from all the backends. When new backend is added into the ssm
-    it should be registered withing this class with appropriate name.
+    it should be registered in ssmlib.backends.REGISTRY as a 'vol' backend.
     """
 
     def __init__(self, *args, **kwargs):
         super(Volumes, self).__init__(*args, **kwargs)
+        self.kind = 'vol'
 
-        try:
-            self._data['lvm'] = lvm.LvsInfo(options=self.options)
-        except RuntimeError as err:
-            PR.warn(err)
-            PR.warn("Can not get information about LVM volumes")
-        try:
-            self._data['crypt'] = crypt.DmCryptVolume(options=self.options)
-        except RuntimeError as err:
-            PR.warn(err)
-            PR.warn("Can not get information about crypt volumes")
-        try:
-            self._data['btrfs'] = btrfs.BtrfsVolume(options=self.options)
-        except RuntimeError as err:
-            PR.warn(err)
-            PR.warn("Can not get information about btrfs volumes")
-        try:
-            self._data['md'] = md.MdRaidVolume(options=self.options)
-        except RuntimeError as err:
-            PR.warn(err)
-            PR.warn("Can not get information about md raid volumes")
+        found = self._discover(backends.get_backends(self.kind))
+        for name, backend in found:
+            self._data[name] = backend
 
         self.item_cls = VolumeItem
         self.header = ['Volume', 'Pool', 'Volume size', 'FS', 'FS size',
@@ -1436,22 +1851,16 @@ class Snapshots(Storage):
     """
     Store Snapshots from all the backends that supports snapshotting. When
     the snapshotting support is added into the backed it should be registered
-    within this class with appropriate name.
+    in ssmlib.backends.REGISTRY as a 'snap' backend.
     """
 
     def __init__(self, *args, **kwargs):
         super(Snapshots, self).__init__(*args, **kwargs)
+        self.kind = 'snap'
 
-        try:
-            self._data['lvm'] = lvm.SnapInfo(options=self.options)
-        except RuntimeError as err:
-            PR.warn(err)
-            PR.warn("Can not get information about LVM snapshots")
-        try:
-            self._data['btrfs'] = btrfs.BtrfsSnap(options=self.options)
-        except RuntimeError as err:
-            PR.warn(err)
-            PR.warn("Can not get information about btrfs snapshots")
+        found = self._discover(backends.get_backends(self.kind))
+        for name, backend in found:
+            self._data[name] = backend
 
         self.item_cls = SnapshotItem
         self.header = ['Snapshot', 'Origin', 'Pool', 'Volume size', 'Used',
@@ -1467,19 +1876,23 @@ def create_graph(pools, devices, volumes, snapshots):
         oriented graph. That allows us to get related Items and their info
         from every Item.
     """
-    def find_node(name, source):
-        """ Search items of class node_cls and try to find one
-            with specific name.
+    def index_names(source):
+        """ Map every name of the items in source to the first item
+            with that name.
         """
+        index = {}
         for item in source:
-            if item.matches_name(name):
-                return item
-        return None
+            for name in item.names:
+                index.setdefault(name, item)
+        return index
+
+    sources = [index_names(source)
+               for source in [pools, volumes, devices, snapshots]]
 
     def find_parents(item, parent_fields, child_fields):
         for field in parent_fields:
-            for source in [pools, volumes, devices, snapshots]:
-                parent = find_node(item[field], source)
+            for index in sources:
+                parent = index.get(item[field])
                 if not parent or item == parent:
                     continue
                 item.add_parent(parent)
@@ -1527,12 +1940,23 @@ class StorageHandle(object):
         self._pool = None
         self._volumes = None
         self._snapshots = None
+        # Information about the system shared by all the backends
+        self.system_snapshot = misc.new_snapshot()
         self.set_globals(options)
         self.options = options
         # this is a workaround for limited argparse capabilities,
         # where we need to do cross-option validation
         self.__argparse_helper = dict()
 
+    def load_discovery_cache(self):
+        """ Use the discovery results saved by a previous run of ssm, if
+            they are still valid. Must be called before anything is
+            discovered.
+        """
+        if self._dev or self._pool or self._volumes or self._snapshots:
+            return
+        self.system_snapshot = misc.load_discovery_cache()
+
     def set_globals(self, options):
         if self._dev:
             self.dev.set_globals(options)
@@ -1551,9 +1975,24 @@ class StorageHandle(object):
         self._dev = Devices(options=self.options)
         return self._dev
 
-    def reinit_dev(self):
+    def _invalidate(self, backends=None, items=None):
+        """ Drop the system information which might have changed. See
+            Storage.reinitialize() for the meaning of the arguments, without
+            any everything is dropped.
+        """
+        if backends is None and items is None:
+            self.system_snapshot.invalidate()
+            return
+        if backends:
+            # Backends might have created or removed block devices
+            self.system_snapshot.invalidate_devices()
+        for item in items or []:
+            self.system_snapshot.invalidate_signature(item)
+
+    def reinit_dev(self, backends=None, items=None):
         if self._dev:
-            self._dev.reinitialize()
+            self._invalidate(backends, items)
+            self._dev.reinitialize(backends, items)
 
     @property
     def pool(self):
@@ -1562,9 +2001,10 @@ class StorageHandle(object):
         self._pool = Pool(options=self.options)
         return self._pool
 
-    def reinit_pool(self):
+    def reinit_pool(self, backends=None, items=None):
         if self._pool:
-            self._pool.reinitialize()
+            self._invalidate(backends, items)
+            self._pool.reinitialize(backends, items)
 
     @property
     def vol(self):
@@ -1573,9 +2013,10 @@ class StorageHandle(object):
         self._volumes = Volumes(options=self.options)
         return self._volumes
 
-    def reinit_vol(self):
+    def reinit_vol(self, backends=None, items=None):
         if self._volumes:
-            self._volumes.reinitialize()
+            self._invalidate(backends, items)
+            self._volumes.reinitialize(backends, items)
 
     @property
     def snap(self):
@@ -1584,9 +2025,10 @@ class StorageHandle(object):
         self._snapshots = Snapshots(options=self.options)
         return self._snapshots
 
-    def reinit_snap(self):
+    def reinit_snap(self, backends=None, items=None):
         if self._snapshots:
-            self._snapshots.reinitialize()
+            self._invalidate(backends, items)
+            self._snapshots.reinitialize(backends, items)
 
     def _create_fs(self, fstype, volume):
         """
@@ -1605,6 +2047,7 @@ class StorageHandle(object):
         if self.options.verbose:
             if fstype in EXTN:
                 command.insert(1, '-v')
+        self.system_snapshot.invalidate_signature(volume)
         return misc.run(command, stdout=True)[0]
 
     def _do_mount(self, volume, options=None, directory=None):
@@ -1675,7 +2118,7 @@ class StorageHandle(object):
         else:
             have_size = float(have_size)
 
-        changed = False
+        changed = set()
 
         devices = args.device
         args.device = []
@@ -1684,12 +2127,15 @@ class StorageHandle(object):
             if self.dev[dev] and 'pool_name' in self.dev[dev] and \
                self.dev[dev]['pool_name'] != args.pool.name:
                 if PR.check(PR.DEVICE_USED, [dev, self.dev[dev]['pool_name']]):
+                    # Devices of all the backends are merged in a single
+                    # DeviceInfo, only the pool tells which backend it is
+                    pool = self.pool[self.dev[dev]['pool_name']]
                     remove_args = Struct()
                     remove_args.all = False
                     remove_args.items = [self.dev[dev]]
                     if self.remove(remove_args):
                         args.device.append(dev)
-                        changed = True
+                        changed.add(pool.backend_name if pool else None)
                     elif new_size is None:
                         PR.error("Device \'{0}\' can not be used".format(dev))
                     else:
@@ -1719,7 +2165,7 @@ class StorageHandle(object):
                     except problem.FsMounted:
                         args.device.remove(dev)
                         continue
-                signature = misc.get_fs_type(dev)
+                signature = self.system_snapshot.get_fs_type(dev)
                 if signature and \
                    PR.check(PR.EXISTING_FILESYSTEM, [signature, dev]):
                     misc.wipefs(dev, signature)
@@ -1730,8 +2176,10 @@ class StorageHandle(object):
                 else:
                     args.device.append(dev)
 
-        if changed:
+        if None in changed:
             self.reinit_dev()
+        elif changed:
+            self.reinit_dev(backends=list(changed), items=args.device)
 
         for dev in devices:
             if not self.dev[dev]:
@@ -1871,6 +2319,7 @@ class StorageHandle(object):
             crypt.set_passphrase(password, force=force_weak_password)
 
         lvname = self.create_volume(args)
+        changed_backends = [args.pool.backend_name]
 
         if args.encrypt and misc.is_bdevice(lvname) and \
            SSM_DEFAULT_BACKEND != 'crypt':
@@ -1880,13 +2329,14 @@ class StorageHandle(object):
                                       size=None,
                                       options=options,
                                       name=args.name)
+            changed_backends.append('crypt')
 
         if args.fstype and args.pool.type != 'btrfs':
             if self._create_fs(args.fstype, lvname) != 0:
                 self._mpoint = None
         if self._mpoint:
             create_directory(self._mpoint)
-            self.reinit_vol()
+            self.reinit_vol(backends=changed_backends, items=[lvname])
             self._do_mount(self.vol[lvname], args.mnt_options)
 
     def create_volume(self, args):
@@ -2001,7 +2451,7 @@ class StorageHandle(object):
             # Pool has been changed so reinitialize it so we can
             # calculate the size properly
             if pool_changed:
-                self.reinit_pool()
+                self.reinit_pool(backends=[args.pool.backend_name])
                 args.pool = self.pool[args.pool.name]
             vol_size = calculate_size(args.size, args.pool)
 
@@ -2015,21 +2465,76 @@ class StorageHandle(object):
         """
         List devices, pools, volumes
         """
+        pool = getattr(args, 'pool', None)
+        where = getattr(args, 'where', None) or []
+        fields = getattr(args, 'fields', None)
+        no_fs = getattr(args, 'no_fs', False)
+
+        # Let the backends know before anything is discovered, so they can
+        # skip what is not in the pool
+        if pool:
+            self.options.pool_filter = pool
+
+        def cond_func(item):
+            if pool and not in_pool(item, pool):
+                return False
+            for key, value in where:
+                if str(item[key]) != value:
+                    return False
+            return True
+
+        # Sources are only discovered when we get to them, so the records
+        # of the first ones can go out before the others are discovered
         if not args.type:
-            self.dev.psummary()
-            self.pool.psummary()
-            self.vol.psummary(more_data=self.dev.filesystems())
-            self.snap.psummary()
+            tables = [('dev', {}), ('pool', {}), ('vol', {}), ('snap', {})]
         elif args.type in ['fs', 'filesystems']:
-            self.vol.psummary(more_data=self.dev.filesystems(), cond="fs_only")
+            if no_fs:
+                err = "File systems can not be listed with --no-fs."
+                raise argparse.ArgumentTypeError(err)
+            tables = [('vol', {'cond': "fs_only"})]
         elif args.type in ['dev', 'devices']:
-            self.dev.psummary()
+            tables = [('dev', {})]
         elif args.type in ["volumes", "vol"]:
-            self.vol.psummary(more_data=self.dev.filesystems())
+            tables = [('vol', {})]
         elif args.type in ["pool", "pools"]:
-            self.pool.psummary()
+            tables = [('pool', {})]
         elif args.type in ['snap', 'snapshots']:
-            self.snap.psummary()
+            tables = [('snap', {})]
+
+        for source, kwargs in tables:
+            kwargs['fields'] = fields
+            if pool or where:
+                kwargs['cond_func'] = cond_func
+            if source != 'vol':
+                continue
+            # File systems are only probed for the columns which need them,
+            # and not at all without the file system columns
+            if no_fs:
+                kwargs['fields'] = [attr for attr in fields or self.vol.attrs
+                                    if not attr.startswith("fs_")]
+            else:
+                kwargs['more_data'] = self.dev.filesystems()
+
+        output = getattr(args, 'output', 'text')
+        if output == 'text':
+            for source, kwargs in tables:
+                getattr(self, source).psummary(**kwargs)
+            return
+
+        def records():
+            for source, kwargs in tables:
+                for record in getattr(self, source).records(**kwargs):
+                    yield record
+
+        columns = None
+        if output == 'csv':
+            # All the attributes of the listed sources make up the columns
+            columns = ['object']
+            for source, kwargs in tables:
+                for attr in kwargs['fields'] or getattr(self, source).attrs:
+                    if attr not in columns:
+                        columns.append(attr)
+        misc.precords(records(), output, columns)
 
     def info(self, args):
         """
@@ -2037,6 +2542,22 @@ class StorageHandle(object):
         """
         sources = [self.pool, self.dev, self.vol, self.snap]
         create_graph(*sources)
+        output = getattr(args, 'output', 'text')
+        if output != 'text':
+            found = []
+
+            def records():
+                for source in sources:
+                    for record in source.details(item=args.item):
+                        found.append(record['name'])
+                        yield record
+
+            misc.precords(records(), output)
+            if args.item and not found:
+                err = "The item '%s' was not found." % args.item
+                raise argparse.ArgumentTypeError(err)
+            return
+
         print("EXPERIMENTAL FEATURE (The format can yet change)\n")
 
         if not args.item:
@@ -2082,7 +2603,7 @@ class StorageHandle(object):
                             args.device.remove(dev)
                             continue
                     else:
-                        signature = misc.get_fs_type(dev)
+                        signature = self.system_snapshot.get_fs_type(dev)
                         if signature and \
                            PR.check(PR.EXISTING_FILESYSTEM,
                                     [signature, dev]):
@@ -2185,6 +2706,7 @@ class StorageHandle(object):
         source_pool = None
         target_pool = None
         changed = False
+        changed_backends = []
         source = self.dev[args.source]
         if source and 'pool_name' in source:
             source_pool = self.pool[source['pool_name']]
@@ -2201,6 +2723,7 @@ class StorageHandle(object):
                 if not PR.check(PR.DEVICE_USED, [target.name, target['pool_name']]):
                     raise problem.UserInterrupted("Terminated by user!")
                 target_pool.reduce(target.name)
+                changed_backends.append(target_pool.backend_name)
                 target_pool = None
                 changed = True
             elif target_pool.type == "btrfs":
@@ -2213,7 +2736,7 @@ class StorageHandle(object):
                 if PR.check(PR.FS_MOUNTED, [args.target, target['mount']]):
                     misc.do_umount(target.name)
             else:
-                signature = misc.get_signature(args.target)
+                signature = self.system_snapshot.get_signature(args.target)
                 if signature and \
                    PR.check(PR.EXISTING_SIGNATURE,
                             [signature, args.target]):
@@ -2232,7 +2755,7 @@ class StorageHandle(object):
 
 
         if changed:
-            self.reinit_dev()
+            self.reinit_dev(backends=changed_backends, items=[args.target])
             source = self.dev[args.source]
             target = self.dev[args.target]
 
@@ -2338,16 +2861,8 @@ class StorageHandle(object):
         raise argparse.ArgumentTypeError(err)
 
     def can_snapshot(self, string):
-        vol = self.vol[string]
-        have = False
+        vol = self.vol[string] or self.vol.get_mounted(string)
         if not vol:
-            for vol in self.vol:
-                if 'mount' in vol and (vol['mount'] == string.rstrip("/")):
-                    have = True
-                    break
-        else:
-            have = True
-        if not have:
             err = "'{0}' is not valid volume nor mount point.".format(string)
             raise argparse.ArgumentTypeError(err)
         else:
@@ -2382,13 +2897,59 @@ class StorageHandle(object):
                     return device
             except argparse.ArgumentTypeError:
                 pass
-        for vol in self.vol:
-            if 'mount' in vol and (vol['mount'] == string.rstrip("/")):
-                return vol
+        vol = self.vol.get_mounted(string)
+        if vol:
+            return vol
         err = "'{0}' is not valid pool nor volume".format(string)
         raise argparse.ArgumentTypeError(err)
 
 
+def valid_fields(string):
+    """ Validate the comma separated list of attributes to print.
+
+    >>> valid_fields("dev_name,pool_name")
+    ['dev_name', 'pool_name']
+    >>> valid_fields(",")
+    Traceback (most recent call last):
+    ...
+    ArgumentTypeError: ',' is not valid list of fields.
+    """
+    fields = [field.strip() for field in string.split(",") if field.strip()]
+    if not fields:
+        err = "'{0}' is not valid list of fields.".format(string)
+        raise argparse.ArgumentTypeError(err)
+    return fields
+
+
+def valid_where(string):
+    """ Validate the key=value condition items have to match.
+
+    >>> valid_where("type=linear")
+    ('type', 'linear')
+    >>> valid_where("mount=")
+    ('mount', '')
+    >>> valid_where("linear")
+    Traceback (most recent call last):
+    ...
+    ArgumentTypeError: 'linear' is not valid condition, use key=value.
+    """
+    key, sep, value = string.partition("=")
+    if not sep or not key.strip():
+        err = "'{0}' is not valid condition, use key=value.".format(string)
+        raise argparse.ArgumentTypeError(err)
+    return (key.strip(), value)
+
+
+def in_pool(item, pool):
+    """ Return True if the item is the pool 'pool' or belongs into it. Thin
+        pools can be given with their parent pool as well, like vg/pool.
+    """
+    if item['pool_name'] == pool:
+        return True
+    return bool(item['parent_pool']) and \
+        "{0}/{1}".format(item['parent_pool'], item['pool_name']) == pool
+
+
 def valid_size(size):
     """ Validate that the 'size' is usable size argument. This is almost the
     same as valid_resize_size() except we do not allow '+' and '-' signs
@@ -2596,6 +3157,13 @@ class SsmParser(object):
         self.args = self.parser.parse_args()
         return self.args
 
+    @staticmethod
+    def _supported_crypt():
+        # Encryption is only possible with the crypt backend enabled
+        if not backends.is_enabled('crypt'):
+            return []
+        return backends.get_module('crypt').SUPPORTED_CRYPT
+
     def _get_parser_global(self, prog):
         """
         General ssm options
@@ -2730,7 +3298,7 @@ class SsmParser(object):
                 help="Pool to use to create the new volume.",
                 type=self.storage.is_pool)
         parser_create.add_argument('-e', '--encrypt', nargs='?',
-                choices=crypt.SUPPORTED_CRYPT, const=True,
+                choices=self._supported_crypt(), const=True,
                 help='''Create encrpted volume. Extension to use can be
                      specified.''')
         parser_create.add_argument('-o', '--mnt-options',
@@ -2765,6 +3333,22 @@ class SsmParser(object):
         parser_list.add_argument('type', nargs='?',
                 choices=["volumes", "vol", "dev", "devices", "pool", "pools",
                     "fs", "filesystems", "snap", "snapshots"])
+        parser_list.add_argument('-p', '--pool',
+                help='''List only the pool of this name and what is in
+                     it. Backends which can, discover only this pool.''')
+        parser_list.add_argument('--fields', type=valid_fields,
+                help='''Comma separated list of attributes to list instead of
+                     the default columns, for example
+                     dev_name,pool_name,vol_size.''')
+        parser_list.add_argument('-w', '--where', type=valid_where,
+                action='append',
+                help='''List only items with the attribute matching the value,
+                     given as key=value. Can be used more than once.''')
+        parser_list.add_argument('--no-fs', action='store_true',
+                help='''Do not probe the file systems. Volumes are listed
+                     without the file system columns and devices with a file
+                     system are not listed as volumes.''')
+        self._add_output_argument(parser_list)
         parser_list.set_defaults(func=self.storage.list)
         return parser_list
 
@@ -2776,9 +3360,19 @@ class SsmParser(object):
                 help='''Show detailed information about
                      an object. EXPERIMENTAL''')
         parser_info.add_argument('item', nargs='?')
+        self._add_output_argument(parser_info)
         parser_info.set_defaults(func=self.storage.info)
         return parser_info
 
+    @staticmethod
+    def _add_output_argument(parser):
+        parser.add_argument('-o', '--output', choices=OUTPUT_FORMATS,
+                default='text',
+                help='''Output format. Other than the default 'text' table
+                     the sizes are in bytes, 'json' prints a single list of
+                     records, 'ndjson' a record per line as soon as it is
+                     known and 'csv' a header and a line per record.''')
+
     def _get_parser_add(self):
         """
         Add command
@@ -2928,9 +3522,21 @@ def main(args=None):
     if args.dry_run:
         return 0
 
+    # Only listing commands can use the saved discovery results, anything
+    # else might change the system so make sure they are not used again
+    read_only = args.func in [storage.list, storage.info]
+    if read_only:
+        storage.load_discovery_cache()
+    else:
+        misc.drop_discovery_cache()
+
     try:
         args.func(args)
     except argparse.ArgumentTypeError as ex:
         ssm_parser.parser.error(ex)
 
+    # Discovery limited to a single pool is not worth remembering
+    if read_only and not options.pool_filter:
+        misc.save_discovery_cache()
+
     return 0
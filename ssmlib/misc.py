@@ -20,11 +20,19 @@ from __future__ import print_function
 import os
 import re
 import sys
+import csv
+import json
 import stat
+import time
+import pickle
+import hashlib
 import tempfile
 import threading
 import subprocess
+from collections import namedtuple
 from ssmlib import problem
+from ssmlib import dm
+from ssmlib import superblock
 from base64 import encode
 
 if sys.version < '3':
@@ -38,6 +46,33 @@ else:
 # before exiting
 TMP_MOUNTED = []
 
+# Directory for information worth keeping between runs of ssm. It can be
+# set to an empty string to keep nothing on the disk.
+try:
+    SSM_CACHE_DIR = os.environ['SSM_CACHE_DIR']
+except KeyError:
+    SSM_CACHE_DIR = "/var/cache/ssm"
+
+# Maximum age in seconds of the discovery results saved for 'list' and
+# 'info'. Zero means that nothing is saved.
+try:
+    SSM_DISCOVERY_CACHE = int(os.environ['SSM_DISCOVERY_CACHE'])
+except (KeyError, ValueError):
+    SSM_DISCOVERY_CACHE = 0
+
+# Number of threads reading the superblocks, see probe_signatures()
+try:
+    SSM_PROBE_WORKERS = int(os.environ['SSM_PROBE_WORKERS'])
+except (KeyError, ValueError):
+    SSM_PROBE_WORKERS = 8
+
+# Absolute paths of the executables we have looked up so far. The PATH does
+# not change while we are running, so there is no need to look again.
+BINARY_PATHS = {}
+
+# Where the kernel lists all the block devices, see get_partitions()
+SYS_BLOCK_DIR = "/sys/class/block"
+
 # A debug flag, because we can't reach to main.py from here
 VERBOSE_VV_FLAG = False
 VERBOSE_VVV_FLAG = False
@@ -254,11 +289,31 @@ def get_file_size(path):
         return os.lseek(f.fileno(), os.SEEK_SET, os.SEEK_END) // 1024
 
 
+def find_binary(name):
+    """ Return the absolute path of the executable 'name' searched for in
+        the PATH, or None if there is no such executable. The result is
+        remembered for the rest of the run.
+    """
+    try:
+        return BINARY_PATHS[name]
+    except KeyError:
+        pass
+    found = None
+    if os.path.dirname(name):
+        candidates = [name]
+    else:
+        candidates = [os.path.join(path.strip('"'), name) for path in
+                      os.environ.get('PATH', os.defpath).split(os.pathsep)]
+    for candidate in candidates:
+        if os.path.isfile(candidate) and os.access(candidate, os.X_OK):
+            found = os.path.abspath(candidate)
+            break
+    BINARY_PATHS[name] = found
+    return found
+
+
 def check_binary(name):
-    command = ['which', name]
-    if run(command, can_fail=True)[0]:
-        return False
-    return True
+    return find_binary(name) is not None
 
 
 def do_mount(device, directory, options=None):
@@ -266,6 +321,7 @@ def do_mount(device, directory, options=None):
     if options:
         command.extend(['-o', options])
     command.extend([device, directory])
+    get_snapshot().invalidate_mounts()
     run(command)
 
 
@@ -273,6 +329,7 @@ def do_umount(mpoint, all_targets=False):
     command = ['umount']
     if all_targets:
         command.append('--all-targets')
+    get_snapshot().invalidate_mounts()
     try:
         run(command + [mpoint])
     except RuntimeError:
@@ -303,6 +360,11 @@ def do_cleanup():
 
 
 def get_signature(device, types=None):
+    signature = superblock.detect(device)
+    if signature:
+        if types is None or signature[1] in types.split(","):
+            return signature[0]
+        return None
     command = ["blkid", "-o", "value", "-p", "-s", "TYPE"]
     if types is not None:
         command.extend(['-u', types])
@@ -320,6 +382,68 @@ def get_fs_type(device):
     return get_signature(device, "filesystem")
 
 
+def probe_signatures(devices):
+    """ Probe signatures of all the devices. The superblocks ssm knows
+        about are read directly, see superblock.detect(), and everything
+        else is left to a single blkid call.
+
+    Parameters
+    ----------
+    devices : list of str
+        Devices to probe.
+
+    Returns
+    -------
+    dict
+        (type, usage) tuple for every device with a signature, for example
+        ('ext4', 'filesystem') or ('crypto_LUKS', 'crypto'). Devices
+        without any signature are left out.
+    """
+    signatures = {}
+    if not devices:
+        return signatures
+    unknown = []
+    found = parallel_map(superblock.detect, devices, SSM_PROBE_WORKERS)
+    for device, signature in zip(devices, found):
+        if signature:
+            signatures[device] = signature
+        else:
+            unknown.append(device)
+    if not unknown:
+        return signatures
+    command = ["blkid", "-p", "-o", "export", "-s", "TYPE", "-s", "USAGE"]
+    # blkid fails when any of the devices does not have a signature, but
+    # it still prints out the rest of them.
+    output = run(command + unknown, can_fail=True, stderr=False)[1]
+    for block in (output or "").split("\n\n"):
+        values = dict([line.split("=", 1) for line in block.splitlines()
+                       if "=" in line])
+        if 'DEVNAME' in values and 'TYPE' in values:
+            signatures[values['DEVNAME']] = (values['TYPE'],
+                                             values.get('USAGE'))
+    return signatures
+
+
+def device_number(major, minor):
+    """ Return the device number as a tuple of strings used to join the
+        information from different sources, or None if it is not known,
+        like for inactive logical volumes.
+
+    >>> device_number(8, '1')
+    ('8', '1')
+    >>> device_number('-1', '-1')
+    >>> device_number('', None)
+    """
+    try:
+        major = int(major)
+        minor = int(minor)
+    except (TypeError, ValueError):
+        return None
+    if major < 0 or minor < 0:
+        return None
+    return (str(major), str(minor))
+
+
 def get_real_device(device):
     if os.path.islink(device):
         return os.path.abspath(os.path.join(os.path.dirname(device),
@@ -335,11 +459,125 @@ def get_swaps():
     return swap
 
 
+# A block device as found by get_partitions(). The first fields are the
+# same as the columns lsblk used to give us, so the rows can be still used
+# as lists: the device number, size in KiB, kernel name, the name under
+# which the device is known (/dev/mapper/ for device mapper) and the name of
+# the parent device, if any. Holders and slaves are kernel names of the
+# devices on top of, or below this one.
+BlockDevice = namedtuple('BlockDevice', [
+    'major', 'minor', 'size', 'kname', 'name', 'parent', 'partition',
+    'holders', 'slaves', 'dm_name', 'dm_uuid', 'logical_block_size',
+    'physical_block_size', 'optimal_io_size', 'rotational'])
+BlockDevice.__new__.__defaults__ = ('', False, (), (), '', '', 512, 512, 0,
+                                    False)
+
+
+def _read_sysfs(path, default=None):
+    try:
+        with open(path, 'r') as f:
+            return f.read().strip()
+    except (IOError, OSError):
+        return default
+
+
+def _list_sysfs(path):
+    try:
+        return sorted(os.listdir(path))
+    except OSError:
+        return []
+
+
+def _sys_block_device(name):
+    """ Read everything we want to know about the block device 'name' from
+        its sysfs directory. Return None for devices lsblk would not list.
+    """
+    path = os.path.join(SYS_BLOCK_DIR, name)
+    number = _read_sysfs(os.path.join(path, "dev"), "")
+    size = _read_sysfs(os.path.join(path, "size"))
+    if ':' not in number or size is None:
+        return None
+    major, minor = number.split(':', 1)
+    # Neither RAM disks nor unused loop devices, the same as lsblk
+    if major == '1' or (major == '7' and int(size) == 0):
+        return None
+
+    kname = "/dev/" + name.replace('!', '/')
+    holders = tuple("/dev/" + dev for dev in _list_sysfs(path + "/holders"))
+    slaves = tuple("/dev/" + dev for dev in _list_sysfs(path + "/slaves"))
+    partition = os.path.exists(os.path.join(path, "partition"))
+    if partition:
+        # The partition lives in the directory of the whole disk
+        parent = os.path.basename(os.path.dirname(os.readlink(path)))
+        queue = os.path.join(SYS_BLOCK_DIR, parent, "queue")
+        parent = "/dev/" + parent.replace('!', '/')
+    else:
+        parent = slaves[0] if slaves else ''
+        queue = os.path.join(path, "queue")
+
+    dm_name = _read_sysfs(os.path.join(path, "dm/name"), "")
+    name = "/dev/mapper/" + dm_name if dm_name else kname
+
+    def limit(name, default):
+        return int(_read_sysfs(os.path.join(queue, name), default))
+
+    return BlockDevice(
+        major, minor, int(size) // 2, kname, name, parent, partition,
+        holders, slaves, dm_name,
+        _read_sysfs(os.path.join(path, "dm/uuid"), ""),
+        limit("logical_block_size", 512), limit("physical_block_size", 512),
+        limit("optimal_io_size", 0), limit("rotational", 0) == 1)
+
+
 def get_partitions():
+    """ Return a BlockDevice for every block device in the system, read
+        straight from sysfs.
+    """
+    try:
+        names = sorted(os.listdir(SYS_BLOCK_DIR))
+    except OSError:
+        # No sysfs, ask lsblk then
+        return _get_lsblk_partitions()
+    partitions = []
+    for name in names:
+        try:
+            device = _sys_block_device(name)
+        except (IOError, OSError, ValueError):
+            # The device went away while we were looking at it
+            continue
+        if device:
+            partitions.append(device)
+    return partitions
+
+
+def is_partition_name(name, parent):
+    """ Return True if 'name' is what the kernel would call a partition of
+        'parent'. The partition number is appended to the parent name, with
+        a 'p' in between when the parent name ends with a digit.
+
+    >>> is_partition_name('/dev/sda1', '/dev/sda')
+    True
+    >>> is_partition_name('/dev/nvme0n1p1', '/dev/nvme0n1')
+    True
+    >>> is_partition_name('/dev/dm-10', '/dev/dm-1')
+    False
+    >>> is_partition_name('/dev/sdab', '/dev/sda')
+    False
+    """
+    if not parent or name == parent or not name.startswith(parent):
+        return False
+    suffix = name[len(parent):]
+    if parent[-1].isdigit():
+        if not suffix.startswith("p"):
+            return False
+        suffix = suffix[1:]
+    return suffix.isdigit()
+
+
+def _get_lsblk_partitions():
     partitions = []
-    new_line = []
-    output = run(["lsblk", "-l", "-b", "-n", "-p", "-o", "MAJ:MIN,SIZE,KNAME,NAME,PKNAME"],
-                 stdout=False)
+    output = run(["lsblk", "-l", "-b", "-n", "-p", "-o",
+                  "MAJ:MIN,SIZE,KNAME,NAME,PKNAME"], stdout=False)
 
     for line in output[1].splitlines():
         new_line = re.split(r'\s+|:', line.strip())
@@ -347,9 +585,7 @@ def get_partitions():
         # if we got data, convert the size to kB
         if len(new_line) in [5, 6]:
             new_line[2] = int(new_line[2])//1024
-            partitions.append(new_line)
-        else:
-            pass
+            partitions.append(BlockDevice(*new_line))
     return partitions
 
 
@@ -357,6 +593,8 @@ def get_mountinfo(regex=".*"):
     mounts = {}
     reg = re.compile(regex)
     names = ['id', 'parent', 'major_minor', 'root', 'mp', 'options']
+    # Many mounts share the same source, resolve each of them only once
+    real_devices = {}
     with open('/proc/self/mountinfo', 'r') as f:
         for line in f:
             m = reg.search(line)
@@ -372,7 +610,10 @@ def get_mountinfo(regex=".*"):
             row['fs'] = array[1]
             row['dev'] = array[2]
             row['sb_options'] = array[3]
-            dev = get_real_device(row['dev'])
+            try:
+                dev = real_devices[row['dev']]
+            except KeyError:
+                dev = real_devices[row['dev']] = get_real_device(row['dev'])
             if row['root'] != '/':
                 dev = "{0}:{1}".format(dev, row['root'])
             mounts[dev] = row
@@ -408,6 +649,559 @@ def get_dmnumber(name):
                 break
     return dmnumber
 
+class SystemSnapshot(object):
+    """
+    Information about mounts, swaps, device numbers and block devices in the
+    system shared by all the backends. Every piece of information is read
+    only once, when it is needed for the first time, and it is kept until it
+    is invalidated. It should be invalidated whenever ssm changes something
+    which might affect the information.
+
+    Backends can also keep their own data here with cached(), so it is
+    dropped together with the rest of the snapshot.
+    """
+
+    def __init__(self):
+        self._data = {}
+        # Backends might be discovered in parallel, so make sure that every
+        # piece of information is gathered only once.
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        # Set when the snapshot can be saved by save_discovery_cache()
+        self.fingerprint = None
+
+    def invalidate(self, key=None):
+        """ Drop the information stored under 'key', or everything if
+            the key is not provided.
+        """
+        with self._lock:
+            if key is None:
+                self._data = {}
+            else:
+                self._data.pop(key, None)
+
+    def cached(self, key, func):
+        """ Return the value stored under 'key'. If there is no such value
+            yet, call func() to get it and store it.
+        """
+        try:
+            return self._data[key]
+        except KeyError:
+            pass
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            try:
+                return self._data[key]
+            except KeyError:
+                value = self._data[key] = func()
+                return value
+
+    @property
+    def mounts(self):
+        """ Mounted devices as returned by get_mounts(). """
+        return self.cached('mounts', get_mounts)
+
+    def get_mount(self, device, major=None, minor=None):
+        """ Return mount information for the device or None if it is not
+            mounted. With the device number known, the mount is found by
+            the number, so the device name does not need to be resolved.
+        """
+        number = device_number(major, minor)
+        if number:
+            mount = self.cached('mount_numbers', self._index_mounts).get(number)
+            if mount:
+                return mount
+        return self.mounts.get(device)
+
+    def _index_mounts(self):
+        # Only mounts of the whole file system, the same as the device
+        # names in get_mounts() without the root appended
+        numbers = {}
+        for mount in self.mounts.values():
+            if mount.get('root', '/') != '/' or 'major_minor' not in mount:
+                continue
+            number = device_number(*mount['major_minor'].split(':'))
+            if number:
+                numbers[number] = mount
+        return numbers
+
+    def invalidate_mounts(self):
+        """ Drop the mount table after something was (un)mounted. """
+        for key in ['mounts', 'mount_numbers', 'fs_infos']:
+            self.invalidate(key)
+
+    @property
+    def swaps(self):
+        """ Active swaps as returned by get_swaps(). """
+        return self.cached('swaps', get_swaps)
+
+    def is_swap(self, device, major=None, minor=None):
+        """ Return True if the device is used as a swap. The device number
+            is used the same way as in get_mount().
+        """
+        number = device_number(major, minor)
+        if number and number in self.cached('swap_numbers',
+                                            self._index_swaps):
+            return True
+        swaps = self.cached('swap_devices',
+                            lambda: set([swap[0] for swap in self.swaps]))
+        return device in swaps
+
+    def _index_swaps(self):
+        numbers = set()
+        for swap in self.swaps:
+            try:
+                info = os.stat(swap[0])
+            except OSError:
+                continue
+            # Swap files live on some other device
+            if stat.S_ISBLK(info.st_mode):
+                numbers.add((str(os.major(info.st_rdev)),
+                             str(os.minor(info.st_rdev))))
+        return numbers
+
+    def get_real_device(self, device, major=None, minor=None):
+        """ Return the kernel name of the device, the same as
+            get_real_device(). With the device number known it is looked up
+            in the block device table, otherwise every name is resolved only
+            once.
+        """
+        number = device_number(major, minor)
+        if number:
+            name = self.get_device_by_number(*number)
+            if name:
+                return name
+        real_devices = self.cached('real_devices', dict)
+        try:
+            return real_devices[device]
+        except KeyError:
+            real = real_devices[device] = get_real_device(device)
+            return real
+
+    @property
+    def partitions(self):
+        """ Block devices as returned by get_partitions(). """
+        return self.cached('partitions', get_partitions)
+
+    def get_partition(self, device):
+        """ Return the row of get_partitions() for the device or None. """
+        return self.cached('partitions_index',
+                           lambda: dict([(line[3], line)
+                                         for line in self.partitions])
+                           ).get(device)
+
+    def get_stack(self, device):
+        """ Return the kernel names of all the block devices 'device' is
+            built on, from the top down. Those are the slaves of device
+            mapper and md devices and the disks of partitions, so for a
+            logical volume on an encrypted md array on multipath devices,
+            all of them down to the disks.
+        """
+        stack = []
+        below = [self.get_real_device(device)]
+        while below:
+            row = self.get_partition(below.pop(0))
+            if not row:
+                continue
+            parents = list(row.slaves)
+            if row.partition and row.parent:
+                parents.append(row.parent)
+            for parent in parents:
+                if parent not in stack:
+                    stack.append(parent)
+                    below.append(parent)
+        return stack
+
+    def get_device_by_number(self, major, minor):
+        """ Return the name of the block device with given major and minor
+            number, or None.
+        """
+        numbers = self.cached('partitions_numbers',
+                              lambda: dict([((line[0], line[1]), line[3])
+                                            for line in self.partitions]))
+        return numbers.get((str(major), str(minor)))
+
+    @property
+    def dm_tables(self):
+        """ Tables of all device mapper devices as returned by
+            dm.get_tables(), or None if we can not ask the device mapper
+            directly and the caller needs to fall back to dmsetup.
+        """
+        return self.cached('dm_tables', _get_dm_tables)
+
+    def get_dm_name(self, major, minor):
+        """ Return the device mapper name of the device with given major and
+            minor number, or None.
+        """
+        def index():
+            return dict([((str(table['major']), str(table['minor'])),
+                          table['name']) for table in self.dm_tables or []])
+        return self.cached('dm_names', index).get((str(major), str(minor)))
+
+    def _probe_all_signatures(self):
+        devices = [line[3] for line in self.partitions]
+        signatures = probe_signatures(devices)
+        # Remember the devices without any signature as well
+        for device in devices:
+            signatures.setdefault(device, None)
+        return signatures
+
+    def _signature(self, device):
+        # Probe every known block device at once, the first time any
+        # signature is needed. Anything else is probed separately.
+        signatures = self.cached('signatures', self._probe_all_signatures)
+        if device not in signatures:
+            with self._lock:
+                signatures.update(probe_signatures([device]))
+                signatures.setdefault(device, None)
+        return signatures.get(device)
+
+    def invalidate_signature(self, device):
+        """ Drop the signature of a single device, it is probed again
+            when needed.
+        """
+        with self._lock:
+            self._data.get('signatures', {}).pop(device, None)
+            # File systems are cached by device number, not by name
+            self._data.pop('fs_infos', None)
+
+    def invalidate_devices(self):
+        """ Drop the block device table after devices might have been
+            created or removed.
+        """
+        for key in ['partitions', 'partitions_index', 'partitions_numbers',
+                    'dm_tables', 'dm_names', 'swap_devices', 'swap_numbers',
+                    'swaps', 'real_devices', 'fs_infos']:
+            self.invalidate(key)
+
+    def get_signature(self, device):
+        """ Return the type of signature on the device, the same as
+            get_signature(), or None if there is no signature.
+        """
+        signature = self._signature(device)
+        if signature:
+            return signature[0]
+        return None
+
+    def get_fs_type(self, device):
+        """ Return the type of file system on the device, the same as
+            get_fs_type(), or None if there is no file system.
+        """
+        signature = self._signature(device)
+        if signature and signature[1] == 'filesystem':
+            return signature[0]
+        return None
+
+    def get_dmnumber(self, name):
+        """ Return the major number for the driver 'name' from
+            /proc/devices, or None.
+        """
+        return self.cached('devices', _read_proc_devices).get(name)
+
+
+def _get_dm_tables():
+    try:
+        return dm.get_tables()
+    except (OSError, IOError):
+        return None
+
+
+def _read_proc_devices():
+    devices = {}
+    with open('/proc/devices', 'r') as f:
+        for line in f:
+            array = line.split()
+            # The first match wins, same as in get_dmnumber()
+            if len(array) == 2 and array[1] not in devices:
+                devices[array[1]] = array[0]
+    return devices
+
+
+# Snapshot of the system information shared by all the backends. This is
+# replaced by every StorageHandle, see new_snapshot().
+SYSTEM_SNAPSHOT = None
+
+
+def get_snapshot():
+    """ Return current SystemSnapshot. """
+    global SYSTEM_SNAPSHOT
+    if SYSTEM_SNAPSHOT is None:
+        SYSTEM_SNAPSHOT = SystemSnapshot()
+    return SYSTEM_SNAPSHOT
+
+
+def new_snapshot():
+    """ Replace current SystemSnapshot with a new one and return it. """
+    global SYSTEM_SNAPSHOT
+    SYSTEM_SNAPSHOT = SystemSnapshot()
+    return SYSTEM_SNAPSHOT
+
+
+# Files which change whenever block devices, their signatures, mounts or
+# swaps do. Every uevent, including the one udev sends after a block device
+# was written to, bumps uevent_seqnum.
+FINGERPRINT_FILES = ["/proc/partitions", "/proc/self/mountinfo",
+                     "/proc/swaps", "/proc/mdstat", "/sys/kernel/uevent_seqnum"]
+
+# lvm writes the metadata backup of a volume group on every change of it
+LVM_BACKUP_DIR = "/etc/lvm/backup"
+
+# SystemSnapshot keys saved by save_discovery_cache(). Only the layout of the
+# storage goes there, none of it changes without the fingerprint changing as
+# well. Never add anything volatile, like the file system usage ('fs_infos'),
+# lvm data and metadata usage ('lvm_report') or btrfs usage
+# ('btrfs_topology'), nor anything secret, like the device mapper tables
+# ('dm_tables') which contain the dm-crypt keys.
+DISCOVERY_CACHE_KEYS = frozenset([
+    'devices', 'dm_names', 'md_arrays', 'mount_numbers', 'mounts',
+    'multipath_maps', 'partitions', 'partitions_index', 'partitions_numbers',
+    'real_devices', 'signatures', 'swap_devices', 'swap_numbers', 'swaps'])
+
+
+def system_fingerprint():
+    """ Return a cheap fingerprint of the storage configuration, which
+        changes whenever anything ssm discovers might have changed.
+    """
+    digest = hashlib.sha1()
+    for path in FINGERPRINT_FILES:
+        try:
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+        except (IOError, OSError):
+            digest.update(b"-")
+    try:
+        for name in sorted(os.listdir(LVM_BACKUP_DIR)):
+            st = os.stat(os.path.join(LVM_BACKUP_DIR, name))
+            digest.update("{0} {1} {2}\n".format(name, st.st_mtime,
+                                                  st.st_size).encode())
+    except (IOError, OSError):
+        pass
+    # The environment decides what ssm looks at
+    digest.update(repr(sorted((name, value) for name, value in
+                              os.environ.items()
+                              if name.startswith("SSM_"))).encode())
+    return digest.hexdigest()
+
+
+def _discovery_cache_path():
+    if not SSM_CACHE_DIR:
+        return None
+    return os.path.join(SSM_CACHE_DIR, "discovery.cache")
+
+
+def load_discovery_cache():
+    """ Replace current SystemSnapshot with a new one filled with the
+        information saved by save_discovery_cache(), as long as it is not
+        older than SSM_DISCOVERY_CACHE seconds and the system fingerprint
+        did not change since. Return the new snapshot.
+    """
+    snapshot = new_snapshot()
+    snapshot.fingerprint = system_fingerprint()
+    path = _discovery_cache_path()
+    if not path or SSM_DISCOVERY_CACHE <= 0:
+        return snapshot
+    try:
+        st = os.stat(path)
+        # Never load anything somebody else could have written
+        if st.st_uid != os.geteuid() or st.st_mode & 0o022:
+            return snapshot
+        if time.time() - st.st_mtime > SSM_DISCOVERY_CACHE:
+            return snapshot
+        with open(path, 'rb') as f:
+            fingerprint, data = pickle.load(f)
+    except (IOError, OSError, EOFError, ValueError, TypeError,
+            AttributeError, ImportError, pickle.UnpicklingError):
+        return snapshot
+    if fingerprint == snapshot.fingerprint:
+        snapshot._data.update((key, value) for key, value in data.items()
+                              if key in DISCOVERY_CACHE_KEYS)
+    return snapshot
+
+
+def save_discovery_cache():
+    """ Save the information from current SystemSnapshot so it can be
+        reused by load_discovery_cache(). Only the DISCOVERY_CACHE_KEYS are
+        saved, everything else is gathered again on every run.
+    """
+    snapshot = get_snapshot()
+    path = _discovery_cache_path()
+    if not path or SSM_DISCOVERY_CACHE <= 0 or snapshot.fingerprint is None:
+        return
+    tmp = None
+    try:
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".discovery")
+        with os.fdopen(fd, 'wb') as f:
+            data = dict((key, value) for key, value in snapshot._data.items()
+                        if key in DISCOVERY_CACHE_KEYS)
+            pickle.dump((snapshot.fingerprint, data), f, 2)
+        os.rename(tmp, path)
+    except (IOError, OSError, TypeError, AttributeError,
+            pickle.PicklingError):
+        # Not being able to save it only means it is not going to be reused
+        if tmp and os.path.exists(tmp):
+            os.unlink(tmp)
+
+
+def drop_discovery_cache():
+    """ Forget the saved discovery results. """
+    path = _discovery_cache_path()
+    if not path:
+        return
+    try:
+        os.unlink(path)
+    except (IOError, OSError):
+        pass
+
+
+class ToolCapabilities(object):
+    """
+    Versions and supported options of the tools we are using. Finding those
+    out means running the tool, so every capability is probed only when it
+    is needed for the first time. The results are saved in 'path' and
+    reused by later runs of ssm for as long as the path, inode and mtime of
+    the binary stay the same, so an upgraded tool is probed again. When
+    'path' is None the results are only kept in memory.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._tools = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._tools is not None:
+            return
+        self._tools = {}
+        if not self.path:
+            return
+        try:
+            with open(self.path, 'r') as f:
+                tools = json.load(f)
+        except (IOError, OSError, ValueError):
+            return
+        if isinstance(tools, dict):
+            self._tools = tools
+
+    def _save(self):
+        if not self.path:
+            return
+        try:
+            directory = os.path.dirname(self.path)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            fd, tmp = tempfile.mkstemp(dir=directory, prefix=".capabilities")
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self._tools, f)
+            os.rename(tmp, self.path)
+        except (IOError, OSError):
+            # Not being able to remember it is not a problem
+            pass
+
+    def _get_tool(self, binary):
+        path = find_binary(binary)
+        if path is None:
+            return None
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        identity = [st.st_ino, st.st_mtime]
+        self._load()
+        tool = self._tools.get(path)
+        if not tool or tool.get('identity') != identity:
+            tool = self._tools[path] = {'identity': identity,
+                                        'capabilities': {}}
+        return tool
+
+    def get(self, binary, name, probe=None, failed=None):
+        """ Return the capability 'name' of the tool 'binary'. If it is not
+            known yet, call probe() to find it out and remember the result,
+            unless it is 'failed', which is what probe() returns when it
+            could not find out. Without probe return None for unknown
+            capabilities.
+        """
+        with self._lock:
+            tool = self._get_tool(binary)
+            if tool is not None and name in tool['capabilities']:
+                return tool['capabilities'][name]
+        if probe is None:
+            return None
+        value = probe()
+        if tool is not None and (failed is None or value != failed):
+            self.set(binary, name, value)
+        return value
+
+    def set(self, binary, name, value):
+        """ Remember the capability 'name' of the tool 'binary'. """
+        with self._lock:
+            tool = self._get_tool(binary)
+            if tool is None or tool['capabilities'].get(name) == value:
+                return
+            tool['capabilities'][name] = value
+            self._save()
+
+
+TOOL_CAPABILITIES = None
+
+
+def get_capabilities():
+    """ Return ToolCapabilities shared by everything in ssm. """
+    global TOOL_CAPABILITIES
+    if TOOL_CAPABILITIES is None:
+        path = None
+        if SSM_CACHE_DIR:
+            path = os.path.join(SSM_CACHE_DIR, "capabilities.json")
+        TOOL_CAPABILITIES = ToolCapabilities(path)
+    return TOOL_CAPABILITIES
+
+
+def parallel_map(func, items, workers=4):
+    """ Call func(item) for every item using at most 'workers' threads and
+        return the results in the same order as the items. If any call
+        raises an exception, the first one (in the order of the items) is
+        raised again once all the calls are finished.
+
+    >>> parallel_map(lambda x: x * 2, [1, 2, 3], workers=2)
+    [2, 4, 6]
+    """
+    items = list(items)
+    results = [None] * len(items)
+    errors = [None] * len(items)
+    queue = list(range(len(items)))
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                if not queue:
+                    return
+                index = queue.pop(0)
+            try:
+                results[index] = func(items[index])
+            except Exception as err:
+                errors[index] = err
+
+    if workers <= 1 or len(items) <= 1:
+        worker()
+    else:
+        threads = [threading.Thread(target=worker)
+                   for _ in range(min(workers, len(items)))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    for error in errors:
+        if error is not None:
+            raise error
+    return results
+
+
 def udev_checkpoint(devices):
     if not isinstance(devices, list):
         devices = [devices]
@@ -423,6 +1217,8 @@ def wipefs(devices, signatures):
     command = ['wipefs', '-a', '-t', ','.join(signatures)] + devices
     # Avoid race with udev
     udev_settle()
+    for device in devices:
+        get_snapshot().invalidate_signature(device)
     run(command)
 
 
@@ -501,8 +1297,11 @@ def run(cmd, show_cmd=False, stdout=False, stderr=True, can_fail=False,
     if VERBOSE_VV_FLAG:
         print('executing command: {}'.format(' '.join(cmd)))
 
-    proc = subprocess.Popen(cmd, stdout=stdout,
-                            stderr=stderr, stdin=stdin, close_fds=True)
+    # Use the path we have already resolved instead of searching the PATH
+    # again, the command itself is left as it is for the messages
+    proc = subprocess.Popen(cmd, executable=find_binary(cmd[0]),
+                            stdout=stdout, stderr=stderr, stdin=stdin,
+                            close_fds=True)
 
     output, error = proc.communicate(input=stdin_data)
 
@@ -686,115 +1485,67 @@ def get_device_size(device):
             size = int(line)//2
             return size
 
-def ptable(data, table_header=None):
+def ptable(data, table_header=None, widths=None):
     """
     Print data in a table, optionally with a header.
     The data has to be a list of tuples of strings [('a', 'b', 'c'), ...]
     The header is a tuple: (('name', type), ... ), where the type is used to decide alignment.
     Int and float aligns to right, anything else to left.
     All the tuples has to have the same number of members.
-    """
-    if len(data) == 0:
-        return
 
+    The width of the columns is found with a single pass over the data, see
+    ptable_widths(). When 'widths' are known in advance, the data can be any
+    iterable and the lines are printed as they come, without keeping them
+    around.
+    """
     header = []
     types = []
-    fmt = ""
-    skip_header = True
-    # Keep track of used columns. Then we only print out columns with values.
-    columns = [False] * len(data[0])
-
-    len_matrix = []
     if table_header:
-        skip_header = False
-        line = []
         for n, t in table_header:
             if not isinstance(n, str) or not isinstance(t, type):
                 raise ValueError("The header for ptable has to be a tuple/list in the format: " +
                                  "[('name', type), ...], but got [..., ({}, {}), ...]".format(n, t))
-            line.append(len(n))
             header.append(n)
             types.append(t)
-        # add header lengths into the matrix
-        len_matrix.append(line)
-    else:
-        header = [''] * len(data[0])
-        types = [str] * len(data[0])
-
-    for _ in data:
-        len_matrix.append([0 for _ in data[0]])
-
-    index = 0
-    # Gather all lines which are going to be printed into the list
-    # and create matrix of attribute lengths.
-    # Iterate through all items.
-    for itemsline in data:
-        # a line
-        for i, item in enumerate(itemsline):
-            len_matrix[index][i] = len(item)
-            if len(item) > 0:
-                columns[i] = True
-        index += 1
-
 
-    if header:
-        alignment = [(len(item)) for item in header]
-    else:
-        alignment = [0]*len(data[0])
-        types = [str]*len(data[0])
-    term_width = terminal_size()[0]
+    if widths is None:
+        data = list(data)
+    lines = iter(data)
+    try:
+        first = __next__(lines)
+    except StopIteration:
+        return
+    lines = chain([first], lines)
 
-    # Update matrix of attribute lengths and construct the final list
-    # of alignment for each column in the table.
-    for index in range(len(len_matrix)):
-        line = None
-        # Find maximum length for each column
-        for a, array in enumerate(len_matrix):
-            for i, item in enumerate(array):
-                if not columns[i]:
-                    alignment[i] = 0
-                    continue
-                if item > alignment[i]:
-                    alignment[i] = item
-                    line = a
-
-        # Check the overall line length and if it is longer then the
-        # actual terminal width we can wrap the line right after the
-        # first attribute. Simply set the alignment to the smaller
-        # possible and let recalculate the list of column alignments.
-        # Note that when even with the line wrap we would still exceed
-        # the terminal width, then there is nothing we can do about it
-        # so do not bother with line wrapping at all since it would
-        # only screw the formatting even more.
-        length = sum(alignment) + 2 * len(header) - 2
-        if length > term_width and \
-                (length - term_width) < (alignment[0] - len(header[0])) and \
-                line is not None:
-            alignment[0] = len(header[0])
-            len_matrix[line][0] = len(header[0])
-        else:
-            break
+    skip_header = not header
+    if skip_header:
+        header = [''] * len(first)
+        types = [str] * len(first)
+    if widths is None:
+        widths = ptable_widths(data, header)
+    # Only columns with values are printed out
+    columns = [width is not None for width in widths]
 
     # Get the actual line width
-    width = sum(compress(alignment, columns)) + 2 * len(header) - 2
+    width = sum(compress(widths, columns)) + 2 * len(header) - 2
 
     pos = 0
-    # Use column alignments list to construct formatting string for each
-    # line in the table. Note that some lines might be wrapped later on.
+    fmt = ""
+    # Use column widths to construct formatting string for each line in
+    # the table. Note that some lines might be wrapped later on.
     for i, t in enumerate(types):
         if not columns[i]:
             continue
         if t in (float, int):
-            fmt += "{{{0}:>{1}}}  ".format(pos, alignment[i])
+            fmt += "{{{0}:>{1}}}  ".format(pos, widths[i])
         else:
             # Do not append additional spaces if this is the last item
             if i == len(header) - 1:
-                fmt += "{{{0}:{1}}}".format(pos, alignment[i])
+                fmt += "{{{0}:{1}}}".format(pos, widths[i])
             else:
-                fmt += "{{{0}:{1}}}  ".format(pos, alignment[i])
+                fmt += "{{{0}:{1}}}  ".format(pos, widths[i])
         pos += 1
 
-
     if not skip_header:
         print("-" * width)
         print(fmt.format(*tuple(header)))
@@ -802,17 +1553,91 @@ def ptable(data, table_header=None):
     # Now print each line of the table. When the first attribute of the
     # line is longer than it should be we know that we have to wrap the
     # line.
-    for i, line in enumerate(data):
-        line = compress(line, columns)
-        tmp1 = __next__(line)
-        if len(tmp1) > alignment[0]:
-            print(tmp1)
-            print(fmt.format('', *line))
-        else:
-            print(fmt.format(tmp1, *line))
+    wrap = widths[0] or 0
+    used = [i for i, column in enumerate(columns) if column]
+    write = sys.stdout.write
+    for line in lines:
+        line = [line[i] for i in used]
+        if len(line[0]) > wrap:
+            write(line[0] + "\n")
+            line[0] = ''
+        write(fmt.format(*line) + "\n")
     print("-" * width)
 
 
+def ptable_widths(data, header):
+    """
+    Return the list of column widths ptable() would use to print the data
+    with the header (a list of column names), None for the columns without
+    any value which are not printed at all.
+
+    >>> ptable_widths([('a', '', 'ccc'), ('aaaa', '', 'c')], ['h1', 'h2', 'h3'])
+    [4, None, 3]
+    """
+    widths = [len(name) for name in header]
+    columns = [False] * len(header)
+    first = []
+    # The last line which made any column wider
+    widest = None
+    for index, line in enumerate(data):
+        for i, item in enumerate(line):
+            if item:
+                columns[i] = True
+                if len(item) > widths[i]:
+                    widths[i] = len(item)
+                    widest = index
+        first.append(len(line[0]))
+    widths = [width if used else 0 for width, used in zip(widths, columns)]
+
+    # Check the overall line length and if it is longer then the actual
+    # terminal width we can wrap the lines right after the first attribute.
+    # The first column is then as wide as the longest first attribute which
+    # still fits, not counting the widest line which is always wrapped.
+    # Note that when even with the line wrap we would still exceed the
+    # terminal width, then there is nothing we can do about it so do not
+    # bother with line wrapping at all since it would only screw the
+    # formatting even more.
+    term_width = terminal_size()[0]
+    length = sum(widths) + 2 * len(header) - 2
+    rest = length - widths[0]
+    if columns[0] and widest is not None and length > term_width and \
+            rest + len(header[0]) < term_width:
+        first[widest] = 0
+        widths[0] = max([n for n in first if n + rest <= term_width] +
+                        [len(header[0])])
+    return [width if used else None for width, used in zip(widths, columns)]
+
+
+def precords(records, output, fields=None):
+    """
+    Print records (dictionaries) in the machine readable format 'output',
+    which is 'json' for a single list, 'ndjson' for one JSON object per line
+    or 'csv'. Except for 'json' every record is written out as soon as it
+    comes, so the consumer does not have to wait for all of them. 'fields'
+    are the CSV columns, by default the keys of the first record.
+    """
+    if output == 'json':
+        json.dump(list(records), sys.stdout, indent=2)
+        sys.stdout.write("\n")
+        return
+
+    if output == 'csv':
+        writer = None
+        for record in records:
+            if writer is None:
+                writer = csv.writer(sys.stdout, lineterminator="\n")
+                fields = fields or list(record.keys())
+                writer.writerow(fields)
+            writer.writerow(["" if record.get(field) is None
+                             else record[field] for field in fields])
+            sys.stdout.flush()
+        return
+
+    for record in records:
+        sys.stdout.write(json.dumps(record) + "\n")
+        sys.stdout.flush()
+
+
 class Node(object):
     """ A simple graph node class """
 
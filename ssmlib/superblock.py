@@ -0,0 +1,230 @@
+# (C)2011 Red Hat, Inc., Lukas Czerner <lczerner@redhat.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# superblock.py - recognizing the signatures ssm cares about without blkid
+
+import os
+import struct
+
+__all__ = ["detect", "read_usage"]
+
+OPEN_FLAGS = os.O_RDONLY | getattr(os, 'O_CLOEXEC', 0)
+
+# Everything but btrfs, the bigger swap pages and the md superblocks at the
+# end of the device is found within the first HEAD_SIZE bytes
+HEAD_SIZE = 8192
+
+EXT_SUPERBLOCK = 1024
+EXT_MAGIC = b"\x53\xef"
+EXT_FEATURE_COMPAT_HAS_JOURNAL = 0x4
+EXT_FEATURE_INCOMPAT_JOURNAL_DEV = 0x8
+EXT_FEATURE_INCOMPAT_64BIT = 0x80
+EXT_FLAGS_TEST_FILESYS = 0x4
+# Features ext2 and ext3 know about, anything else makes it ext4
+EXT2_FEATURE_INCOMPAT_SUPP = 0x2 | 0x10
+EXT3_FEATURE_INCOMPAT_SUPP = 0x2 | 0x4 | 0x10
+EXT3_FEATURE_RO_COMPAT_SUPP = 0x1 | 0x2 | 0x4
+
+LUKS_MAGIC = b"LUKS\xba\xbe"
+XFS_MAGIC = b"XFSB"
+BTRFS_MAGIC = b"_BHRfS_M"
+BTRFS_MAGIC_OFFSET = 65536 + 64
+SWAP_MAGICS = (b"SWAPSPACE2", b"SWAP-SPACE")
+SWAP_PAGE_SIZES = (4096, 8192, 16384, 65536)
+MD_MAGICS = (b"\xfc\x4e\x2b\xa9", b"\xa9\x2b\x4e\xfc")
+
+# The same (type, usage) blkid would report
+EXT2 = ('ext2', 'filesystem')
+EXT3 = ('ext3', 'filesystem')
+EXT4 = ('ext4', 'filesystem')
+XFS = ('xfs', 'filesystem')
+BTRFS = ('btrfs', 'filesystem')
+SWAP = ('swap', 'other')
+LUKS = ('crypto_LUKS', 'crypto')
+LVM2 = ('LVM2_member', 'raid')
+MD = ('linux_raid_member', 'raid')
+
+
+if hasattr(os, 'pread'):
+    def _pread(fd, size, offset):
+        return os.pread(fd, size, offset)
+else:
+    def _pread(fd, size, offset):
+        os.lseek(fd, offset, os.SEEK_SET)
+        return os.read(fd, size)
+
+
+def _ext(head):
+    sb = head[EXT_SUPERBLOCK:EXT_SUPERBLOCK + 356]
+    if len(sb) < 356 or sb[56:58] != EXT_MAGIC:
+        return None
+    compat, incompat, ro_compat = struct.unpack("<III", sb[92:104])
+    flags = struct.unpack("<I", sb[352:356])[0]
+    # External journals and test file systems are left to blkid
+    if incompat & EXT_FEATURE_INCOMPAT_JOURNAL_DEV or \
+       flags & EXT_FLAGS_TEST_FILESYS:
+        return None
+    ro_unsupported = ro_compat & ~EXT3_FEATURE_RO_COMPAT_SUPP
+    if compat & EXT_FEATURE_COMPAT_HAS_JOURNAL:
+        if not ro_unsupported and \
+           not incompat & ~EXT3_FEATURE_INCOMPAT_SUPP:
+            return EXT3
+    elif not ro_unsupported and not incompat & ~EXT2_FEATURE_INCOMPAT_SUPP:
+        return EXT2
+    return EXT4
+
+
+def _lvm2(head):
+    # The label can be in any of the first four sectors
+    for offset in range(0, 2048, 512):
+        if head[offset:offset + 8] == b"LABELONE" and \
+           head[offset + 24:offset + 32] == b"LVM2 001":
+            return LVM2
+    return None
+
+
+def _md1(data):
+    # Version 1 superblocks have the major version right after the magic
+    if len(data) >= 8 and data[:4] == MD_MAGICS[0] and \
+       struct.unpack("<I", data[4:8])[0] == 1:
+        return MD
+    return None
+
+
+def _head_signatures(head):
+    found = [_ext(head), _lvm2(head), _md1(head[0:8]),
+             _md1(head[4096:4104])]
+    if head[:6] == LUKS_MAGIC:
+        found.append(LUKS)
+    if head[:4] == XFS_MAGIC:
+        found.append(XFS)
+    return found
+
+
+def _swap(fd, head):
+    for page in SWAP_PAGE_SIZES:
+        if page <= len(head):
+            magic = head[page - 10:page]
+        else:
+            magic = _pread(fd, 10, page - 10)
+        if magic in SWAP_MAGICS:
+            return SWAP
+    return None
+
+
+def _md_tail(fd):
+    size = os.lseek(fd, 0, os.SEEK_END)
+    found = []
+    # Version 0.90 at the last 64KiB aligned 64KiB of the device
+    offset = (size & ~(65536 - 1)) - 65536
+    if offset >= 0 and _pread(fd, 4, offset) in MD_MAGICS:
+        found.append(MD)
+    # Version 1.0 at 8KiB from the end, 4KiB aligned
+    offset = (size - 8192) & ~(4096 - 1)
+    if offset >= 0:
+        found.append(_md1(_pread(fd, 8, offset)))
+    return found
+
+
+def detect(device):
+    """ Read the superblocks of the device and return the (type, usage)
+        tuple blkid would report for ext2, ext3, ext4, xfs, btrfs, swap,
+        crypto_LUKS, LVM2_member and linux_raid_member signatures.
+
+        None is returned when there is none of those, or more than one of
+        them, or the device can not be read. It is up to blkid to tell what
+        is on such a device.
+    """
+    try:
+        fd = os.open(device, OPEN_FLAGS)
+    except (IOError, OSError):
+        return None
+    try:
+        head = _pread(fd, HEAD_SIZE, 0)
+        found = _head_signatures(head)
+        found.append(_swap(fd, head))
+        if _pread(fd, 8, BTRFS_MAGIC_OFFSET) == BTRFS_MAGIC:
+            found.append(BTRFS)
+        found.extend(_md_tail(fd))
+    except (IOError, OSError, struct.error):
+        return None
+    finally:
+        os.close(fd)
+
+    found = set(signature for signature in found if signature)
+    if len(found) != 1:
+        return None
+    return found.pop()
+
+
+def _ext_usage(head):
+    sb = head[EXT_SUPERBLOCK:EXT_SUPERBLOCK + 356]
+    if len(sb) < 356 or sb[56:58] != EXT_MAGIC:
+        return None
+    bcount, rbcount, fbcount = struct.unpack("<III", sb[4:16])
+    log_bsize = struct.unpack("<I", sb[24:28])[0]
+    incompat = struct.unpack("<I", sb[96:100])[0]
+    if incompat & EXT_FEATURE_INCOMPAT_64BIT:
+        high = struct.unpack("<III", sb[336:348])
+        bcount |= high[0] << 32
+        rbcount |= high[1] << 32
+        fbcount |= high[2] << 32
+    return {'Block size': 1024 << log_bsize,
+            'Block count': bcount,
+            'Reserved block count': rbcount,
+            'Free blocks': fbcount}
+
+
+def _xfs_usage(head):
+    if len(head) < 152 or head[:4] != XFS_MAGIC:
+        return None
+    bsize, dblocks = struct.unpack(">IQ", head[4:16])
+    agcount = struct.unpack(">I", head[88:92])[0]
+    logblocks = struct.unpack(">I", head[96:100])[0]
+    fdblocks = struct.unpack(">Q", head[144:152])[0]
+    return {'blocksize': bsize, 'dblocks': dblocks, 'agcount': agcount,
+            'logblocks': logblocks, 'fdblocks': fdblocks}
+
+
+USAGE_PARSERS = {
+    'ext2': _ext_usage,
+    'ext3': _ext_usage,
+    'ext4': _ext_usage,
+    'xfs': _xfs_usage,
+}
+
+
+def read_usage(device, fstype):
+    """ Decode the block counts of an ext2, ext3, ext4 or xfs file system
+        from its superblock. The fields are named the same way tune2fs and
+        xfs_db name them. None is returned for any other file system, or
+        when the superblock can not be read or does not match fstype.
+
+        Only meaningful for file systems that are not mounted, the kernel
+        does not keep the counters on the disk up to date.
+    """
+    parse = USAGE_PARSERS.get(fstype)
+    if not parse:
+        return None
+    try:
+        fd = os.open(device, OPEN_FLAGS)
+    except (IOError, OSError):
+        return None
+    try:
+        return parse(_pread(fd, HEAD_SIZE, 0))
+    except (IOError, OSError, struct.error):
+        return None
+    finally:
+        os.close(fd)
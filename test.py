@@ -31,7 +31,8 @@ os.environ['SSM_NONINTERACTIVE'] = "1"
 
 from ssmlib import main
 from ssmlib import misc
-from ssmlib.backends import lvm, crypt, btrfs, multipath
+from ssmlib import dm
+from ssmlib.backends import lvm, crypt, btrfs, multipath, md
 
 import tests.unittests as tests_module
 from tests.unittests import *
@@ -203,6 +204,10 @@ def doc_tests():
             raise_on_error=False, optionflags=doctest_flags)
     result = doctest.testmod(misc, exclude_empty=True, report=True,
             raise_on_error=False, optionflags=doctest_flags)
+    result = doctest.testmod(md, exclude_empty=True, report=True,
+            raise_on_error=False, optionflags=doctest_flags)
+    result = doctest.testmod(dm, exclude_empty=True, report=True,
+            raise_on_error=False, optionflags=doctest_flags)
 
 def unit_tests(names):
     print("[+] Running unittests")
@@ -257,7 +262,10 @@ def unit_tests(names):
         tests_ssm = test_loader.loadTestsFromModule(test_ssm)
         tests_misc = test_loader.loadTestsFromModule(test_misc)
         tests_multipath = test_loader.loadTestsFromModule(test_multipath)
-        tests = unittest.TestSuite([tests_lvm, tests_btrfs, tests_ssm, tests_misc, tests_multipath])
+        tests_md = test_loader.loadTestsFromModule(test_md)
+        tests_crypt = test_loader.loadTestsFromModule(test_crypt)
+        tests = unittest.TestSuite([tests_lvm, tests_btrfs, tests_ssm, tests_misc, tests_multipath,
+                                    tests_md, tests_crypt])
 
     test_runner = unittest.TextTestRunner(verbosity=2)
     return not test_runner.run(tests).wasSuccessful()
@@ -22,6 +22,8 @@ import unittest
 import argparse
 from ssmlib import main
 from ssmlib import misc
+from ssmlib import dm
+from ssmlib.backends import md
 
 
 class MyStdout(object):
@@ -43,8 +45,16 @@ class BaseStorageHandleInit(unittest.TestCase):
         self.run_data = []
         self.run_orig = misc.run
         misc.run = self.mock_run
+        self.check_binary_orig = misc.check_binary
+        misc.check_binary = self.mock_check_binary
+        # Keep whatever the mocked tools say out of the persistent cache
+        self.capabilities_orig = misc.TOOL_CAPABILITIES
+        misc.TOOL_CAPABILITIES = misc.ToolCapabilities()
         main.SSM_NONINTERACTIVE = True
 
+    def mock_check_binary(self, name):
+        return True
+
     def mock_run(self, cmd, *args, **kwargs):
         # Convert all parts of cmd into string
         for i, item in enumerate(cmd):
@@ -61,6 +71,8 @@ class BaseStorageHandleInit(unittest.TestCase):
         self.storage = None
         self.run_data = []
         misc.run = self.run_orig
+        misc.check_binary = self.check_binary_orig
+        misc.TOOL_CAPABILITIES = self.capabilities_orig
         main.SSM_NONINTERACTIVE = False
 
 
@@ -92,6 +104,12 @@ class MockSystemDataSource(unittest.TestCase):
         misc.send_udev_event = self.mock_send_udev_event
         self.get_fs_type_orig = misc.get_fs_type
         misc.get_fs_type = self.mock_get_fs_type
+        self.probe_signatures_orig = misc.probe_signatures
+        misc.probe_signatures = self.mock_probe_signatures
+        self.dm_get_tables_orig = dm.get_tables
+        dm.get_tables = self.mock_dm_get_tables
+        self.read_mdstat_orig = md.read_mdstat
+        md.read_mdstat = self.mock_read_mdstat
         self.create_directory = main.create_directory
         main.create_directory = self.mock_create_directory
         self.main_os_statvfs = main.os.statvfs
@@ -102,6 +120,11 @@ class MockSystemDataSource(unittest.TestCase):
         self.mount_data = {}
         self.links = {}
         self._mpoint = False
+        # Do not let the system information cached by other tests leak in
+        misc.new_snapshot()
+        # Keep whatever the mocked tools say out of the persistent cache
+        self.capabilities_orig = misc.TOOL_CAPABILITIES
+        misc.TOOL_CAPABILITIES = misc.ToolCapabilities()
         main.SSM_NONINTERACTIVE = True
 
     def tearDown(self):
@@ -123,6 +146,10 @@ class MockSystemDataSource(unittest.TestCase):
         misc.check_binary = self.check_binary_orig
         misc.send_udev_event = self.send_udev_event_orig
         misc.get_fs_type = self.get_fs_type_orig
+        misc.probe_signatures = self.probe_signatures_orig
+        dm.get_tables = self.dm_get_tables_orig
+        md.read_mdstat = self.read_mdstat_orig
+        misc.TOOL_CAPABILITIES = self.capabilities_orig
         main.SSM_NONINTERACTIVE = False
 
     def _cmdEq(self, expected, index=-1, expected_args=None):
@@ -201,8 +228,10 @@ class MockSystemDataSource(unittest.TestCase):
     def mock_get_partitions(self):
         partitions = []
         for (_, data) in self.dev_data.items():
-            partitions.append([data['major'], data['minor'], data['dev_size'],
-                               data['dev_name'], data['dev_name']])
+            partitions.append(misc.BlockDevice(data['major'], data['minor'],
+                                               data['dev_size'],
+                                               data['dev_name'],
+                                               data['dev_name']))
         return partitions
 
     def mock_get_real_device(self, devname):
@@ -251,6 +280,23 @@ class MockSystemDataSource(unittest.TestCase):
             return None
         return None
 
+    def mock_probe_signatures(self, devices):
+        signatures = {}
+        for device in devices:
+            fstype = self.mock_get_fs_type(device)
+            if fstype:
+                signatures[device] = (fstype, 'filesystem')
+        return signatures
+
+    def mock_dm_get_tables(self):
+        # Pretend we can not talk to the device mapper directly so that
+        # the mocked dmsetup is used instead
+        raise OSError("mock data not available")
+
+    def mock_read_mdstat(self):
+        # There are no md arrays in the mock data
+        return ""
+
     def mock_send_udev_event(self, device, event):
         pass
 
@@ -450,6 +450,25 @@ class BtrfsFunctionCheck(MockSystemDataSource):
         self._cmdEq("mount -o rw,discard,neco=44 /dev/sdb /mnt/test1")
 
 
+    def test_btrfs_topology(self):
+        # Generate some storage data
+        self._addPool('default_pool', ['/dev/sda', '/dev/sdb'])
+        self._addPool('my_pool', ['/dev/sdc2', '/dev/sdc3', '/dev/sdc1'])
+        self._addVol('vol001', 117283225, 1, 'default_pool', ['/dev/sda'])
+        self._addVol('vol002', 237284225, 1, 'default_pool', ['/dev/sda'],
+                    '/mnt/mount')
+
+        # All the btrfs views are built from a single scan
+        self.run_data = []
+        main.main("ssm list")
+        btrfs_cmds = [cmd for cmd in self.run_data if cmd.startswith("btrfs ")]
+        self.assertEqual(btrfs_cmds.count("btrfs filesystem show"), 1)
+        self.assertEqual(btrfs_cmds.count(
+            "btrfs subvolume list -a /mnt/mount"), 1)
+        self.assertEqual(btrfs_cmds.count(
+            "btrfs subvolume list -a -s /mnt/mount"), 1)
+        self.assertEqual(len(btrfs_cmds), 3)
+
     def test_btrfs_migrate(self):
         # Generate some storage data
         self._addDevice('/dev/sdd1', 11489037516)
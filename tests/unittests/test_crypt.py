@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+#
+# (C)2012 Red Hat, Inc., Lukas Czerner <lczerner@redhat.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Unittests for the system storage manager crypt backend
+
+import os
+import shutil
+import tempfile
+import unittest
+from ssmlib import dm
+from ssmlib import main
+from ssmlib.backends import crypt
+from tests.unittests.common import *
+
+
+class CryptFunctionCheck(MockSystemDataSource):
+
+    def setUp(self):
+        super(CryptFunctionCheck, self).setUp()
+        self._options = main.Options()
+        self._addDevice('/dev/sdb', 2097152, 16)
+        self._addDevice('/dev/dm-0', 2093056, 0)
+        self.dev_data['/dev/dm-0']['major'] = '253'
+        self._addDevice('/dev/dm-1', 1048576, 1)
+        self.dev_data['/dev/dm-1']['major'] = '253'
+
+        # The mappings are only listed when their device node exists
+        self.dev_dir = tempfile.mkdtemp()
+        self.dev_dir_orig = crypt.DM_DEV_DIR
+        crypt.DM_DEV_DIR = self.dev_dir
+        os.mkdir(os.path.join(self.dev_dir, "mapper"))
+        for name in ["secret", "linear"]:
+            open(os.path.join(self.dev_dir, "mapper", name), "w").close()
+
+    def tearDown(self):
+        super(CryptFunctionCheck, self).tearDown()
+        crypt.DM_DEV_DIR = self.dev_dir_orig
+        shutil.rmtree(self.dev_dir)
+
+    def mock_dm_get_tables(self):
+        return [{'name': 'secret', 'uuid': 'CRYPT-LUKS2-0123-secret',
+                 'major': 253, 'minor': 0,
+                 'targets': [{'start': 0, 'length': 4186112, 'type': 'crypt',
+                              'params': "aes-xts-plain64 " + "0" * 128 +
+                                        " 0 8:16 4096"}]},
+                {'name': 'linear', 'uuid': '', 'major': 253, 'minor': 1,
+                 'targets': [{'start': 0, 'length': 2097152,
+                              'type': 'linear', 'params': "8:16 2048"}]}]
+
+    def test_crypt_tables(self):
+        volumes = crypt.DmCryptVolume(options=self._options)
+        name = os.path.join(self.dev_dir, "mapper", "secret")
+        self.assertEqual(list(volumes.data.keys()), [name])
+        vol = volumes.data[name]
+        self.assertEqual(vol['cipher'], 'aes-xts-plain64')
+        self.assertEqual(vol['keysize'], '512')
+        self.assertEqual(vol['crypt_device'], '/dev/sdb')
+        self.assertEqual(vol['vol_size'], '2093056.0')
+        self.assertEqual(vol['real_dev'], '/dev/dm-0')
+        # Everything is known from the tables, nothing is run
+        self.assertFalse([cmd for cmd in self.run_data
+                          if cmd.startswith(("dmsetup", "cryptsetup"))])
+
+    def test_crypt_hidden_key(self):
+        params = "aes-xts-plain64 " + "0123456789abcdef" * 8 + " 0 8:16 4096"
+        hidden = dm.hide_crypt_key(params)
+        self.assertNotIn("0123456789abcdef", hidden)
+        # Everything ssm needs to know is still there
+        self.assertEqual(dm.parse_crypt_params(hidden),
+                         dm.parse_crypt_params(params))
@@ -17,12 +17,23 @@
 
 # Unittests for the system storage manager lvm backend
 
+import os
+import sys
+import json
+import shutil
+import tempfile
 import unittest
 from ssmlib import main
 from ssmlib import problem
+from ssmlib import superblock
 from ssmlib.backends import lvm
 from tests.unittests.common import *
 
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
 
 class LvmFunctionCheck(MockSystemDataSource):
 
@@ -47,25 +58,373 @@ class LvmFunctionCheck(MockSystemDataSource):
 
         self.run_data.append(" ".join(cmd))
         output = ""
-        if cmd[1] == 'pvs':
-            for (dev, data) in self.dev_data.items():
-                if 'pool_name' in data:
-                    output += "{0}|{1}|{2}|{3}\n".format(dev, data['pool_name'],
-                            data['dev_free'], data['dev_used'])
-        elif cmd[1] == 'vgs':
-            for (pool, data) in self.pool_data.items():
-                output += "{0}|{1}|{2}|{3}|{4}\n".format(pool, data['dev_count'],
-                        data['pool_size'], data['pool_free'], data['vol_count'])
-        elif cmd[1] == 'lvs':
-            for (vol, data) in self.vol_data.items():
-                output += "{0}|{1}|{2}|{3}|{4}|{5}|{6}|{7}\n".format(data['pool_name'],
-                        data['vol_size'], data['stripes'], data['stripesize'],
-                        data['type'], data['dev_name'].split("/")[-1],
-                        data['origin'], data['attr'])
+        if cmd[1] == 'fullreport':
+            output = json.dumps({'report': self._lvm_report()})
+        elif cmd[1] in ['pvs', 'vgs', 'lvs']:
+            fields = cmd[cmd.index('-o') + 1].split(",")
+            rows = []
+            for section in self._lvm_report():
+                if cmd[1] == 'lvs':
+                    rows.extend(section['lv'])
+                else:
+                    rows.extend(section[cmd[1][:2]])
+            for row in rows:
+                output += "|".join([str(row.get(field, ''))
+                                    for field in fields]) + "\n"
+        elif cmd[0] == 'tune2fs':
+            output = ("tune2fs 1.47.0\nBlock count: 1024\n" +
+                      "Block size: 4096\nReserved block count: 0\n" +
+                      "Free blocks: 256\n")
         if 'return_stdout' in kwargs and not kwargs['return_stdout']:
             output = None
         return (0, output, None)
 
+    def _lvm_report(self):
+        """ Create lvm report sections from the mock data, the same way
+            'lvm fullreport' would.
+        """
+        sections = []
+        for (pool, data) in self.pool_data.items():
+            vg = {'vg_name': pool, 'pv_count': data['dev_count'],
+                  'vg_size': data['pool_size'],
+                  'vg_free': data['pool_free'],
+                  'lv_count': data['vol_count']}
+            sections.append({'vg': [vg], 'pv': [], 'lv': [], 'seg': []})
+        orphans = {'vg': [], 'pv': [], 'lv': [], 'seg': []}
+        sections.append(orphans)
+        by_name = dict([(s['vg'][0]['vg_name'], s) for s in sections
+                        if s['vg']])
+        for (dev, data) in self.dev_data.items():
+            if 'pool_name' not in data:
+                continue
+            section = by_name.get(data['pool_name'], orphans)
+            section['pv'].append({'pv_name': dev,
+                                  'vg_name': data['pool_name'],
+                                  'pv_free': data['dev_free'],
+                                  'pv_used': data['dev_used']})
+        for (vol, data) in self.vol_data.items():
+            section = by_name[data['pool_name']]
+            lv = {'vg_name': data['pool_name'],
+                  'lv_name': data['dev_name'].split("/")[-1],
+                  'lv_uuid': vol, 'lv_size': data['vol_size'],
+                  'origin': data['origin'], 'lv_attr': data['attr'],
+                  'lv_kernel_major': data.get('major', -1),
+                  'lv_kernel_minor': data.get('minor', -1)}
+            # thin pools and thin volumes
+            for field in ['data_percent', 'metadata_percent', 'pool_lv']:
+                if field in data:
+                    lv[field] = data[field]
+            if 'dm_path' in data:
+                lv['lv_dm_path'] = data['dm_path']
+            section['lv'].append(lv)
+            section['seg'].append({'lv_uuid': vol,
+                                   'segtype': data['type'],
+                                   'stripes': data['stripes'],
+                                   'stripe_size': data['stripesize']})
+            # lvs reports volume group and segment fields directly
+            lv['pv_count'] = section['vg'][0]['pv_count']
+            lv.update(section['seg'][-1])
+        return sections
+
+    def test_lvm_report(self):
+        default_pool = lvm.SSM_LVM_DEFAULT_POOL
+        self._addPool(default_pool, ['/dev/sda', '/dev/sdb'])
+        self._addVol('vol001', 117283225, 1, default_pool, ['/dev/sda'])
+
+        # All the lvm information is gathered with a single command
+        self.run_data = []
+        main.main("ssm list")
+        lvm_cmds = [cmd for cmd in self.run_data if cmd.startswith("lvm ")]
+        self.assertEqual(len(lvm_cmds), 1)
+        self.assertTrue(lvm_cmds[0].startswith("lvm fullreport"))
+
+        # Older lvm versions fall back to separate commands
+        version = lvm.LVM_VERSION
+        lvm.LVM_VERSION = [2, 2, 100]
+        try:
+            self.run_data = []
+            main.main("ssm list")
+        finally:
+            lvm.LVM_VERSION = version
+        lvm_cmds = [cmd.split()[1] for cmd in self.run_data
+                    if cmd.startswith("lvm ")]
+        self.assertEqual(lvm_cmds, ['vgs', 'pvs', 'lvs'])
+        self._checkCmd("ssm remove", ['/dev/{0}/vol001'.format(default_pool)],
+            "lvm lvremove /dev/{0}/vol001".format(default_pool))
+
+    def _list_output(self, command):
+        stdout = sys.stdout
+        sys.stdout = output = StringIO()
+        try:
+            main.main(command)
+        finally:
+            sys.stdout = stdout
+        return output.getvalue()
+
+    def test_lvm_list_output(self):
+        self._addPool('default_pool', ['/dev/sda', '/dev/sdb'])
+        self._addVol('vol001', 117283225, 1, 'default_pool', ['/dev/sda'])
+
+        pools = json.loads(self._list_output("ssm list -o json pool"))
+        self.assertEqual(len(pools), 1)
+        self.assertEqual(pools[0]['object'], 'pool')
+        self.assertEqual(pools[0]['pool_name'], 'default_pool')
+        # Sizes are in bytes, not rounded for humans
+        self.assertEqual(pools[0]['pool_size'],
+                         int((11489037516 + 234566451) * 1024))
+
+        lines = self._list_output("ssm list --output ndjson").splitlines()
+        records = [json.loads(line) for line in lines]
+        self.assertEqual([r['object'] for r in records if r['object'] != 'dev'],
+                         ['pool', 'vol'])
+        vol = records[-1]
+        self.assertEqual(vol['dev_name'], '/dev/default_pool/vol001')
+        self.assertEqual(vol['vol_size'], 117283225 * 1024)
+
+        lines = self._list_output("ssm list -o csv vol").splitlines()
+        self.assertEqual(lines[0], "object,dev_name,pool_name,vol_size," +
+                                   "fs_type,fs_size,fs_free,type,mount")
+        self.assertTrue(lines[1].startswith(
+            "vol,/dev/default_pool/vol001,default_pool,120098022400,"))
+
+        details = json.loads(self._list_output(
+            "ssm info -o json /dev/default_pool/vol001"))
+        self.assertEqual([d['object'] for d in details], ['vol'])
+        self.assertEqual(details[0]['vol_size'], 117283225 * 1024)
+        self.assertRaises(SystemExit, self._list_output,
+                          "ssm info -o json /dev/default_pool/vol002")
+
+    def test_lvm_list_pool(self):
+        self._addPool('default_pool', ['/dev/sda', '/dev/sdb'])
+        self._addPool('my_pool', ['/dev/sdc2', '/dev/sdc3'])
+        self._addVol('vol001', 117283225, 1, 'default_pool', ['/dev/sda'])
+        self._addVol('vol002', 20000000, 1, 'my_pool', ['/dev/sdc2'])
+        self._addVol('vol003', 1024, 1, 'my_pool', ['/dev/sdc3'])
+
+        self.run_data = []
+        records = json.loads(self._list_output(
+            "ssm list -o json --pool my_pool"))
+        # Only the volume group asked about is reported by lvm
+        lvm_cmds = [cmd for cmd in self.run_data
+                    if cmd.startswith("lvm fullreport")]
+        self.assertEqual(len(lvm_cmds), 1)
+        self.assertTrue(lvm_cmds[0].endswith(" my_pool"))
+        self.assertEqual(sorted([r.get('dev_name') or r.get('pool_name')
+                                 for r in records]),
+                         ['/dev/my_pool/vol002', '/dev/my_pool/vol003',
+                          '/dev/sdc2', '/dev/sdc3', 'my_pool'])
+
+        records = json.loads(self._list_output(
+            "ssm list vol -o json --fields dev_name,vol_size " +
+            "--where pool_name=my_pool --where vol_size=1024"))
+        self.assertEqual(records, [{'object': 'vol',
+                                    'dev_name': '/dev/my_pool/vol003',
+                                    'vol_size': 1024 * 1024}])
+
+        lines = self._list_output("ssm list pool --fields pool_name,dev_count,pool_used " +
+                                  "-w pool_name=default_pool").splitlines()
+        self.assertEqual(lines[1].split(), ['Pool', 'Devices', 'Used'])
+        self.assertEqual(lines[3].split(), ['default_pool', '2', '111.85', 'GB'])
+        self.assertEqual(len(lines), 5)
+
+    def test_lvm_list_lazy_fs(self):
+        # File systems are cached by device number, keep them unique
+        self._addDevice('/dev/sdd', 11489037516, 48)
+        self.dev_data['/dev/sdd']['fstype'] = 'xfs'
+        self._addPool('default_pool', ['/dev/sda', '/dev/sdb'])
+        self._addVol('vol001', 117283225, 1, 'default_pool', ['/dev/sda'],
+                     fstype='ext4')
+
+        def fs_probes(command):
+            self.run_data = []
+            output = self._list_output(command)
+            tools = [cmd for cmd in self.run_data
+                     if cmd.startswith(("tune2fs", "xfs_db"))]
+            return output, tools
+
+        # Nothing needs the file systems
+        for command in ["ssm list pool", "ssm list dev",
+                        "ssm list vol --no-fs"]:
+            self.assertEqual(fs_probes(command)[1], [])
+        output = fs_probes("ssm list vol --no-fs")[0]
+        self.assertNotIn("/dev/sdd", output)
+        self.assertEqual(output.splitlines()[1].split(),
+                         ['Volume', 'Pool', 'Volume', 'size', 'Type'])
+
+        # The type comes with the device signatures, nothing else is needed
+        output, tools = fs_probes(
+            "ssm list vol --fields dev_name,fs_type")
+        self.assertEqual(tools, [])
+        self.assertIn("/dev/sdd", output)
+        self.assertIn("ext4", output)
+
+        # Only the volumes actually listed are probed
+        output, tools = fs_probes(
+            "ssm list vol --where pool_name=default_pool")
+        self.assertEqual(tools, ["tune2fs -l /dev/default_pool/vol001"])
+        self.assertNotIn("/dev/sdd", output)
+
+        self.assertRaises(SystemExit, main.main, "ssm list fs --no-fs")
+
+    def test_lvm_fs_probe_plan(self):
+        self._addDevice('/dev/sdd', 11489037516, 48)
+        self.dev_data['/dev/sdd']['fstype'] = 'ext3'
+        self._addDevice('/dev/dm-5', 117283225, 5)
+        self.dev_data['/dev/dm-5']['major'] = '253'
+        # The volume is found as /dev/dm-5 by its number
+        self.dev_data['/dev/dm-5']['fstype'] = 'ext4'
+        self._addPool('default_pool', ['/dev/sda', '/dev/sdb'])
+        self._addVol('vol001', 117283225, 1, 'default_pool', ['/dev/sda'],
+                     fstype='ext4')
+        vol = self.vol_data['/dev/default_pool/vol001']
+        vol['major'], vol['minor'] = '253', '5'
+
+        probed = []
+
+        class CountingFsInfo(main.FsInfo):
+            def __init__(self, dev, *args, **kwargs):
+                probed.append(dev)
+                super(CountingFsInfo, self).__init__(dev, *args, **kwargs)
+        fs_info = main.FsInfo
+        main.FsInfo = CountingFsInfo
+        try:
+            output = self._list_output("ssm list")
+        finally:
+            main.FsInfo = fs_info
+
+        self.assertIn("ext3", output)
+        self.assertIn("ext4", output)
+        # Every block device is probed at most once, whatever name it is
+        # listed under, and the pool devices are not probed at all
+        self.assertEqual(len(probed), len(set(probed)))
+        self.assertEqual(probed.count('/dev/sdd'), 1)
+        self.assertEqual(probed.count('/dev/dm-5'), 1)
+        self.assertNotIn('/dev/sda', probed)
+        self.assertNotIn('/dev/sdb', probed)
+
+    def test_lvm_fs_usage(self):
+        self._addPool('default_pool', ['/dev/sda', '/dev/sdb'])
+        self._addVol('vol001', 117283225, 1, 'default_pool', ['/dev/sda'],
+                     fstype='ext4')
+        self._addVol('vol002', 1024, 1, 'default_pool', ['/dev/sdb'],
+                     fstype='xfs')
+        self._mountVol('vol001', 'default_pool', ['/dev/sda'], '/mnt/test')
+
+        statvfs = []
+
+        def mock_statvfs(mount_point):
+            statvfs.append(mount_point)
+            return os.statvfs_result((4096, 4096, 1024, 256, 200, 0, 0, 0,
+                                      0, 255))
+        main.os.statvfs = mock_statvfs
+        # The superblock of the unmounted one is read instead of xfs_db, the
+        # mounted one only for its size
+        usage = {'xfs': {'blocksize': 4096, 'dblocks': 2048, 'agcount': 4,
+                         'logblocks': 1024, 'fdblocks': 524},
+                 'ext4': {'Block size': 4096, 'Block count': 1100,
+                          'Reserved block count': 0, 'Free blocks': 1000}}
+        read_usage = superblock.read_usage
+        superblock.read_usage = lambda dev, fstype: dict(usage[fstype])
+        fields = "dev_name,fs_size,fs_free,fs_used"
+        try:
+            self.run_data = []
+            output = self._list_output(
+                "ssm list vol -o json --fields " + fields)
+        finally:
+            superblock.read_usage = read_usage
+            main.os.statvfs = self.mock_os_statvfs
+
+        self.assertEqual(statvfs, ['/mnt/test'])
+        self.assertEqual([cmd for cmd in self.run_data
+                          if cmd.startswith(("tune2fs", "xfs_db"))], [])
+        records = dict([(record['dev_name'], record)
+                        for record in json.loads(output)])
+        # The size of ext file systems includes the metadata statvfs leaves
+        # out, blocks reserved for root are neither free nor used
+        self.assertEqual(records['/dev/default_pool/vol001']['fs_size'],
+                         1100 * 4096)
+        self.assertEqual(records['/dev/default_pool/vol001']['fs_free'],
+                         200 * 4096)
+        self.assertEqual(records['/dev/default_pool/vol001']['fs_used'],
+                         768 * 4096)
+        self.assertEqual(records['/dev/default_pool/vol002']['fs_free'],
+                         512 * 4096)
+        self.assertEqual(records['/dev/default_pool/vol002']['fs_used'],
+                         512 * 4096)
+
+        # The counters in the superblock of a mounted file system are stale,
+        # tune2fs is asked when statvfs fails
+        def failing_statvfs(mount_point):
+            raise OSError("statvfs failed")
+        main.os.statvfs = failing_statvfs
+        superblock.read_usage = lambda dev, fstype: dict(usage[fstype])
+        misc.new_snapshot()
+        try:
+            self.run_data = []
+            output = self._list_output(
+                "ssm list vol -o json --fields " + fields)
+        finally:
+            superblock.read_usage = read_usage
+            main.os.statvfs = self.mock_os_statvfs
+        self.assertEqual([cmd for cmd in self.run_data
+                          if cmd.startswith(("tune2fs", "xfs_db"))],
+                         ["tune2fs -l /dev/default_pool/vol001"])
+        records = dict([(record['dev_name'], record)
+                        for record in json.loads(output)])
+        self.assertEqual(records['/dev/default_pool/vol001']['fs_free'],
+                         256 * 4096)
+
+    def test_lvm_device_numbers(self):
+        self._addDevice('/dev/dm-5', 117283225, 5)
+        self.dev_data['/dev/dm-5']['major'] = '253'
+        self._addPool('default_pool', ['/dev/sda', '/dev/sdb'])
+        self._addVol('vol001', 117283225, 1, 'default_pool', ['/dev/sda'])
+        self._addVol('vol002', 1024, 1, 'default_pool', ['/dev/sdb'])
+        vol = self.vol_data['/dev/default_pool/vol001']
+        vol['major'], vol['minor'] = '253', '5'
+        self.mount_data['/dev/dm-5'] = {'dev': '/dev/dm-5', 'mp': '/mnt/test',
+                                        'major_minor': '253:5', 'root': '/'}
+
+        resolved = []
+        get_real_device = misc.get_real_device
+
+        def resolve(device):
+            resolved.append(device)
+            return get_real_device(device)
+        misc.get_real_device = resolve
+
+        vols = json.loads(self._list_output("ssm list vol -o json"))
+        mounts = dict([(vol['dev_name'], vol['mount']) for vol in vols])
+        self.assertEqual(mounts['/dev/default_pool/vol001'], '/mnt/test')
+        self.assertEqual(mounts['/dev/default_pool/vol002'], '')
+        # Only the inactive volume needs its name resolved
+        self.assertNotIn('/dev/default_pool/vol001', resolved)
+        self.assertIn('/dev/default_pool/vol002', resolved)
+
+        storage = main.StorageHandle(main.Options())
+        self.assertEqual(storage.vol['/dev/dm-5']['dev_name'],
+                         '/dev/default_pool/vol001')
+
+    def test_lvm_create_thin(self):
+        self._addPool('default_pool', ['/dev/sda', '/dev/sdb'])
+        version = lvm.LVM_VERSION
+        lvm.LVM_VERSION = [2, 3, 0]
+        # lvm needs the thin provisioning tools
+        tools = tempfile.mkdtemp()
+        open(os.path.join(tools, "thin_check"), "w").close()
+        path = os.environ["PATH"]
+        os.environ["PATH"] = tools + os.pathsep + path
+        try:
+            main.main("ssm create -p default_pool -v 1G -s 512M")
+        finally:
+            lvm.LVM_VERSION = version
+            os.environ["PATH"] = path
+            shutil.rmtree(tools)
+        self._cmdEq("lvm lvcreate default_pool -T -L 524288.0K " +
+                    "-n default_pool_thin001", -2)
+        self._cmdEq("lvm lvcreate -n tvol001 -T " +
+                    "default_pool/default_pool_thin001 -V 1048576.0K")
+
     def test_lvm_create(self):
         default_pool = lvm.SSM_LVM_DEFAULT_POOL
 
@@ -445,6 +804,127 @@ class LvmFunctionCheck(MockSystemDataSource):
         self._checkCmd("ssm add", ['/dev/sda /dev/sdb'],
             "lvm vgextend {0} /dev/sda".format(default_pool))
 
+    def test_lvm_targeted_reinit(self):
+        self._addPool('default_pool', ['/dev/sda', '/dev/sdb'])
+        storage = main.StorageHandle(main.Options())
+        self.assertEqual(storage.dev['/dev/sdc']['dev_name'], '/dev/sdc')
+        self.assertTrue(storage.pool['default_pool'])
+        del self.run_data[:]
+
+        # Only lvm is asked again after the lvm pool has changed
+        self._addPool('my_pool', ['/dev/sdc2', '/dev/sdc3'])
+        # Which is what running any lvm command does
+        lvm.invalidate_lvm_report()
+        storage.reinit_pool(backends=['lvm'])
+        storage.reinit_dev(backends=['lvm'])
+        self.assertTrue(storage.pool['my_pool'])
+        self.assertEqual(storage.dev['/dev/sdc2']['pool_name'], 'my_pool')
+        self.assertTrue(self.run_data)
+        for cmd in self.run_data:
+            self.assertTrue(cmd.startswith("lvm "), cmd)
+
+    def test_lvm_reinit_used_device(self):
+        self._addPool('default_pool', ['/dev/sda', '/dev/sdb'])
+        self._addPool('my_pool', ['/dev/sdc2', '/dev/sdc3'])
+        self.dev_data['/dev/sdc2']['dev_free'] = '0.0'
+
+        def run(cmd, *args, **kwargs):
+            if cmd[:2] == ['lvm', 'vgreduce']:
+                # The device is left alone, out of any group
+                del self.dev_data[cmd[-1]]['pool_name']
+            return self.mock_run(cmd, *args, **kwargs)
+        misc.run = run
+
+        options = main.Options()
+        options.force = True
+        main.PR.set_options(options)
+        try:
+            storage = main.StorageHandle(options)
+            args = main.Struct()
+            args.device = ['/dev/sdc2']
+            args.pool = storage.pool['default_pool']
+            have_size, devices = storage._filter_device_list(args)
+        finally:
+            main.PR.set_options(main.Options())
+        self.assertIn("lvm vgreduce -f my_pool /dev/sdc2", self.run_data)
+        self.assertEqual(args.device, ['/dev/sdc2'])
+        # The device is seen as it is after it has been removed from the pool
+        dev = storage.dev['/dev/sdc2']
+        self.assertNotIn('pool_name', dev)
+        self.assertEqual(have_size, float(dev['dev_size']))
+
+    def test_lvm_lookup(self):
+        self._addPool('default_pool', ['/dev/sda', '/dev/sdb'])
+        self._addVol('vol001', 117283225, 1, 'default_pool', ['/dev/sda'],
+                    '/mnt/test1')
+        storage = main.StorageHandle(main.Options())
+        vol = storage.vol['/dev/default_pool/vol001']
+        self.assertTrue(vol)
+        # All the names the volume is known by lead to the same data
+        for name in ['default_pool/vol001', vol['real_dev'], vol['dm_name']]:
+            self.assertEqual(storage.vol[name].data, vol.data)
+        self.assertEqual(storage.vol.get_mounted('/mnt/test1/').data,
+                         vol.data)
+        self.assertEqual(storage.vol['default_pool/vol002'], None)
+        self.assertEqual(storage.vol.get_mounted('/mnt/test2'), None)
+
+    def test_lvm_lookup_thin(self):
+        self._addDevice('/dev/dm-7', 1024, 7)
+        self.dev_data['/dev/dm-7']['major'] = '253'
+        self._addPool('default_pool', ['/dev/sda', '/dev/sdb'])
+        self._addVol('thin', 1048576, 1, 'default_pool', ['/dev/sda'])
+        self._addVol('tvol', 1024, 1, 'default_pool', ['/dev/sdb'])
+        thin = self.vol_data['/dev/default_pool/thin']
+        thin['attr'] = 'twi-a-tz--'
+        thin['data_percent'] = thin['metadata_percent'] = '0.00'
+        # Active thin volume
+        tvol = self.vol_data['/dev/default_pool/tvol']
+        tvol.update({'attr': 'Vwi-a-tz--', 'type': 'thin', 'pool_lv': 'thin',
+                     'major': '253', 'minor': '7',
+                     'dm_path': '/dev/mapper/default_pool-tvol'})
+        storage = main.StorageHandle(main.Options())
+        vol = storage.vol['/dev/dm-7']
+        self.assertEqual(vol['pool_name'], 'thin')
+        self.assertEqual(vol['parent_pool'], 'default_pool')
+        for name in ['/dev/default_pool/tvol', 'default_pool/tvol',
+                     '/dev/mapper/default_pool-tvol',
+                     'mapper/default_pool-tvol', 'dm-7']:
+            self.assertEqual(storage.vol[name].data, vol.data, name)
+
+    def test_lvm_graph(self):
+        self._addPool('default_pool', ['/dev/sda', '/dev/sdb'])
+        self._addVol('vol001', 117283225, 1, 'default_pool', ['/dev/sda'])
+        storage = main.StorageHandle(main.Options())
+        main.create_graph(storage.pool, storage.dev, storage.vol,
+                          storage.snap)
+        pool = storage.pool['default_pool']
+        vol = storage.vol['/dev/default_pool/vol001']
+        self.assertEqual(vol.parents, [pool])
+        self.assertEqual(pool.children, [vol])
+        # Names are put together once per item
+        self.assertTrue(vol.names is vol.names)
+
+    def test_lvm_lookup_ambiguous(self):
+        self._addPool('default_pool', ['/dev/sda', '/dev/sdb'])
+        self._addPool('my_pool', ['/dev/sdc2', '/dev/sdc3'])
+        self._addVol('thin', 1024, 1, 'default_pool', ['/dev/sda'])
+        self._addVol('thin', 1024, 1, 'my_pool', ['/dev/sdc2'])
+        self._addVol('thin2', 1024, 1, 'my_pool', ['/dev/sdc3'])
+        for vol in ['/dev/default_pool/thin', '/dev/my_pool/thin',
+                    '/dev/my_pool/thin2']:
+            self.vol_data[vol]['attr'] = 'twi-a-tz--'
+            self.vol_data[vol]['data_percent'] = '0.00'
+            self.vol_data[vol]['metadata_percent'] = '0.00'
+        storage = main.StorageHandle(main.Options())
+        self.assertEqual(storage.pool['default_pool/thin']['parent_pool'],
+                         'default_pool')
+        self.assertEqual(storage.pool['thin2']['parent_pool'], 'my_pool')
+        # The thin pool name alone does not tell which one
+        self.assertRaises(Exception, storage.pool.__getitem__, 'thin')
+        self.assertRaises(Exception, main.main, "ssm create -p thin -s 512M")
+        self.assertFalse([cmd for cmd in self.run_data
+                          if cmd.startswith("lvm lvcreate")])
+
     def test_lvm_mount(self):
         self._addDir("/mnt/test")
         self._addDir("/mnt/test1")
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+#
+# (C)2012 Red Hat, Inc., Lukas Czerner <lczerner@redhat.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Unittests for the system storage manager md backend
+
+import os
+import shutil
+import tempfile
+import unittest
+from ssmlib import main
+from ssmlib.backends import md
+from tests.unittests.common import *
+
+MDSTAT = """Personalities : [raid1] [raid0]
+md127 : active raid1 sdc1[1] sdb1[0]
+      1047552 blocks super 1.2 [2/2] [UU]
+      [==>..................]  resync = 12.5% (131072/1047552) finish=0.1min speed=65536K/sec
+
+md126 : inactive sdd[0](S)
+      2096128 blocks super 1.2
+
+unused devices: <none>
+"""
+
+
+class MdFunctionCheck(MockSystemDataSource):
+
+    def setUp(self):
+        super(MdFunctionCheck, self).setUp()
+        self._options = main.Options()
+        self._addDevice('/dev/sdb1', 1048576)
+        self._addDevice('/dev/sdc1', 1048576)
+        self._addDevice('/dev/sdd', 2097152)
+
+        # Fake sysfs with just the md127 array described in it
+        self.sysfs = tempfile.mkdtemp()
+        self.sysfs_orig = md.SYSFS_BLOCK
+        md.SYSFS_BLOCK = self.sysfs
+        self._addSysfs("md127/size", "2095104")
+        self._addSysfs("md127/md/level", "raid1")
+        self._addSysfs("md127/md/raid_disks", "2")
+        self._addSysfs("md127/md/dev-sdb1/state", "in_sync")
+        self._addSysfs("md127/md/dev-sdc1/state", "in_sync")
+
+    def tearDown(self):
+        super(MdFunctionCheck, self).tearDown()
+        md.SYSFS_BLOCK = self.sysfs_orig
+        shutil.rmtree(self.sysfs)
+
+    def _addSysfs(self, name, value):
+        path = os.path.join(self.sysfs, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "w") as f:
+            f.write(value + "\n")
+
+    def mock_read_mdstat(self):
+        return MDSTAT
+
+    def mock_run(self, cmd, *args, **kwargs):
+        self.run_data.append(" ".join(cmd))
+        output = ""
+        if cmd[:2] == ['mdadm', '--detail']:
+            output = "    Raid Level : raid0\n    Array Size : 2096128 (2047 MiB)\n"
+        return (0, output, None)
+
+    def test_md_discovery(self):
+        vol = md.MdRaidVolume(options=self._options)
+        data = vol.data['/dev/md127']
+        self.assertEqual(data['type'], 'raid1')
+        self.assertEqual(data['vol_size'], 1047552)
+        self.assertEqual(data['raid_disks'], '2')
+        self.assertEqual(data['total_devices'], '2')
+        self.assertEqual(data['sync_action'], 'resync')
+        self.assertEqual(data['sync_progress'], '12.5')
+        self.assertEqual(data['sync_speed'], 65536)
+
+        # Only the array the kernel does not describe is asked about
+        self.assertEqual(self.run_data, ['mdadm --detail /dev/md126'])
+        self.assertEqual(vol.data['/dev/md126']['type'], 'raid0')
+
+        dev = md.MdRaidDevice(options=self._options)
+        self.assertEqual(sorted(dev.data.keys()),
+                         ['/dev/sdb1', '/dev/sdc1', '/dev/sdd'])
+        self.assertEqual(dev.data['/dev/sdb1']['md_state'], 'in_sync')
+        self.assertEqual(dev.data['/dev/sdb1']['dev_size'], 1048576)
+        self.assertEqual(dev.data['/dev/sdd']['pool_name'], 'md')
+        # Discovery is shared through the system snapshot
+        self.assertEqual(len(self.run_data), 1)
@@ -22,12 +22,16 @@ import re
 import sys
 import stat
 import time
+import struct
+import shutil
+import tempfile
 import doctest
 import unittest
 import argparse
 from ssmlib import main
 from ssmlib import misc
 from ssmlib import problem
+from ssmlib import superblock
 try:
     from StringIO import StringIO
 except ImportError:
@@ -39,11 +43,11 @@ class MiscCheck(unittest.TestCase):
     """
     Checks for various helpers and tools.
     """
-    def _get_ptable_output(self, data, header=None):
+    def _get_ptable_output(self, data, header=None, widths=None):
         stdout_orig = sys.stdout
         sys.stdout = stringio = StringIO()
         try:
-            misc.ptable(data, header)
+            misc.ptable(data, header, widths)
         finally:
             sys.stdout = stdout_orig
         return stringio.getvalue()
@@ -110,6 +114,36 @@ class MiscCheck(unittest.TestCase):
             "-------------------\n")
 
 
+    def test_ptable_widths(self):
+        data = [('a1', '1', ''), ('a2--', '2', ''), ('a3', '300', '')]
+        header = (('h1', str), ('h2', int), ('h3', float))
+        widths = misc.ptable_widths(data, [name for name, _ in header])
+        self.assertEqual(widths, [4, 3, None])
+        # With known widths the lines are printed as they come
+        self.assertEqual(self._get_ptable_output(data, header),
+                         self._get_ptable_output((line for line in data),
+                                                 header, widths))
+        self.assertEqual(self._get_ptable_output(iter([]), header, widths),
+                         "")
+
+    def test_find_binary(self):
+        path_orig = os.environ.get('PATH')
+        paths_orig = misc.BINARY_PATHS
+        misc.BINARY_PATHS = {}
+        try:
+            sh = misc.find_binary('sh')
+            self.assertTrue(os.path.isabs(sh))
+            self.assertTrue(misc.check_binary(sh))
+            self.assertEqual(misc.find_binary('ssm-no-such-binary'), None)
+            self.assertFalse(misc.check_binary('ssm-no-such-binary'))
+            # The PATH is searched only once for every name
+            os.environ['PATH'] = ""
+            self.assertEqual(misc.find_binary('sh'), sh)
+        finally:
+            os.environ['PATH'] = path_orig
+            misc.BINARY_PATHS = paths_orig
+
+
 class NodeCheck(unittest.TestCase):
     def setUp(self):
         self.root = misc.Node()
@@ -153,3 +187,443 @@ class NodeCheck(unittest.TestCase):
         self.assertEqual(b.parents, [a])
         self.assertEqual(b.neighbours, [a])
         self.assertEqual(a.neighbours, [b])
+
+
+class SystemSnapshotCheck(unittest.TestCase):
+    """
+    Checks that the system information is read only once.
+    """
+
+    def setUp(self):
+        self.calls = 0
+        self.run_data = []
+        self.get_partitions_orig = misc.get_partitions
+        misc.get_partitions = self.mock_get_partitions
+        self.run_orig = misc.run
+        misc.run = self.mock_run
+
+    def tearDown(self):
+        misc.get_partitions = self.get_partitions_orig
+        misc.run = self.run_orig
+
+    def mock_run(self, cmd, *args, **kwargs):
+        self.run_data.append(" ".join(cmd))
+        output = ""
+        if cmd[0] == "blkid":
+            signatures = {'/dev/sda': ('crypto_LUKS', 'crypto'),
+                          '/dev/sda1': ('ext4', 'filesystem')}
+            for dev in cmd[8:]:
+                if dev in signatures:
+                    output += "DEVNAME={0}\nTYPE={1}\nUSAGE={2}\n\n".format(
+                              dev, *signatures[dev])
+        return (2, output, None)
+
+    def mock_get_partitions(self):
+        self.calls += 1
+        return [misc.BlockDevice('8', '0', 1024, '/dev/sda', '/dev/sda'),
+                misc.BlockDevice('8', '1', 512, '/dev/sda1', '/dev/sda1',
+                                 '/dev/sda', True)]
+
+    def test_partitions(self):
+        snapshot = misc.SystemSnapshot()
+        self.assertEqual(len(snapshot.partitions), 2)
+        self.assertEqual(snapshot.get_partition('/dev/sda1')[2], 512)
+        self.assertEqual(snapshot.get_partition('/dev/sdb'), None)
+        self.assertEqual(self.calls, 1)
+
+        snapshot.invalidate('mounts')
+        snapshot.partitions
+        self.assertEqual(self.calls, 1)
+
+        snapshot.invalidate()
+        snapshot.partitions
+        self.assertEqual(self.calls, 2)
+
+    def test_new_snapshot(self):
+        snapshot = misc.new_snapshot()
+        self.assertTrue(misc.get_snapshot() is snapshot)
+        self.assertFalse(misc.new_snapshot() is snapshot)
+
+    def test_signatures(self):
+        snapshot = misc.SystemSnapshot()
+        self.assertEqual(snapshot.get_signature('/dev/sda'), 'crypto_LUKS')
+        self.assertEqual(snapshot.get_fs_type('/dev/sda'), None)
+        self.assertEqual(snapshot.get_signature('/dev/sda1'), 'ext4')
+        self.assertEqual(snapshot.get_fs_type('/dev/sda1'), 'ext4')
+        # All known devices are probed with a single blkid call
+        self.assertEqual(self.run_data, ["blkid -p -o export -s TYPE -s " +
+                                         "USAGE /dev/sda /dev/sda1"])
+
+        # Unknown devices are probed separately, but only once
+        self.assertEqual(snapshot.get_signature('/tmp/image'), None)
+        self.assertEqual(snapshot.get_signature('/tmp/image'), None)
+        self.assertEqual(len(self.run_data), 2)
+
+        # Invalidated device is probed again, the others are kept
+        snapshot.invalidate_signature('/dev/sda1')
+        self.assertEqual(snapshot.get_signature('/dev/sda'), 'crypto_LUKS')
+        self.assertEqual(len(self.run_data), 2)
+        self.assertEqual(snapshot.get_signature('/dev/sda1'), 'ext4')
+        self.assertEqual(self.run_data[-1], "blkid -p -o export -s TYPE " +
+                                            "-s USAGE /dev/sda1")
+
+    def test_device_numbers(self):
+        resolved = []
+
+        def get_real_device(device):
+            resolved.append(device)
+            return device.replace("/dev/mapper/", "/dev/")
+
+        def get_mounts(regex=None):
+            return {'/dev/sda1': {'dev': '/dev/sda1', 'mp': '/boot',
+                                  'major_minor': '8:1', 'root': '/'},
+                    '/dev/sda1:/home': {'dev': '/dev/sda1', 'mp': '/home',
+                                        'major_minor': '8:1',
+                                        'root': '/home'},
+                    '/dev/sdb': {'dev': '/dev/sdb', 'mp': '/data'}}
+
+        originals = misc.get_real_device, misc.get_mounts
+        misc.get_real_device, misc.get_mounts = get_real_device, get_mounts
+        try:
+            snapshot = misc.SystemSnapshot()
+            # Known device numbers need no name resolution at all
+            self.assertEqual(snapshot.get_real_device('/dev/mapper/boot',
+                                                      '8', '1'), '/dev/sda1')
+            self.assertEqual(snapshot.get_mount('/dev/mapper/boot',
+                                                8, 1)['mp'], '/boot')
+            self.assertEqual(resolved, [])
+
+            # Everything else is resolved only once
+            for i in range(2):
+                self.assertEqual(snapshot.get_real_device('/dev/mapper/sdb',
+                                                          '-1', '-1'),
+                                 '/dev/sdb')
+            self.assertEqual(resolved, ['/dev/mapper/sdb'])
+            self.assertEqual(snapshot.get_mount('/dev/sdb', 8, 16)['mp'],
+                             '/data')
+            self.assertEqual(snapshot.get_mount('/dev/sdc', 8, 32), None)
+
+            snapshot.invalidate_devices()
+            snapshot.get_real_device('/dev/mapper/sdb')
+            self.assertEqual(len(resolved), 2)
+        finally:
+            misc.get_real_device, misc.get_mounts = originals
+
+
+class SysBlockCheck(unittest.TestCase):
+    """
+    Checks that the block devices are read from sysfs.
+    """
+
+    def setUp(self):
+        self.sys_block_dir = misc.SYS_BLOCK_DIR
+        self.directory = tempfile.mkdtemp()
+        misc.SYS_BLOCK_DIR = os.path.join(self.directory, "class", "block")
+        os.makedirs(misc.SYS_BLOCK_DIR)
+        # dm-0 (crypt) on md0 on a partition of sda, loop0 is not used
+        self._addDevice("sda", "8:0", 2048, {'queue/rotational': "1"})
+        self._addDevice("sda/sda1", "8:1", 1024, {'partition': "1"},
+                        holders=["md0"])
+        self._addDevice("md0", "9:0", 1000, slaves=["sda1"],
+                        holders=["dm-0"])
+        self._addDevice("dm-0", "253:0", 996, {'dm/name': "secret",
+                                              'dm/uuid': "CRYPT-LUKS2-1"},
+                        slaves=["md0"])
+        self._addDevice("loop0", "7:0", 0)
+        self._addDevice("ram0", "1:0", 8192)
+
+    def tearDown(self):
+        misc.SYS_BLOCK_DIR = self.sys_block_dir
+        shutil.rmtree(self.directory)
+
+    def _addDevice(self, path, number, sectors, files=None, holders=(),
+                   slaves=()):
+        device = os.path.join(self.directory, "devices", path)
+        files = dict(files or {})
+        files['dev'] = number
+        files['size'] = str(sectors)
+        for name, value in files.items():
+            if not os.path.isdir(os.path.dirname(os.path.join(device, name))):
+                os.makedirs(os.path.dirname(os.path.join(device, name)))
+            with open(os.path.join(device, name), "w") as f:
+                f.write(value + "\n")
+        for kind, names in [('holders', holders), ('slaves', slaves)]:
+            os.makedirs(os.path.join(device, kind))
+            for name in names:
+                os.symlink("../../" + name, os.path.join(device, kind, name))
+        os.symlink(os.path.relpath(device, misc.SYS_BLOCK_DIR),
+                   os.path.join(misc.SYS_BLOCK_DIR, os.path.basename(path)))
+
+    def test_devices(self):
+        devices = dict([(dev.kname, dev) for dev in misc.get_partitions()])
+        self.assertEqual(sorted(devices), ['/dev/dm-0', '/dev/md0',
+                                           '/dev/sda', '/dev/sda1'])
+        self.assertEqual(list(devices['/dev/sda1'][:6]),
+                         ['8', '1', 512, '/dev/sda1', '/dev/sda1', '/dev/sda'])
+        self.assertTrue(devices['/dev/sda1'].partition)
+        self.assertTrue(devices['/dev/sda1'].rotational)
+        self.assertEqual(devices['/dev/sda1'].holders, ('/dev/md0',))
+        self.assertEqual(devices['/dev/dm-0'].name, '/dev/mapper/secret')
+        self.assertEqual(devices['/dev/dm-0'].parent, '/dev/md0')
+        self.assertEqual(devices['/dev/dm-0'].dm_uuid, 'CRYPT-LUKS2-1')
+
+    def test_stack(self):
+        snapshot = misc.SystemSnapshot()
+        self.assertEqual(snapshot.get_stack('/dev/dm-0'),
+                         ['/dev/md0', '/dev/sda1', '/dev/sda'])
+        self.assertEqual(snapshot.get_stack('/dev/sda'), [])
+
+
+class SuperblockCheck(unittest.TestCase):
+    """
+    Checks that the signatures are found without blkid.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.run_data = []
+        self.run_orig = misc.run
+        misc.run = self.mock_run
+
+    def tearDown(self):
+        misc.run = self.run_orig
+        shutil.rmtree(self.directory)
+
+    def mock_run(self, cmd, *args, **kwargs):
+        self.run_data.append(" ".join(cmd))
+        return (2, "", None)
+
+    def _image(self, name, writes, size=1024 * 1024):
+        path = os.path.join(self.directory, name)
+        with open(path, "wb") as f:
+            f.truncate(size)
+            for offset, data in writes:
+                f.seek(offset)
+                f.write(data)
+        return path
+
+    def _ext(self, compat=0, incompat=0, ro_compat=0):
+        return (1024, b"\0" * 56 + b"\x53\xef" + b"\0" * 34 +
+                struct.pack("<III", compat, incompat, ro_compat))
+
+    def test_detect(self):
+        images = {
+            'ext2': [self._ext(incompat=0x2)],
+            'ext3': [self._ext(compat=0x4, incompat=0x2)],
+            'ext4': [self._ext(compat=0x4, incompat=0x2 | 0x40 | 0x200)],
+            'xfs': [(0, b"XFSB")],
+            'btrfs': [(65536 + 64, b"_BHRfS_M")],
+            'swap': [(4096 - 10, b"SWAPSPACE2")],
+            'crypto_LUKS': [(0, b"LUKS\xba\xbe")],
+            'LVM2_member': [(512, b"LABELONE" + b"\0" * 16 + b"LVM2 001")],
+            'linux_raid_member': [(4096, b"\xfc\x4e\x2b\xa9\1\0\0\0")],
+        }
+        for signature, writes in images.items():
+            path = self._image(signature, writes)
+            self.assertEqual(superblock.detect(path)[0], signature)
+
+        # md 0.90 at the end of the device
+        path = self._image("md090", [(1024 * 1024 - 65536,
+                                      b"\xfc\x4e\x2b\xa9")])
+        self.assertEqual(superblock.detect(path), ('linux_raid_member',
+                                                   'raid'))
+
+        # Nothing, more than one signature, or a missing device is for
+        # blkid to decide
+        self.assertEqual(superblock.detect(self._image("empty", [])), None)
+        self.assertEqual(superblock.detect(self._image(
+            "both", [(0, b"XFSB"), (4096 - 10, b"SWAPSPACE2")])), None)
+        self.assertEqual(superblock.detect(
+            os.path.join(self.directory, "missing")), None)
+
+    def test_usage(self):
+        # 64bit ext4 with 4KiB blocks
+        sb = struct.pack("<6I", 0, 1024, 100, 256, 0, 0) + \
+            struct.pack("<I", 2) + b"\0" * 28 + b"\x53\xef" + b"\0" * 38 + \
+            struct.pack("<I", 0x80) + b"\0" * 236 + \
+            struct.pack("<III", 1, 0, 2)
+        ext4 = self._image("ext4", [(1024, sb)])
+        self.assertEqual(superblock.read_usage(ext4, "ext4"),
+                         {'Block size': 4096,
+                          'Block count': 1024 + (1 << 32),
+                          'Reserved block count': 100,
+                          'Free blocks': 256 + (2 << 32)})
+
+        sb = b"XFSB" + struct.pack(">IQ", 4096, 2621440) + b"\0" * 72 + \
+            struct.pack(">I", 4) + b"\0" * 4 + struct.pack(">I", 2560) + \
+            b"\0" * 44 + struct.pack(">Q", 2588999)
+        xfs = self._image("xfs", [(0, sb)])
+        self.assertEqual(superblock.read_usage(xfs, "xfs"),
+                         {'blocksize': 4096, 'dblocks': 2621440,
+                          'agcount': 4, 'logblocks': 2560,
+                          'fdblocks': 2588999})
+
+        # The superblock has to match the file system asked for
+        self.assertEqual(superblock.read_usage(xfs, "ext4"), None)
+        self.assertEqual(superblock.read_usage(ext4, "xfs"), None)
+        self.assertEqual(superblock.read_usage(xfs, "vfat"), None)
+        self.assertEqual(superblock.read_usage(
+            os.path.join(self.directory, "missing"), "xfs"), None)
+
+    def test_probe(self):
+        xfs = self._image("xfs", [(0, b"XFSB")])
+        empty = self._image("empty", [])
+        self.assertEqual(misc.probe_signatures([xfs, empty]),
+                         {xfs: ('xfs', 'filesystem')})
+        # Only what we do not know is left to blkid
+        self.assertEqual(self.run_data, ["blkid -p -o export -s TYPE -s " +
+                                         "USAGE " + empty])
+        self.assertEqual(misc.get_fs_type(xfs), 'xfs')
+        self.assertEqual(misc.get_signature(xfs, "raid"), None)
+        self.assertEqual(len(self.run_data), 1)
+
+
+class ToolCapabilitiesCheck(unittest.TestCase):
+    """
+    Checks that the tool capabilities are probed only once for a binary.
+    """
+
+    def setUp(self):
+        self.probes = 0
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "capabilities.json")
+        self.binary = os.path.join(self.directory, "tool")
+        with open(self.binary, "w") as f:
+            f.write("#!/bin/sh\n")
+        os.chmod(self.binary, 0o755)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        misc.BINARY_PATHS.pop(self.binary, None)
+
+    def probe(self):
+        self.probes += 1
+        return [1, 2, 3]
+
+    def test_persistent(self):
+        capabilities = misc.ToolCapabilities(self.path)
+        self.assertEqual(capabilities.get(self.binary, 'version', self.probe),
+                         [1, 2, 3])
+        self.assertEqual(capabilities.get(self.binary, 'version', self.probe),
+                         [1, 2, 3])
+        self.assertEqual(capabilities.get(self.binary, 'other'), None)
+        self.assertEqual(self.probes, 1)
+
+        # Another run of ssm reads it from the disk
+        capabilities = misc.ToolCapabilities(self.path)
+        self.assertEqual(capabilities.get(self.binary, 'version', self.probe),
+                         [1, 2, 3])
+        self.assertEqual(self.probes, 1)
+
+        # Upgraded binary is probed again
+        st = os.stat(self.binary)
+        os.utime(self.binary, (st.st_atime, st.st_mtime + 10))
+        capabilities = misc.ToolCapabilities(self.path)
+        capabilities.get(self.binary, 'version', self.probe)
+        self.assertEqual(self.probes, 2)
+
+    def test_failed_probe(self):
+        def failing_probe():
+            self.probes += 1
+            return [0, 0, 0]
+        capabilities = misc.ToolCapabilities(self.path)
+        for _ in range(2):
+            self.assertEqual(capabilities.get(self.binary, 'version',
+                                              failing_probe,
+                                              failed=[0, 0, 0]), [0, 0, 0])
+        # Nothing is remembered, the next time it is probed again
+        self.assertEqual(self.probes, 2)
+        self.assertFalse(os.path.exists(self.path))
+        self.assertEqual(capabilities.get(self.binary, 'version',
+                                          self.probe, failed=[0, 0, 0]),
+                         [1, 2, 3])
+        self.assertEqual(misc.ToolCapabilities(self.path).get(
+            self.binary, 'version'), [1, 2, 3])
+
+    def test_missing_binary(self):
+        capabilities = misc.ToolCapabilities(self.path)
+        capabilities.get('ssm-no-such-binary', 'version', self.probe)
+        capabilities.get('ssm-no-such-binary', 'version', self.probe)
+        self.assertEqual(self.probes, 2)
+        self.assertFalse(os.path.exists(self.path))
+
+
+class DiscoveryCacheCheck(unittest.TestCase):
+    """
+    Checks that the saved discovery results are reused only as long as the
+    system did not change.
+    """
+
+    def setUp(self):
+        self.calls = 0
+        self.directory = tempfile.mkdtemp()
+        self.partitions = os.path.join(self.directory, "partitions")
+        self._write_partitions("8 0 1024 sda\n")
+        self.orig = (misc.SSM_CACHE_DIR, misc.SSM_DISCOVERY_CACHE,
+                     misc.FINGERPRINT_FILES, misc.LVM_BACKUP_DIR)
+        misc.SSM_CACHE_DIR = self.directory
+        misc.SSM_DISCOVERY_CACHE = 60
+        misc.FINGERPRINT_FILES = [self.partitions]
+        misc.LVM_BACKUP_DIR = os.path.join(self.directory, "backup")
+
+    def tearDown(self):
+        (misc.SSM_CACHE_DIR, misc.SSM_DISCOVERY_CACHE,
+         misc.FINGERPRINT_FILES, misc.LVM_BACKUP_DIR) = self.orig
+        misc.new_snapshot()
+        shutil.rmtree(self.directory)
+
+    def _write_partitions(self, data):
+        with open(self.partitions, "w") as f:
+            f.write(data)
+
+    def _discover(self):
+        def read():
+            self.calls += 1
+            return ['/dev/sda']
+        snapshot = misc.load_discovery_cache()
+        value = snapshot.cached('devices', read)
+        misc.save_discovery_cache()
+        return value
+
+    def test_reuse(self):
+        self.assertEqual(self._discover(), ['/dev/sda'])
+        self.assertEqual(self._discover(), ['/dev/sda'])
+        self.assertEqual(self.calls, 1)
+
+    def test_changed_system(self):
+        self._discover()
+        self._write_partitions("8 0 1024 sda\n8 16 1024 sdb\n")
+        self._discover()
+        self.assertEqual(self.calls, 2)
+        # The new state is saved for the next run
+        self._discover()
+        self.assertEqual(self.calls, 2)
+
+    def test_saved_keys(self):
+        snapshot = misc.load_discovery_cache()
+        snapshot.cached('devices', lambda: ['/dev/sda'])
+        snapshot.cached('dm_tables', lambda: [{'name': 'luks',
+                                               'params': 'secret'}])
+        snapshot.cached('fs_infos', lambda: {'/dev/sda': 'usage'})
+        snapshot.cached('lvm_report', lambda: 'usage')
+        misc.save_discovery_cache()
+        self.assertEqual(self._discover(), ['/dev/sda'])
+        self.assertEqual(self.calls, 0)
+        # Neither the keys nor the usage are kept on the disk
+        with open(os.path.join(self.directory, "discovery.cache"), "rb") as f:
+            self.assertNotIn(b"secret", f.read())
+        snapshot = misc.load_discovery_cache()
+        for key in ['dm_tables', 'fs_infos', 'lvm_report']:
+            self.assertNotIn(key, snapshot._data)
+
+    def test_drop(self):
+        self._discover()
+        misc.drop_discovery_cache()
+        self._discover()
+        self.assertEqual(self.calls, 2)
+
+    def test_disabled(self):
+        misc.SSM_DISCOVERY_CACHE = 0
+        self._discover()
+        self._discover()
+        self.assertEqual(self.calls, 2)
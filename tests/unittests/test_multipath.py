@@ -101,7 +101,10 @@ class MultipathFunctionCheck(MockSystemDataSource):
                 if mp_vol != None and mp_vol != mp_name:
                     continue
                 mp_id="XX360000000000000000e0000000"+chr(ord('a')+counter)
-                output += "{name} ({id}) {dev} QEMU    ,QEMU HARDDISK \n".format(name=mp_name, id=mp_id, dev=basename(v_data['real_dev']))
+                # maps named by their wwid or by an alias
+                header = v_data.get('mp_header',
+                                    "{0} ({1})".format(mp_name, mp_id))
+                output += "{header} {dev} QEMU    ,QEMU HARDDISK \n".format(header=header, dev=basename(v_data['real_dev']))
                 output += "size={0} features='0' hwhandler='0' wp=rw\n".format(size_converted)
 
                 devs = []
@@ -154,6 +157,50 @@ class MultipathFunctionCheck(MockSystemDataSource):
         self.assertEqual(vdata['dev_name'], '/dev/dm-90')
         self.assertEqual(vdata['nodes'], ['/dev/sda','/dev/sdb'])
 
+    def test_mp_wwid_and_alias(self):
+        self.createMP("dm-92", "3600a0b80001", 1048576, ["sdg"])
+        self.vol_data['/dev/mapper/3600a0b80001']['mp_header'] = \
+            "3600a0b80001"
+        self.createMP("dm-93", "mydata", 2097152, ["sdh"])
+        self.vol_data['/dev/mapper/mydata']['mp_header'] = \
+            "mydata (3600a0b80002)"
+        mp = MultipathDevice(options=self._options)
+        self.assertEqual(mp.get_real_device("3600a0b80001"), "/dev/dm-92")
+        self.assertEqual(mp.get_real_device("mydata"), "/dev/dm-93")
+
+        vdata = mp.get_volume_data("3600a0b80001")
+        self.assertEqual(vdata['dev_name'], '/dev/dm-92')
+        self.assertEqual(vdata['wwid'], '3600a0b80001')
+        self.assertEqual(vdata['nodes'], ['/dev/sdg'])
+        vdata = mp.get_volume_data("mydata")
+        self.assertEqual(vdata['dev_name'], '/dev/dm-93')
+        self.assertEqual(vdata['wwid'], '3600a0b80002')
+        self.assertEqual(vdata['nodes'], ['/dev/sdh'])
+        self.assertEqual(mp['/dev/sdh']['pool_name'], '/dev/dm-93')
+
+        self._stdout = sys.stdout
+        sys.stdout = self._stringio = StringIO()
+        try:
+            main.main("ssm list dev")
+        finally:
+            sys.stdout = self._stdout
+        devices = [line.split()[0] for line in
+                   self._stringio.getvalue().splitlines()
+                   if line.startswith("/dev/")]
+        self.assertIn('/dev/dm-92', devices)
+        self.assertIn('/dev/dm-93', devices)
+
+    def test_mp_single_call(self):
+        self._stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            main.main("ssm list dev")
+        finally:
+            sys.stdout = self._stdout
+        # All maps and their paths come from one multipath call
+        mp_calls = [cmd for cmd in self.run_data if cmd.startswith("multipath")]
+        self.assertEqual(mp_calls, ["multipath -ll"])
+
     def test_mp_forbidden_ops(self):
         self.assertRaises(problem.SsmError, main.main, "ssm remove /dev/mapper/mpatha")
         self.assertRaises(problem.SsmError, main.main, "ssm remove /dev/dm-90")
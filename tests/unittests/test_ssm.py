@@ -28,6 +28,7 @@ import argparse
 from ssmlib import main
 from ssmlib import misc
 from ssmlib import problem
+from ssmlib import backends
 
 from tests.unittests.common import *
 
@@ -163,6 +164,59 @@ class StorageHandleSanityCheck(BaseStorageHandleInit):
                 self.assertTrue(item.options.debug)
                 self.assertEqual(item.options.config, "my_config")
 
+    def test_enabled_backends(self):
+        enabled_orig = backends.SSM_BACKENDS
+        default_orig = main.SSM_DEFAULT_BACKEND
+        backends.SSM_BACKENDS = ['lvm', 'crypt']
+        # Other tests might have chosen a backend which is not enabled here
+        main.SSM_DEFAULT_BACKEND = 'lvm'
+        try:
+            self.assertEqual(
+                [name for name, _, _ in backends.get_backends('pool')],
+                ['lvm', 'thin', 'crypt'])
+            self.assertEqual(
+                [name for name, _, _ in backends.get_backends('snap')],
+                ['lvm'])
+            self.storage.reinit_pool()
+            self.assertEqual(sorted(self.storage.pool._data.keys()),
+                             ['crypt', 'lvm', 'thin'])
+        finally:
+            backends.SSM_BACKENDS = enabled_orig
+            main.SSM_DEFAULT_BACKEND = default_orig
+
+    def test_discover(self):
+        class Slow(object):
+            def __init__(self, options):
+                time.sleep(0.1)
+
+        class Broken(object):
+            def __init__(self, options):
+                raise RuntimeError("broken tool")
+
+        class Fast(object):
+            def __init__(self, options):
+                pass
+
+        warnings = []
+        warn = main.PR.warn
+        main.PR.warn = warnings.append
+        try:
+            found = self.storage.pool._discover(
+                [('slow', Slow, 'slow pools'),
+                 ('broken', Broken, 'broken pools'),
+                 ('fast', Fast, 'fast pools')])
+        finally:
+            main.PR.warn = warn
+        # The slow backend finishes last but keeps its place, the broken one
+        # does not stop the others
+        self.assertEqual([name for name, _ in found], ['slow', 'fast'])
+        self.assertTrue(isinstance(found[0][1], Slow))
+        self.assertTrue(isinstance(found[1][1], Fast))
+        self.assertEqual(len(warnings), 2)
+        self.assertEqual(str(warnings[0]), "broken tool")
+        self.assertEqual(warnings[1],
+                         "Can not get information about broken pools")
+
     def test_set_globals_propagation(self):
         options = main.Options()
         options.force = False
@@ -786,6 +840,40 @@ class SsmFunctionCheck(MockSystemDataSource):
             ['--size 1G', '--name test' ,'/mnt/test'],
             "vol snapshot /dev/default_pool/vol004 test 1048576.0")
 
+    def test_partitions(self):
+        rows = [['8', '0', 2097152, '/dev/sda', '/dev/sda'],
+                ['8', '1', 1048576, '/dev/sda1', '/dev/sda1', '/dev/sda'],
+                ['8', '2', 1048576, '/dev/sda2', '/dev/sda2', '/dev/sda'],
+                ['259', '0', 2097152, '/dev/nvme0n1', '/dev/nvme0n1'],
+                ['259', '1', 2097152, '/dev/nvme0n1p1', '/dev/nvme0n1p1',
+                 '/dev/nvme0n1'],
+                ['253', '1', 1048576, '/dev/dm-1', '/dev/mapper/a',
+                 '/dev/sda2'],
+                ['253', '11', 1048576, '/dev/dm-11', '/dev/mapper/c',
+                 '/dev/nvme0n1p1'],
+                # LVM on LUKS, the volume is on a lower numbered dm device
+                ['253', '10', 1048576, '/dev/dm-10', '/dev/mapper/b',
+                 '/dev/dm-1'],
+                # Partition known from sysfs with a name the kernel did not
+                # make up
+                misc.BlockDevice('253', '12', 1048576, '/dev/dm-12',
+                                 '/dev/mapper/ap1', '/dev/dm-1', True)]
+        misc.get_partitions = lambda: rows
+        misc.new_snapshot()
+        data = main.DeviceInfo(options=main.Options()).data
+        self.assertEqual(data['/dev/sda']['partitioned'], 2)
+        self.assertEqual(data['/dev/sda']['mount'], 'PARTITIONED')
+        self.assertEqual(data['/dev/sda1']['type'], 'part')
+        self.assertEqual(data['/dev/nvme0n1']['partitioned'], 1)
+        self.assertEqual(data['/dev/nvme0n1p1']['type'], 'part')
+        # Device mapper devices on top of partitions are not partitions
+        for name in ['/dev/dm-10', '/dev/dm-11']:
+            self.assertEqual(data[name]['partitioned'], 0)
+            self.assertTrue('partition' not in data[name])
+        # /dev/dm-10 is not a partition of /dev/dm-1, /dev/dm-12 is
+        self.assertEqual(data['/dev/dm-1']['partitioned'], 1)
+        self.assertEqual(data['/dev/dm-12']['type'], 'part')
+
     def test_mount(self):
         self._addDir("/mnt/test")
         self._addDir("/mnt/test1")